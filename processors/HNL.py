@@ -34,6 +34,9 @@ parser.add_argument('--overwrite_pu', action='store', default=None)
 parser.add_argument('--leptons', dest='leptons', type=int, default=2, choices=[1,2])                     
 parser.add_argument('--input', dest='inputFiles', action='append', default=[])
 parser.add_argument('--cutflow', dest='cutflow', action='store_true', default=False)
+parser.add_argument('--timing', dest='timing', action='store_true', default=False)
+parser.add_argument('--schedule', dest='schedule', action='store_true', default=False)
+parser.add_argument('--lazy', dest='lazy', action='store_true', default=False)
 
 parser.add_argument('output', nargs=1)
 
@@ -632,7 +635,10 @@ p = PostProcessor(
     maxEvents=-1,
     friend=True,
     cut="((nElectron+nMuon)>0)", #remove if doing cutflow
-    cutFlow=args.cutflow
+    cutFlow=args.cutflow,
+    moduleTiming=args.timing,
+    schedule=args.schedule,
+    lazy=args.lazy
 )
 
 p.run()
@@ -27,6 +27,7 @@ parser.add_argument('--notrigger', dest='notrigger',
 parser.add_argument('--overwrite_pu', action='store', default=None)                    
 parser.add_argument('--input', dest='inputFiles', action='append', default=[])
 parser.add_argument('--cutflow', dest='cutflow', action='store_true', default=False)
+parser.add_argument('--timing', dest='timing', action='store_true', default=False)
 
 parser.add_argument('output', nargs=1)
 
@@ -402,7 +403,8 @@ p = PostProcessor(
     maxEvents=-1,
     friend=True,
     cut="((nElectron+nMuon)>2)", #remove if doing cutflow
-    cutFlow=args.cutflow
+    cutFlow=args.cutflow,
+    moduleTiming=args.timing
 )
 
 p.run()
@@ -89,7 +89,7 @@ yields = "${CMSSW_BASE}/src/PhysicsTools/NanoAODTools/data/da/"+str(year)+"/even
 
 
 leptonSelection = [
-    EventSkim(selection=lambda event: event.nTrigObj > 0),
+    EventSkim(selection_expr="nTrigObj > 0"),
     MuonSelection(
         outputName="tightMuon",
         storeKinematics=['pt', 'eta', 'dxy', 'dxyErr', 'dz',
@@ -239,7 +239,8 @@ p = PostProcessor(
     cut="(nJet<5)&&(nJet>0)&&((nElectron+nMuon)>0)",
     modules=analyzerChain,
     maxEvents=-1,
-    friend=False
+    friend=False,
+    pushdownSkims=True
 )
 
 p.run()
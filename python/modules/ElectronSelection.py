@@ -8,6 +8,7 @@ import numpy as np
 
 from PhysicsTools.NanoAODTools.postprocessing.framework.datamodel import Collection
 from PhysicsTools.NanoAODTools.postprocessing.framework.eventloop import Module
+from PhysicsTools.NanoAODTools.postprocessing.framework.scheduler import functionReads
 
 from utils import getHist, getSFXY, deltaR
 
@@ -85,6 +86,11 @@ class ElectronSelection(Module):
               ]
         self.inputCollection = inputCollection
         self.outputName = outputName
+
+        inputs = functionReads(inputCollection)
+        if inputs is not None:
+            self.consumes = sorted(inputs) + ["nMuon", "Muon_*"]
+            self.produces = [outputName, outputName+"_unselected", "n"+outputName, outputName+"_*"]
         self.electronMinPt = electronMinPt
         self.electronMaxEta = electronMaxEta
         self.electronIPCuts = electronIPCuts
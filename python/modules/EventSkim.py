@@ -7,13 +7,33 @@ import random
 
 from PhysicsTools.NanoAODTools.postprocessing.framework.datamodel import Collection
 from PhysicsTools.NanoAODTools.postprocessing.framework.eventloop import Module
+from PhysicsTools.NanoAODTools.postprocessing.framework.expressions import compileExpression
+from PhysicsTools.NanoAODTools.postprocessing.framework.scheduler import functionReads
 
 
 class EventSkim(Module):
-    def __init__(self, selection=lambda event: True, outputName=None, store=False):
+    def __init__(self, selection=lambda event: True, outputName=None, store=False, selection_expr=None, consumes=None):
+        """The selection is either a function of the event, or a cut in the TTree::Draw syntax (selection_expr),
+           which is also evaluated in bulk in the chunked event loop.
+           What the selection reads (consumes) is found from the expression or the function, unless given."""
         self.selection = selection
         self.outputName = outputName
         self.store = store
+        self.selection_expr = selection_expr
+        if selection_expr is not None:
+            self.expr = compileExpression(selection_expr)
+            self.selection = self.expr.selectEvent
+            self.inputBranches = self.expr.branches
+            self.analyzeChunk = self._analyzeChunk
+            # only pushed into the preselection where TTree::Draw is known to select the same entries: indexes
+            # out of range are handled alike for constant indexes, not for those read from branches
+            if not (outputName is not None and store) and not self.expr.variableIndexes:
+                self.rawSelection = selection_expr
+        if consumes is None:
+            consumes = self.expr.branches if selection_expr is not None else functionReads(selection)
+        if consumes is not None:
+            self.consumes = sorted(consumes)
+            self.produces = [outputName] if (outputName is not None and store) else []
 
     def beginJob(self):
         pass
@@ -35,4 +55,11 @@ class EventSkim(Module):
             return True
 
         else:
-            return self.selection(event)
\ No newline at end of file
+            return self.selection(event)
+
+    def _analyzeChunk(self, chunk):
+        mask = self.expr.selectChunk(chunk)
+        if self.outputName is not None and self.store:
+            self.out.fillColumn(self.outputName, mask.astype('i4'))
+            return None
+        return mask
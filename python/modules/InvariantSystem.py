@@ -5,13 +5,16 @@ import json
 import ROOT
 import random
 
+import utils
 from utils import deltaPhi, deltaR
 
 from PhysicsTools.NanoAODTools.postprocessing.framework.datamodel import Collection
 from PhysicsTools.NanoAODTools.postprocessing.framework.eventloop import Module
+from PhysicsTools.NanoAODTools.postprocessing.framework.modulecache import sourceHash
 
 
 class InvariantSystem(Module):
+    cacheable = True
     def __init__(
         self,
         inputCollection=lambda event: Collection(event, "Muon"),
@@ -22,6 +25,10 @@ class InvariantSystem(Module):
         self.outputName = outputName
         self.globalOptions = globalOptions
 
+    def cacheConfig(self):
+        """configuration for the module output cache: also the utils helpers"""
+        return (self._constructorArgs, sourceHash(utils))
+
     def beginJob(self):
         pass
 
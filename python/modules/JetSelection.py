@@ -5,8 +5,9 @@ import json
 import ROOT
 import random
 
-from PhysicsTools.NanoAODTools.postprocessing.framework.datamodel import Collection
+from PhysicsTools.NanoAODTools.postprocessing.framework.datamodel import Collection, ArrayCollection
 from PhysicsTools.NanoAODTools.postprocessing.framework.eventloop import Module
+from PhysicsTools.NanoAODTools.postprocessing.framework.scheduler import functionReads
 
 from utils import deltaR, deltaPhi
 
@@ -52,6 +53,11 @@ class JetSelection(Module):
         self.flagDA = flagDA
         self.storeKinematics = storeKinematics
         self.globalFeatures = globalFeatures
+
+        inputs = [functionReads(f) for f in (inputCollection, leptonCollectionDRCleaning, leptonCollectionP4Subraction)]
+        if None not in inputs:
+            self.consumes = sorted(set.union(*inputs)) + ["nJet", "nglobal", "global_*"]
+            self.produces = [outputName, outputName+"_unselected", "n"+outputName, outputName+"_*"] + (["Jet_forDA"] if flagDA else [])
         if jetId==JetSelection.LOOSE and (globalOptions["year"] == 2017 or globalOptions["year"] == 2018):
             self.jetId = JetSelection.TIGHT
         else:
@@ -80,8 +86,8 @@ class JetSelection(Module):
 
         jets = self.inputCollection(event)
         
-        jetglobal = Collection(event, "global")
-        jetglobal_indices = [global_jet.jetIdx for global_jet in jetglobal]
+        jetglobal = ArrayCollection(event, "global")
+        jetglobal_indices = jetglobal.values("jetIdx")
         
         selectedJets = []
         unselectedJets = []
@@ -12,7 +12,6 @@ from utils import deltaR, getCtauLabel
 
 
 class JetTaggerResult(Module):
-
     def __init__(
         self,
         inputCollection="selectedJets_nominal",
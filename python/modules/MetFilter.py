@@ -9,9 +9,16 @@ from PhysicsTools.NanoAODTools.postprocessing.framework.datamodel import Collect
 from PhysicsTools.NanoAODTools.postprocessing.framework.eventloop import Module
 
 class MetFilter(Module):
+    inputBranches = [
+        "Flag_goodVertices", "Flag_globalSuperTightHalo2016Filter", "Flag_HBHENoiseFilter", "Flag_HBHENoiseIsoFilter",
+        "Flag_EcalDeadCellTriggerPrimitiveFilter", "Flag_BadPFMuonFilter", "Flag_eeBadScFilter"
+    ]
     def __init__(self,globalOptions={"isData":False}, outputName=None):
         self.globalOptions=globalOptions
         self.outputName=outputName
+        if self.outputName is None:
+            flags = self.inputBranches if self.globalOptions["isData"] else [f for f in self.inputBranches if f != "Flag_eeBadScFilter"]
+            self.rawSelection = " && ".join(flags)
         
     def beginJob(self):
         pass
@@ -8,6 +8,7 @@ import numpy as np
 
 from PhysicsTools.NanoAODTools.postprocessing.framework.datamodel import Collection
 from PhysicsTools.NanoAODTools.postprocessing.framework.eventloop import Module
+from PhysicsTools.NanoAODTools.postprocessing.framework.scheduler import functionReads
 
 from utils import getGraph, getHist, getHistCanvas, combineHist2D, getSFXY, deltaR
 
@@ -46,6 +47,11 @@ class MuonSelection(Module):
         self.selectLeadingOnly = selectLeadingOnly
         self.muonID=muonID
 
+        inputs = functionReads(inputCollection)
+        if inputs is not None:
+            self.consumes = sorted(inputs)
+            self.produces = [outputName, outputName+"_unselected", "n"+outputName, outputName+"_*"]
+
         if muonID==MuonSelection.MEDIUM or muonIso==MuonSelection.MEDIUM:
             print("Unsupported ID or ISO")
             sys.exit(1)
@@ -10,6 +10,7 @@ from PhysicsTools.NanoAODTools.postprocessing.framework.datamodel import Collect
 from PhysicsTools.NanoAODTools.postprocessing.framework.eventloop import Module
 
 class ScaleUncertainty(Module):
+    cacheable = True
     def __init__(
         self,
         xsecs,
@@ -7,10 +7,13 @@ import random
 
 from PhysicsTools.NanoAODTools.postprocessing.framework.datamodel import Collection
 from PhysicsTools.NanoAODTools.postprocessing.framework.eventloop import Module
+from PhysicsTools.NanoAODTools.postprocessing.framework.modulecache import sourceHash
 
+import utils
 from utils import getHist,combineHist2D,getSFXY
 
 class SingleElectronTriggerSelection(Module):
+    cacheable = True
     def __init__(
         self,
         inputCollection = lambda event: getattr(event,"tightElectron"),
@@ -61,6 +64,10 @@ class SingleElectronTriggerSelection(Module):
         '''
 
             
+    def cacheConfig(self):
+        """configuration for the module output cache: also the utils helpers (no scale factor file is read for now)"""
+        return (self._constructorArgs, sourceHash(utils))
+
     def beginJob(self):
         pass
         
@@ -7,10 +7,13 @@ import random
 
 from PhysicsTools.NanoAODTools.postprocessing.framework.datamodel import Collection
 from PhysicsTools.NanoAODTools.postprocessing.framework.eventloop import Module
+from PhysicsTools.NanoAODTools.postprocessing.framework.modulecache import fileHash, sourceHash
 
+import utils
 from utils import getHist,combineHist2D,getSFXY
 
 class SingleMuonTriggerSelection(Module):
+    cacheable = True
     def __init__(
         self,
         inputCollection = lambda event: getattr(event,"tightMuons"),
@@ -22,15 +25,16 @@ class SingleMuonTriggerSelection(Module):
         self.inputCollection = inputCollection
         self.outputName = outputName
         self.storeWeights = storeWeights
+        self.sfFiles = []
 
         if not self.globalOptions["isData"]:
             if self.globalOptions["year"] == 2016:
 
-                triggerSFBToF = getHist(
+                triggerSFBToF = self.getHist(
                     "PhysicsTools/NanoAODTools/data/muon/2016_trigger/EfficienciesAndSF_RunBtoF.root",
                     "IsoMu24_OR_IsoTkMu24_PtEtaBins/pt_abseta_ratio"
                 )
-                triggerSFGToH = getHist(
+                triggerSFGToH = self.getHist(
                     "PhysicsTools/NanoAODTools/data/muon/2016_trigger/EfficienciesAndSF_RunGtoH.root",
                     "IsoMu24_OR_IsoTkMu24_PtEtaBins/pt_abseta_ratio"
                 )
@@ -43,14 +47,14 @@ class SingleMuonTriggerSelection(Module):
 
             elif self.globalOptions["year"] == 2017:
 
-                self.triggerSFHist = getHist(
+                self.triggerSFHist = self.getHist(
                     "PhysicsTools/NanoAODTools/data/muon/2017_trigger/EfficienciesAndSF_RunBtoF_Nov17Nov2017.root",
                     "IsoMu27_PtEtaBins/pt_abseta_ratio"
                 )
    
             elif self.globalOptions["year"] == 2018:
 
-                self.triggerSFHist = getHist(
+                self.triggerSFHist = self.getHist(
                     "PhysicsTools/NanoAODTools/data/muon/2018_trigger/EfficienciesAndSF_2018Data_AfterMuonHLTUpdate.root",
                     "IsoMu24_PtEtaBins/pt_abseta_ratio"
                 )
@@ -59,6 +63,14 @@ class SingleMuonTriggerSelection(Module):
                 sys.exit(1)
 
             
+    def getHist(self, relFileName, histName):
+        self.sfFiles.append(os.path.expandvars("$CMSSW_BASE/src/"+relFileName))
+        return getHist(relFileName, histName)
+
+    def cacheConfig(self):
+        """configuration for the module output cache: also the content of the scale factor files and of the utils helpers"""
+        return (self._constructorArgs, map(fileHash, self.sfFiles), sourceHash(utils))
+
     def beginJob(self):
         pass
         
@@ -0,0 +1,86 @@
+import time
+
+from PhysicsTools.NanoAODTools.postprocessing.framework.eventloop import Module, moduleLabel
+
+
+class SkimGroup(Module):
+    def __init__(self, skims, warmup=1000, outputName=None):
+        """Skims (e.g. EventSkims) that can be applied in any order, run cheapest and most rejecting first.
+
+           Over the first warmup events all the skims are evaluated, measuring the time per call and the rejection
+           rate of each. The group is then ordered by ascending cost/rejection, which minimises the expected time
+           per event for independent skims, and stops at the first skim rejecting the event. The ordering and the
+           estimated saving are printed with the cutflow."""
+        for skim in skims:
+            if getattr(skim, 'store', False) and getattr(skim, 'outputName', None) is not None:
+                raise RuntimeError("%s stores its decision and accepts all events, it can not be part of a SkimGroup" % moduleLabel(skim))
+        self.skims = list(skims)
+        self.order = list(skims)
+        self.warmup = warmup
+        self.outputName = outputName
+        self.calls = 0
+        self.callTime = [0.]*len(skims)
+        self.passed = [0]*len(skims)
+        self.inputBranches = sum((getattr(skim, 'inputBranches', []) for skim in skims), [])
+        if all(getattr(skim, 'rawSelection', None) for skim in skims):
+            self.rawSelection = " && ".join("(%s)" % skim.rawSelection for skim in skims)
+        if all(getattr(skim, 'consumes', None) is not None for skim in skims):
+            self.consumes = sorted(set(sum((list(skim.consumes) for skim in skims), [])))
+            self.produces = []
+
+    def beginJob(self):
+        for skim in self.skims:
+            skim.beginJob()
+
+    def endJob(self):
+        for skim in self.skims:
+            skim.endJob()
+
+    def beginFile(self, inputFile, outputFile, inputTree, wrappedOutputTree):
+        for skim in self.skims:
+            skim.beginFile(inputFile, outputFile, inputTree, wrappedOutputTree)
+
+    def endFile(self, inputFile, outputFile, inputTree, wrappedOutputTree):
+        for skim in self.skims:
+            skim.endFile(inputFile, outputFile, inputTree, wrappedOutputTree)
+
+    def analyze(self, event):
+        if self.calls >= self.warmup:
+            for skim in self.order:
+                if not skim.analyze(event): return False
+            return True
+        ret = True
+        for i, skim in enumerate(self.skims):
+            t0 = time.time()
+            passed = skim.analyze(event)
+            self.callTime[i] += time.time() - t0
+            if passed: self.passed[i] += 1
+            else: ret = False
+        self.calls += 1
+        if self.calls == self.warmup: self.order = [self.skims[i] for i in self._bestOrder()]
+        return ret
+
+    def cutflowSummary(self):
+        """Measured cost and acceptance of the skims, their order and the estimated time saved per event"""
+        if self.calls == 0: return "%s: no events processed" % moduleLabel(self)
+        lines = ["%s: order measured over %d events (time per call, acceptance):" % (moduleLabel(self), self.calls)]
+        for i in self._bestOrder() if self.calls >= self.warmup else xrange(len(self.skims)):
+            lines.append("  %-30s %8.2f us %6.2f%%" % (moduleLabel(self.skims[i]), 1e6*self.callTime[i]/self.calls, 100.*self.passed[i]/self.calls))
+        before = self._expectedTime(range(len(self.skims)))
+        after = self._expectedTime(self._bestOrder())
+        lines.append("  estimated time per event %.2f us instead of %.2f us in the given order (%.1f%% saved)" % (1e6*after, 1e6*before, 100.*(before-after)/before if before > 0 else 0.))
+        return "\n".join(lines)
+
+    def _bestOrder(self):
+        def ratio(i):
+            rejection = 1. - self.passed[i]/float(self.calls)
+            return self.callTime[i]/rejection if rejection > 0 else float("inf")
+        return sorted(xrange(len(self.skims)), key=lambda i: (ratio(i), i))
+
+    def _expectedTime(self, order):
+        """Expected time per event running the skims in order until the first rejection, assuming they are independent"""
+        expected, reached = 0., 1.
+        for i in order:
+            expected += reached*self.callTime[i]/self.calls
+            reached *= self.passed[i]/float(self.calls)
+        return expected
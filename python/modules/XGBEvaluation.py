@@ -4,8 +4,10 @@ import numpy as np
 from xgboost import XGBClassifier, Booster, DMatrix
 from PhysicsTools.NanoAODTools.postprocessing.framework.datamodel import Collection
 from PhysicsTools.NanoAODTools.postprocessing.framework.eventloop import Module
+from PhysicsTools.NanoAODTools.postprocessing.framework.modulecache import fileHash
 
 class XGBEvaluation(Module):
+    cacheable = True
     def __init__(
         self,
         modelPath="${CMSSW_BASE}/src/PhysicsTools/NanoAODTools/data/bdt/201117/nominal/bdt_2016.model",
@@ -18,15 +20,20 @@ class XGBEvaluation(Module):
         print "---","BDT model: ",self.modelPath
         self.systematics = systematics
         self.outputName = outputName
+        self.inputFeatures = os.path.expandvars(inputFeatures)
         
         feature_dict_module = imp.load_source(
             'features',
-            os.path.expandvars(inputFeatures)
+            self.inputFeatures
         )
         self.features = feature_dict_module.features
         print "[%i]"%len(self.features)," BDT features: ",map(lambda x: x[0],self.features)
        
 
+    def cacheConfig(self):
+        """configuration for the module output cache: also the content of the model and of the features file"""
+        return (self._constructorArgs, fileHash(self.modelPath), fileHash(self.inputFeatures))
+
     def beginJob(self):
         pass
         
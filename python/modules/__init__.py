@@ -14,6 +14,7 @@ from JetSelection import JetSelection
 from TaggerEvaluation import TaggerEvaluation
 from TaggerEvaluationProfiled import TaggerEvaluationProfiled
 from EventSkim import EventSkim
+from SkimGroup import SkimGroup
 from EventObservables import EventObservables
 from MetFilter import MetFilter
 from PileupWeight import PileupWeight
@@ -0,0 +1,66 @@
+import json
+
+class BranchTracer:
+    """Records the input branches read by each module, through readBranch, arrayReader, valueReader, Event.eval and chunk columns.
+
+       The event loop sets current to the label of the module being run; reads done outside of modules
+       (e.g. by the framework) are recorded under None. Values cached by an Object or Collection are
+       only attributed to the module that read them first, but the union over all modules is complete.
+    """
+    def __init__(self):
+        self.current = None
+        self.reads = {}
+        self._branchInfo = {}
+    def record(self, branchName):
+        reads = self.reads.get(self.current)
+        if reads is None:
+            reads = self.reads[self.current] = set()
+        reads.add(branchName)
+    def attach(self, tree):
+        """Start recording the reads from tree (an InputTree)"""
+        tree._branchTracer = self
+    def detach(self, tree):
+        """Stop recording the reads from tree, looking up the branches read so far in it"""
+        tree._branchTracer = None
+        for name in self.allBranches():
+            if name not in self._branchInfo:
+                self._branchInfo[name] = _branchInfo(tree, name)
+    def allBranches(self):
+        ret = set()
+        for reads in self.reads.itervalues():
+            ret.update(reads)
+        return ret
+    def neededBranches(self):
+        """All the existing branches that were read, plus the counters of the variable-length arrays among them"""
+        ret = set()
+        for name in self.allBranches():
+            (exists, countBranch) = self._branchInfo.get(name, (True, None))
+            if exists: ret.add(name)
+            if countBranch: ret.add(countBranch)
+        return ret
+    def writeBranchSelection(self, fileName):
+        """Write a keep/drop file (as read by BranchSelection) keeping only the branches that were read"""
+        out = open(fileName, 'w')
+        out.write("# branches read by the modules, as recorded by BranchTracer\n")
+        out.write("drop *\n")
+        for name in sorted(self.neededBranches()):
+            out.write("keep %s\n" % name)
+        out.close()
+    def writeModuleReads(self, fileName):
+        """Write as JSON the sorted list of branches read by each module"""
+        out = open(fileName, 'w')
+        json.dump(dict((str(label), sorted(reads)) for (label, reads) in self.reads.iteritems()), out, indent=2, sort_keys=True)
+        out.close()
+
+
+
+####### PRIVATE IMPLEMENTATION PART #######
+
+def _branchInfo(tree, name):
+    """Return (whether name is a branch of tree, name of its counter branch if it is a variable-length array)"""
+    branch = tree.GetBranch(name)
+    if not branch: return (False, None)
+    leaf = branch.GetLeaf(name)
+    if leaf and bool(leaf.GetLeafCount()):
+        return (True, leaf.GetLeafCount().GetName())
+    return (True, None)
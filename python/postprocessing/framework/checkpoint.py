@@ -0,0 +1,65 @@
+import os
+import json
+import hashlib
+import ROOT
+ROOT.PyConfig.IgnoreCommandLineOptions = True
+
+class Checkpoint:
+    """Journal of the completed steps of a PostProcessor job, to resume it after it was killed.
+
+       Steps (the processing of an input file or of an entry range of it, and the final hadd) are recorded with their
+       output file and number of entries once they are complete. A restarted job with the same configuration skips the
+       steps whose output is still valid (readable, not recovered, with the recorded number of entries in treeName).
+       The journal is rewritten atomically after every step.
+    """
+    def __init__(self, fileName, config, treeName="Events"):
+        self.fileName = fileName
+        self.fingerprint = hashlib.sha1(json.dumps(config, sort_keys=True)).hexdigest()
+        self.treeName = treeName
+        self.steps = {}
+        self.info = {}
+        if os.path.exists(fileName):
+            journal = json.load(open(fileName))
+            if journal.get("fingerprint") == self.fingerprint:
+                self.steps = journal["steps"]
+                self.info = journal.get("info", {})
+                print "Resuming from checkpoint %s: %d steps already done" % (fileName, len(self.steps))
+            else:
+                print "Ignoring checkpoint %s, written by a job with a different configuration" % fileName
+    def completed(self, key):
+        """Return the record of step key if it was completed and its output is still valid, else None"""
+        record = self.steps.get(key)
+        if record is None: return None
+        if record["outFileName"] and not validOutput(record["outFileName"], record["entries"], self.treeName):
+            print "Output %s of %s is not valid, processing it again" % (record["outFileName"], key)
+            del self.steps[key]
+            return None
+        return record
+    def record(self, key, outFileName, **info):
+        """Record step key as completed, with output outFileName (or None) and any JSON-serializable info"""
+        entries = outputEntries(outFileName, self.treeName) if outFileName else None
+        record = dict(info)
+        record["outFileName"] = outFileName
+        record["entries"] = entries
+        self.steps[key] = record
+        self.save()
+    def save(self):
+        tmpName = "%s.tmp%d" % (self.fileName, os.getpid())
+        out = open(tmpName, 'w')
+        json.dump({"fingerprint": self.fingerprint, "steps": self.steps, "info": self.info}, out, indent=1)
+        out.close()
+        os.rename(tmpName, self.fileName)
+
+def outputEntries(fileName, treeName="Events"):
+    """Number of entries of treeName in fileName, or None if the file can not be read"""
+    if not os.path.exists(fileName): return None
+    f = ROOT.TFile.Open(fileName)
+    if not f or f.IsZombie() or f.TestBit(ROOT.TFile.kRecovered):
+        return None
+    tree = f.Get(treeName)
+    entries = tree.GetEntries() if tree else None
+    f.Close()
+    return entries
+
+def validOutput(fileName, entries, treeName="Events"):
+    return entries is not None and outputEntries(fileName, treeName) == entries
@@ -0,0 +1,268 @@
+from PhysicsTools.NanoAODTools.postprocessing.framework.datamodel import Event
+from PhysicsTools.NanoAODTools.postprocessing.framework.eventloop import moduleLabels, declareInputBranches
+from PhysicsTools.NanoAODTools.postprocessing.framework.treeReaderArrayTools import clearExtraBranches, readerStatistics
+from PhysicsTools.NanoAODTools.postprocessing.framework.output import OutputTree
+from PhysicsTools.NanoAODTools.postprocessing.framework.columns import JaggedColumn, clusterRanges, entryListToArray, readColumn
+import sys, time
+import numpy
+import ROOT
+
+class Chunk:
+    """A block of consecutive entries of the input tree, with its branches read as numpy columns.
+
+       Scalar branches are returned as numpy arrays and variable-length arrays as JaggedColumn.
+       mask flags the entries that are still accepted by the modules run so far.
+    """
+    def __init__(self, tree, positions, entries):
+        self._tree = tree
+        self.positions = positions # entry indices as used by tree.gotoEntry (i.e. within the entry list)
+        self.entries = entries # entry numbers in the TTree
+        self.size = len(positions)
+        self.mask = numpy.ones(self.size, dtype=bool)
+        self._columns = {}
+        self._outputs = {}
+        self._events = {}
+        self._isBranch = {}
+    def __len__(self):
+        return self.size
+    def __getitem__(self, name):
+        return self.column(name)
+    def isBranch(self, name):
+        if name not in self._isBranch:
+            self._isBranch[name] = bool(self._tree.GetBranch(name))
+        return self._isBranch[name]
+    def column(self, name):
+        """Return the column name for all entries of the chunk, either filled by a module or read from the input tree"""
+        if name in self._outputs:
+            return _asColumn(self._outputs[name])
+        if self._tree._branchTracer: self._tree._branchTracer.record(name)
+        if name not in self._columns:
+            self._columns[name] = readColumn(self._tree, name, self.entries)
+        return self._columns[name]
+    def collection(self, prefix, lenVar=None):
+        return ChunkCollection(self, prefix, lenVar)
+    def event(self, row):
+        """Return an Event for one entry of the chunk, reading values from the chunk buffers"""
+        if row in self._events:
+            ev = self._events[row]
+            self._tree.gotoEntry(ev._entry)
+            return ev
+        ev = ChunkEvent(self, row)
+        self._events[row] = ev
+        return ev
+    def setOutput(self, name, row, val):
+        values = self._outputs.get(name)
+        if values is None or not isinstance(values, list):
+            values = _asList(values, self.size)
+            self._outputs[name] = values
+        values[row] = val if isinstance(val, (int, long, float, bool)) else list(val)
+    def setOutputColumn(self, name, values):
+        if len(values) != self.size: raise RuntimeError("Column %s has %d values but the chunk has %d entries" % (name, len(values), self.size))
+        self._outputs[name] = values
+    def outputValue(self, name, row):
+        values = self._outputs[name]
+        if isinstance(values, JaggedColumn):
+            return values[row]
+        val = values[row]
+        return val.item() if isinstance(val, numpy.generic) else val
+
+class ChunkCollection:
+    """Column-wise view of a collection (e.g. Jet) in a Chunk: fields are returned as JaggedColumn"""
+    def __init__(self, chunk, prefix, lenVar=None):
+        self._chunk = chunk
+        self._prefix = prefix
+        self._lenVar = lenVar if lenVar != None else "n"+prefix
+    def __getattr__(self, name):
+        if name[:2] == "__" and name[-2:] == "__":
+            raise AttributeError
+        return self._chunk.column(self._prefix+"_"+name)
+    def __getitem__(self, name):
+        return self.__getattr__(name)
+    def counts(self):
+        return self._chunk.column(self._lenVar)
+
+class ChunkEvent(Event):
+    """Event that serves branch values from the buffers of a Chunk, so that legacy modules can run in the chunked loop"""
+    def __init__(self, chunk, row):
+        Event.__init__(self, chunk._tree, chunk.positions[row])
+        self._chunk = chunk
+        self._row = row
+        self._branchValues = {} # python values of the branches read for this entry, converted once
+    def __getattr__(self, name):
+        if name[:2] == "__" and name[-2:] == "__":
+            raise AttributeError
+        chunk = self._chunk
+        if name in chunk._outputs:
+            val = chunk.outputValue(name, self._row)
+            if val is not None:
+                return val.tolist() if isinstance(val, numpy.ndarray) else val
+        if name in self._tree._extrabranches or not chunk.isBranch(name):
+            return Event.__getattr__(self, name)
+        values = self._branchValues
+        if name not in values:
+            val = chunk.column(name)[self._row]
+            values[name] = val.tolist() if isinstance(val, numpy.ndarray) else val.item()
+        return values[name]
+
+class ChunkOutput:
+    """Wraps the output tree during the chunked loop: values filled by modules are kept per entry and written out at the end of each chunk"""
+    def __init__(self, outputTree):
+        self._output = outputTree
+        self._chunk = None
+        self._row = None
+    def __getattr__(self, name):
+        return getattr(self._output, name)
+    def branch(self, *args, **kwargs):
+        return self._output.branch(*args, **kwargs)
+    def tree(self):
+        return self._output.tree()
+    def fillBranch(self, name, val):
+        """Fill the branch for the entry currently processed by a legacy module"""
+        self._chunk.setOutput(name, self._row, val)
+    fillBranches = OutputTree.fillBranches.im_func
+    def fillColumn(self, name, values):
+        """Fill the branch for all entries of the current chunk at once (numpy array, list or JaggedColumn)"""
+        self._chunk.setOutputColumn(name, values)
+    def writeChunk(self, chunk, rows):
+        tree = chunk._tree
+        for row in rows:
+            tree.gotoEntry(chunk.positions[row])
+            for name, values in chunk._outputs.iteritems():
+                if isinstance(values, list) and values[row] is None: continue # not filled for this entry
+                self._output.fillBranch(name, chunk.outputValue(name, row))
+            self._output.fill()
+            clearExtraBranches(tree)
+
+def chunkedEventLoop(modules, inputFile, outputFile, inputTree, wrappedOutputTree, maxEvents=-1, eventRange=None, progress=(10000,sys.stdout), filterOutput=True, cutFlow=False, chunkSize=10000, timer=None, metrics=None):
+    """Same as eventLoop, but processing cluster-aligned chunks of entries.
+
+       Modules implementing analyzeChunk(chunk) are run once per chunk and return a boolean numpy array
+       (or None to accept all entries); the other modules are run entry by entry through analyze(event),
+       with consecutive legacy modules grouped so that they see the same Event object.
+    """
+    if cutFlow:
+        acceptedEventsPerModule = dict()
+
+    chunkOutput = ChunkOutput(wrappedOutputTree) if wrappedOutputTree != None else None
+    tracer = getattr(inputTree, '_branchTracer', None)
+    labels = dict(zip(modules, moduleLabels(modules)))
+    declareInputBranches([m for m in modules if not hasattr(m, 'analyzeChunk')], inputTree)
+    for m in modules:
+        if tracer: tracer.current = labels[m]
+        if timer: timer.beginFile(labels[m], m, inputFile, outputFile, inputTree, chunkOutput)
+        else: m.beginFile(inputFile, outputFile, inputTree, chunkOutput)
+        if cutFlow:
+            m.__name__ = labels[m]
+            acceptedEventsPerModule[m.__name__] = 0
+    if tracer: tracer.current = None
+
+    # group consecutive legacy modules, so that each entry runs through the group with the same Event
+    segments = []
+    for m in modules:
+        if hasattr(m, 'analyzeChunk'):
+            segments.append((True, [m]))
+        elif segments and not segments[-1][0]:
+            segments[-1][1].append(m)
+        else:
+            segments.append((False, [m]))
+
+    positions = numpy.arange(inputTree.entries, dtype='i8') if eventRange == None else numpy.fromiter(eventRange, dtype='i8')
+    if maxEvents > 0: positions = positions[:maxEvents]
+    if inputTree._entrylist:
+        treeEntries = entryListToArray(inputTree, inputTree._entrylist)[positions]
+    else:
+        treeEntries = positions
+    entries = len(positions)
+
+    t0 = time.time(); tlast = t0; doneEvents = 0; acceptedEvents = 0
+    lastReport = 0
+    if entries > 0:
+        ranges = clusterRanges(inputTree, chunkSize, int(treeEntries[0]), int(treeEntries[-1])+1)
+    else:
+        ranges = []
+    for (begin, end) in ranges:
+        first, last = numpy.searchsorted(treeEntries, [begin, end])
+        if first == last: continue
+        chunk = Chunk(inputTree, positions[first:last], treeEntries[first:last])
+        if chunkOutput: chunkOutput._chunk = chunk
+        for vectorized, group in segments:
+            if vectorized:
+                m = group[0]
+                if tracer: tracer.current = labels[m]
+                if timer:
+                    nIn = int(chunk.mask.sum()); t1 = time.time(); c1 = time.clock()
+                ret = m.analyzeChunk(chunk)
+                if ret is not None:
+                    chunk.mask &= numpy.asarray(ret, dtype=bool)
+                if timer:
+                    timer.add(labels[m], time.time() - t1, time.clock() - c1, nIn, int(chunk.mask.sum()))
+                if cutFlow:
+                    acceptedEventsPerModule[m.__name__] += int(chunk.mask.sum())
+            else:
+                for row in numpy.flatnonzero(chunk.mask):
+                    e = chunk.event(row)
+                    if chunkOutput: chunkOutput._row = row
+                    for m in group:
+                        if tracer: tracer.current = labels[m]
+                        ret = timer.analyze(labels[m], m, e) if timer else m.analyze(e)
+                        if cutFlow and ret:
+                            acceptedEventsPerModule[m.__name__] += 1
+                        if not ret:
+                            chunk.mask[row] = False
+                            break
+            if not chunk.mask.any(): break
+        if tracer: tracer.current = None
+        doneEvents += chunk.size
+        nAccepted = int(chunk.mask.sum())
+        acceptedEvents += nAccepted
+        if chunkOutput:
+            chunkOutput.writeChunk(chunk, numpy.flatnonzero(chunk.mask) if filterOutput else xrange(chunk.size))
+        clearExtraBranches(inputTree)
+        if metrics: metrics.update(doneEvents, acceptedEvents, inputFile, outputFile)
+        if progress:
+            if doneEvents - lastReport >= progress[0]:
+                t1 = time.time()
+                progress[1].write("Processed %8d/%8d entries, %5.2f%% (elapsed time %7.1fs, curr speed %8.3f kHz, avg speed %8.3f kHz), accepted %8d/%8d events (%5.2f%%)\n" % (
+                        doneEvents,entries, doneEvents/float(0.01*entries), t1-t0, ((doneEvents-lastReport)/1000.)/(max(t1-tlast,1e-9)), doneEvents/1000./(max(t1-t0,1e-9)), acceptedEvents, doneEvents, acceptedEvents/(0.01*doneEvents) ))
+                tlast = t1
+                lastReport = doneEvents
+    for m in modules:
+        if tracer: tracer.current = labels[m]
+        if timer: timer.endFile(labels[m], m, inputFile, outputFile, inputTree, chunkOutput)
+        else: m.endFile(inputFile, outputFile, inputTree, chunkOutput)
+    if tracer: tracer.current = None
+    stats = readerStatistics(inputTree)
+    if stats: print stats
+
+    if cutFlow:
+        sortedKeys = sorted(acceptedEventsPerModule, key=acceptedEventsPerModule.get, reverse=True)
+        sortedKeys = [key for key in sortedKeys if "Skim" in key]
+
+        print "--- Results of cutflow ---"
+        for key in sortedKeys:
+            print("%s accepted %i events out of %i: %2.2f%%") % (key, acceptedEventsPerModule[key], doneEvents, acceptedEventsPerModule[key]/float(0.01*max(doneEvents,1)))
+        for m in modules:
+            if hasattr(m, 'cutflowSummary'): print m.cutflowSummary()
+        print "--- End of cutflow ---"
+
+    return (doneEvents, acceptedEvents, time.time() - t0)
+
+
+
+####### PRIVATE IMPLEMENTATION PART #######
+
+def _asList(values, size):
+    if values is None: return [None]*size
+    if isinstance(values, JaggedColumn): return values.tolist()
+    return list(values.tolist() if isinstance(values, numpy.ndarray) else values)
+
+def _asColumn(values):
+    if not isinstance(values, list):
+        return values
+    filled = [v for v in values if v is not None]
+    if filled and isinstance(filled[0], list):
+        rows = [v if v is not None else [] for v in values]
+        counts = numpy.array([len(v) for v in rows], dtype='i8')
+        content = numpy.array([x for v in rows for x in v])
+        return JaggedColumn(content, counts)
+    return numpy.array([v if v is not None else 0 for v in values])
@@ -0,0 +1,171 @@
+import numpy
+import ROOT
+ROOT.PyConfig.IgnoreCommandLineOptions = True
+
+_rootLeafType2NumpyType = {
+    'Bool_t': 'bool', 'Char_t': 'i1', 'UChar_t': 'u1', 'Short_t': 'i2', 'UShort_t': 'u2',
+    'Int_t': 'i4', 'UInt_t': 'u4', 'Long64_t': 'i8', 'ULong64_t': 'u8', 'Float_t': 'f4', 'Double_t': 'f8'
+}
+
+def numpyType(tree, branchName):
+    """Return the numpy dtype matching the leaf type of branch branchName"""
+    leaf = _getLeaf(tree, branchName)
+    return numpy.dtype(_rootLeafType2NumpyType.get(leaf.GetTypeName(), 'f8'))
+
+def countBranch(tree, branchName):
+    """Return the name of the branch holding the length of branchName, or None if it is not a variable-length array"""
+    leafCount = _getLeaf(tree, branchName).GetLeafCount()
+    return leafCount.GetName() if bool(leafCount) else None
+
+def clusterRanges(tree, chunkSize, firstEntry=0, lastEntry=None):
+    """Split [firstEntry, lastEntry) into ranges of at least chunkSize entries whose inner boundaries coincide with cluster boundaries"""
+    if lastEntry is None: lastEntry = tree.GetEntries()
+    ranges = []
+    if lastEntry <= firstEntry: return ranges
+    clusterIter = tree.GetClusterIterator(firstEntry)
+    begin = firstEntry
+    while True:
+        start = clusterIter()
+        if start >= lastEntry: break
+        end = min(clusterIter.GetNextEntry(), lastEntry)
+        if end - begin >= chunkSize:
+            ranges.append((begin, end))
+            begin = end
+    if begin < lastEntry:
+        ranges.append((begin, lastEntry))
+    return ranges
+
+def entryListToArray(tree, elist):
+    """Return the tree entry numbers stored in elist as a sorted numpy array"""
+    if elist is None or elist.GetN() == 0:
+        return numpy.zeros(0, dtype='i8')
+    tree.SetEntryList(elist)
+    try:
+        entries = _draw(tree, "Entry$", elist.GetN())
+    finally:
+        tree.SetEntryList(0)
+    return numpy.sort(entries.astype('i8'))
+
+def readColumn(tree, branchName, entries):
+    """Read branch branchName for the (sorted) tree entry numbers in entries.
+
+       Returns a numpy array for value branches and a JaggedColumn for variable-length arrays, with the type of the branch.
+       Values are read through TTree::Draw, in double precision, except for 64 bit integers (not exact beyond 2^53),
+       which are read with their type from a separate copy of the tree.
+    """
+    entries = numpy.asarray(entries, dtype='i8')
+    dtype = numpyType(tree, branchName)
+    if len(entries) == 0:
+        content = numpy.zeros(0, dtype=dtype)
+        return JaggedColumn(content, numpy.zeros(0, dtype='i8')) if countBranch(tree, branchName) else content
+    first = int(entries[0]); nEntries = int(entries[-1]) - first + 1
+    rows = entries - first
+    contiguous = (len(entries) == nEntries)
+    lenBranch = countBranch(tree, branchName)
+    exact = (dtype.kind in 'iu' and dtype.itemsize == 8)
+    if lenBranch is None:
+        values = _readExact(tree, branchName, dtype, nEntries, first) if exact else _draw(tree, branchName, nEntries, first).astype(dtype)
+        return values if contiguous else values[rows]
+    counts = _draw(tree, lenBranch, nEntries, first).astype('i8')
+    if exact:
+        content = _readExact(tree, branchName, dtype, int(counts.sum()), first, nEntries, lenBranch)
+    else:
+        content = _draw(tree, branchName, int(counts.sum()), first, nEntries).astype(dtype)
+    column = JaggedColumn(content, counts)
+    return column if contiguous else column.take(rows)
+
+
+class JaggedColumn(object):
+    """Flat content plus per-entry counts of a variable-length array branch"""
+    __slots__ = ('content', 'counts', 'offsets')
+    def __init__(self, content, counts):
+        self.content = content
+        self.counts = numpy.asarray(counts, dtype='i8')
+        self.offsets = numpy.zeros(len(self.counts)+1, dtype='i8')
+        numpy.cumsum(self.counts, out=self.offsets[1:])
+    def __len__(self):
+        return len(self.counts)
+    def __getitem__(self, index):
+        if isinstance(index, (int, long, numpy.integer)):
+            return self.content[self.offsets[index]:self.offsets[index+1]]
+        index = numpy.asarray(index)
+        if index.dtype == bool: index = numpy.flatnonzero(index)
+        return self.take(index)
+    def take(self, rows):
+        """Return a new JaggedColumn with the entries at positions rows"""
+        counts = self.counts[rows]
+        starts = self.offsets[:-1][rows]
+        newOffsets = numpy.zeros(len(counts)+1, dtype='i8')
+        numpy.cumsum(counts, out=newOffsets[1:])
+        index = numpy.arange(newOffsets[-1], dtype='i8') + numpy.repeat(starts - newOffsets[:-1], counts)
+        return JaggedColumn(self.content[index], counts)
+    def parents(self):
+        """Return for every element of content the index of the entry it belongs to"""
+        return numpy.repeat(numpy.arange(len(self.counts), dtype='i8'), self.counts)
+    def tolist(self):
+        return [self.content[self.offsets[i]:self.offsets[i+1]].tolist() for i in xrange(len(self.counts))]
+
+
+
+####### PRIVATE IMPLEMENTATION PART #######
+
+def _getLeaf(tree, branchName):
+    branch = tree.GetBranch(branchName)
+    if not branch: raise RuntimeError, "Unknown branch %s" % branchName
+    return branch.GetLeaf(branchName)
+
+def _draw(tree, expr, nValues, first=0, nEntries=None):
+    if nEntries is None: nEntries = nValues
+    if nValues == 0: return numpy.zeros(0, dtype='f8')
+    if tree.GetEstimate() < nValues + 1: tree.SetEstimate(nValues + 1)
+    nSelected = tree.Draw(expr, "", "goff", nEntries, first)
+    if nSelected < 0: raise RuntimeError, "Cannot read '%s' from tree %s" % (expr, tree.GetName())
+    if nSelected != nValues: raise RuntimeError, "Read %d values of '%s' but expected %d" % (nSelected, expr, nValues)
+    buff = tree.GetV1()
+    buff.SetSize(nSelected)
+    return numpy.frombuffer(buff, dtype='f8', count=nSelected).copy()
+
+def _readExact(tree, branchName, dtype, nValues, first, nEntries=None, lenBranch=None):
+    """Read nValues values of an integer branch with its own type, from a separate copy of the tree holding it,
+       so that the branch addresses used by the readers of tree are not changed"""
+    if nEntries is None: nEntries = nValues
+    values = numpy.zeros(nValues, dtype=dtype)
+    if nValues == 0: return values
+    _declareReadBranch()
+    getattr(ROOT, "nanoReadBranch_" + _getLeaf(tree, branchName).GetTypeName())(_privateTree(tree, branchName), branchName, lenBranch or "", first, nEntries, values.ctypes.data)
+    return values
+
+def _privateTree(tree, branchName):
+    owner = tree.GetBranch(branchName).GetTree() # tree or one of its friends
+    if not hasattr(tree, '_privateTrees'): tree._privateTrees = {}
+    key = owner.GetDirectory().GetPath() + "/" + owner.GetName()
+    if key not in tree._privateTrees:
+        copy = owner.GetDirectory().GetKey(owner.GetName()).ReadObj()
+        ROOT.SetOwnership(copy, False) # deleted with its file
+        tree._privateTrees[key] = copy
+    return tree._privateTrees[key]
+
+_readBranchDeclared = False
+def _declareReadBranch():
+    global _readBranchDeclared
+    if _readBranchDeclared: return
+    code = []
+    for typ in ('Long64_t', 'ULong64_t'):
+        code.append("""
+        void nanoReadBranch_%s(TTree *tree, const char *name, const char *lenName, Long64_t first, Long64_t nEntries, ULong64_t address) {
+            TLeaf *lenLeaf = lenName[0] ? tree->GetLeaf(lenName) : 0;
+            std::vector<%s> buffer(lenLeaf ? std::max(lenLeaf->GetMaximum(), 1) : 1);
+            tree->SetBranchStatus("*", 0);
+            tree->SetBranchStatus(name, 1);
+            if (lenLeaf) tree->SetBranchStatus(lenName, 1);
+            tree->SetBranchAddress(name, buffer.data());
+            %s *out = reinterpret_cast<%s *>(address);
+            for (Long64_t entry = first; entry < first + nEntries; ++entry) {
+                tree->GetEntry(entry);
+                Long64_t n = lenLeaf ? Long64_t(lenLeaf->GetValue()) : 1;
+                for (Long64_t i = 0; i < n; ++i) *out++ = buffer[i];
+            }
+            tree->ResetBranchAddresses();
+        }""" % (typ, typ, typ, typ))
+    ROOT.gInterpreter.Declare("\n".join(code))
+    _readBranchDeclared = True
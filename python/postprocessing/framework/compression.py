@@ -0,0 +1,99 @@
+import os
+import time
+import tempfile
+import ROOT
+ROOT.PyConfig.IgnoreCommandLineOptions = True
+
+_algorithms = { 'ZLIB':'kZLIB', 'LZMA':'kLZMA', 'LZ4':'kLZ4', 'ZSTD':'kZSTD' }
+# candidate settings tried by the auto mode, from the fastest to the most compact
+autoCandidates = [ "LZ4:4", "ZSTD:1", "ZLIB:1", "ZSTD:5", "ZLIB:6", "LZMA:4", "LZMA:9" ]
+
+def parseCompression(compression):
+    """Parse a compression setting "none" or "(algo):(level)", with algo one of LZMA, ZLIB, LZ4, ZSTD.
+
+       Returns (compressionLevel, compressionAlgo) as taken by TFile.Open and TFile::SetCompressionAlgorithm.
+    """
+    if compression == "none":
+        return (0, None)
+    ROOT.gInterpreter.ProcessLine("#include <Compression.h>")
+    (algo, level) = compression.split(":")
+    if algo not in _algorithms: raise RuntimeError("Unsupported compression %s" % algo)
+    if not hasattr(ROOT.ROOT, _algorithms[algo]): raise RuntimeError("Compression %s is not supported by this ROOT version" % algo)
+    return (int(level), getattr(ROOT.ROOT, _algorithms[algo]))
+
+def compressionSettings(compression):
+    """Return the compression as a single integer, as taken by TFile::SetCompressionSettings"""
+    (level, algo) = parseCompression(compression)
+    return 100*algo + level if level else 0
+
+def isSupported(compression):
+    try:
+        parseCompression(compression)
+    except RuntimeError:
+        return False
+    return True
+
+def profileCompression(tree, candidates=autoCandidates, nEntries=2000, branchSelection=None):
+    """Write the first nEntries of tree with each of the candidate settings, and measure the compression ratio and the write speed.
+
+       Returns a list of dicts with keys compression, ratio, mbps (uncompressed MB per second of Fill and Write).
+    """
+    if branchSelection: branchSelection.selectBranches(tree)
+    prevdir = ROOT.gDirectory
+    ROOT.gROOT.cd()
+    sample = tree.CopyTree("", "", nEntries) # read once, in memory, so that only the writing is timed
+    tree.SetBranchStatus("*",1)
+    results = []
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for compression in candidates:
+            if not isSupported(compression): continue
+            (level, algo) = parseCompression(compression)
+            fileName = os.path.join(tmpdir, "sample.root")
+            t0 = time.time()
+            outFile = ROOT.TFile.Open(fileName, "RECREATE", "", level)
+            outFile.SetCompressionAlgorithm(algo)
+            out = sample.CloneTree(-1)
+            out.Write()
+            totBytes = out.GetTotBytes(); zipBytes = out.GetZipBytes()
+            outFile.Close()
+            dt = time.time() - t0
+            results.append({ 'compression':compression, 'ratio':totBytes/float(max(zipBytes,1)), 'mbps':totBytes/1e6/max(dt,1e-9) })
+            os.remove(fileName)
+    finally:
+        os.rmdir(tmpdir)
+        prevdir.cd()
+    return results
+
+def chooseCompression(results, mbps=None, ratio=None):
+    """Pick a setting from the results of profileCompression.
+
+       With a speed budget (mbps), the most compact setting writing at least that fast is chosen; with only a size budget (ratio),
+       the fastest setting compressing at least that much. Without budgets, the fastest setting within 10% of the best ratio.
+    """
+    if not results: raise RuntimeError("No compression setting could be profiled")
+    if mbps is None and ratio is None:
+        bestRatio = max(r['ratio'] for r in results)
+        return max([r for r in results if r['ratio'] >= 0.9*bestRatio], key=lambda r: r['mbps'])
+    good = [r for r in results if (mbps is None or r['mbps'] >= mbps) and (ratio is None or r['ratio'] >= ratio)]
+    if not good:
+        print "Warning: no compression setting within the budget (%s MB/s, ratio %s), using the closest one" % (mbps, ratio)
+        return max(results, key=lambda r: r['mbps']) if mbps is not None else max(results, key=lambda r: r['ratio'])
+    if mbps is not None:
+        return max(good, key=lambda r: r['ratio'])
+    return max(good, key=lambda r: r['mbps'])
+
+def autoCompression(spec, tree, nEntries=2000, branchSelection=None):
+    """Resolve a setting auto[:mbps=X][:ratio=Y] by profiling the candidates on a sample of tree, printing the measurements"""
+    budget = {}
+    for item in spec.split(":")[1:]:
+        (key, val) = item.split("=")
+        if key not in ("mbps", "ratio"): raise RuntimeError("Unknown compression budget %s in %s" % (key, spec))
+        budget[key] = float(val)
+    results = profileCompression(tree, nEntries=nEntries, branchSelection=branchSelection)
+    choice = chooseCompression(results, **budget)
+    print "--- Compression profile on %d entries ---" % min(nEntries, tree.GetEntries())
+    for r in results:
+        print "%-8s ratio %5.2f  %8.1f MB/s%s" % (r['compression'], r['ratio'], r['mbps'], "  <--" if r is choice else "")
+    print "--- End of compression profile ---"
+    return choice['compression']
@@ -1,25 +1,50 @@
 import ROOT
 import math
+import numpy
 ROOT.PyConfig.IgnoreCommandLineOptions = True
 from PhysicsTools.NanoAODTools.postprocessing.framework.treeReaderArrayTools import InputTree 
+from PhysicsTools.NanoAODTools.postprocessing.framework.columns import numpyType, countBranch, JaggedColumn
+from PhysicsTools.NanoAODTools.postprocessing.framework.expressions import compileExpression
 
 class Event:
     """Class that allows seeing an entry of a PyROOT TTree as an Event"""
     def __init__(self,tree,entry):
         self._tree = tree
         self._entry = entry
+        self._scalars = {}
         self._tree.gotoEntry(entry)
+    def reset(self,entry):
+        """Move to another entry, so that the same Event can be reused: cached values and attributes set by modules are dropped"""
+        tree = self._tree
+        self.__dict__.clear()
+        self._tree = tree
+        self._entry = entry
+        self._scalars = {}
+        tree.gotoEntry(entry)
     def __getattr__(self,name):
         if name in self.__dict__: return self.__dict__[name]
-        return self._tree.readBranch(name)
+        tree = self._tree
+        if name in tree._extrabranches: return tree._extrabranches[name] # filled by a module, possibly after being read
+        if name in self._scalars: return self._scalars[name]
+        if tree._lazyProviders is not None and tree._lazyProviders.provide(self, name):
+            return self.__getattr__(name) # set by the provider that was just run
+        val = tree.readBranch(name)
+        if name in tree._ttrvs and not tree._branchTracer: self._scalars[name] = val # value branches don't change within the entry
+        return val
     def __getitem__(self,attr):
         return self.__getattr__(attr)
     def eval(self,expr):
         """Evaluate an expression, as TTree::Draw would do. 
 
-           This is added for convenience, but it may perform poorly and the implementation is not bulletproof,
-           so it's better to rely on reading values, collections or objects directly
+           Expressions in the subset understood by expressions.Expression are compiled once and evaluated with numpy
+           on the values of the entry; others fall back to a TTreeFormula, which may perform poorly.
         """ 
+        try:
+            compiled = compileExpression(expr)
+        except RuntimeError:
+            compiled = None
+        if compiled is not None:
+            return compiled.evalEvent(self)
         if not hasattr(self._tree, '_exprs'):
             self._tree._exprs = {}
             # remove useless warning about EvalInstance()
@@ -30,6 +55,9 @@ class Event:
                                     message='creating converter for unknown type "const char\*\[\]"$')
         if expr not in self._tree._exprs:
             formula = ROOT.TTreeFormula(expr,expr,self._tree)
+            # codes like Entry$ have no leaf
+            leaves = [formula.GetLeaf(i) for i in xrange(formula.GetNcodes())] if self._tree._branchTracer else []
+            formula.branches = [leaf.GetBranch().GetName() for leaf in leaves if leaf]
             if formula.IsInteger():
                 formula.go = formula.EvalInstance64
             else:
@@ -40,11 +68,25 @@ class Event:
             self._tree.entry = self._entry
             #self._tree._exprs[expr].SetQuickLoad(False)
         else:
-            self._tree.gotoEntry(entry)
+            self._tree.gotoEntry(self._entry)
             formula = self._tree._exprs[expr]
+        if self._tree._branchTracer:
+            for branchName in formula.branches: self._tree._branchTracer.record(branchName)
         if "[" in expr: # unclear why this is needed, but otherwise for some arrays x[i] == 0 for all i > 0
             formula.GetNdata()
         return formula.go()
+    def _column(self,name):
+        """Value of name for this entry as a column of length 1 (a JaggedColumn for arrays), for expressions.Expression"""
+        val = getattr(self,name)
+        if isinstance(val, (list, tuple, numpy.ndarray)): # filled by a module
+            return JaggedColumn(numpy.asarray(val), [len(val)])
+        tree = self._tree
+        if name in tree._ttras:
+            lenBranch = countBranch(tree,name)
+            if lenBranch:
+                content = numpy.array(_readColumn(self,name,getattr(self,lenBranch)))
+                return JaggedColumn(content, [len(content)])
+        return numpy.array([val])
 
 class Object:
     """Class that allows seeing a set branches plus possibly an index as an Object"""
@@ -106,3 +148,125 @@ class Collection:
     def __len__(self):
         return self._len
 
+
+class ArrayObject(object):
+    """Object of an ArrayCollection: holds only the collection and its index, attributes are read from the collection columns.
+
+       Attributes set by modules (e.g. jet.ptRaw = ...) are stored in side arrays of the collection.
+    """
+    __slots__ = ('_collection', '_index')
+    def __init__(self,collection,index):
+        object.__setattr__(self, '_collection', collection)
+        object.__setattr__(self, '_index', index)
+    def __getattr__(self,name):
+        if name[:2] == "__" and name[-2:] == "__":
+            raise AttributeError(name)
+        return self._collection._value(name, self._index)
+    def __setattr__(self,name,val):
+        self._collection._setValue(name, self._index, val)
+    def __getitem__(self,attr):
+        return self.__getattr__(attr)
+    @property
+    def _event(self):
+        return self._collection._event
+    @property
+    def _prefix(self):
+        return self._collection._prefix+"_"
+    p4 = Object.__dict__['p4']
+    DeltaR = Object.__dict__['DeltaR']
+    def subObj(self,prefix):
+        return Object(self._event,self._prefix+prefix)
+    def __repr__(self):
+        return "<%s[%s]>" % (self._collection._prefix,self._index)
+    def __str__(self):
+        return self.__repr__()
+
+class ArrayCollection(object):
+    """Drop-in replacement of Collection, which reads each field once for all the objects of the collection.
+
+       column(name) returns the field as a numpy array, values(name) as a list of python numbers;
+       objects are ArrayObject instances that index into these.
+    """
+    __slots__ = ('_event', '_prefix', '_len', '_values', '_arrays', '_derived', '_objects')
+    def __init__(self,event,prefix,lenVar=None):
+        self._event = event
+        self._prefix = prefix
+        if lenVar != None:
+            self._len = getattr(event,lenVar)
+        else:
+            self._len = getattr(event,"n"+prefix)
+        self._values = {}
+        self._arrays = {}
+        self._derived = {}
+        self._objects = [ArrayObject(self,i) for i in xrange(self._len)]
+    def __getitem__(self,index):
+        if type(index) == int and 0 <= index < self._len: return self._objects[index]
+        raise IndexError, "Invalid index %r (len is %r) at %s" % (index,self._len,self._prefix)
+    def __len__(self):
+        return self._len
+    def __iter__(self):
+        return iter(self._objects)
+    def values(self,name):
+        """Return the field name of all objects as a list"""
+        if name in self._derived:
+            return self._derived[name]
+        if name not in self._values:
+            self._values[name] = self.column(name).tolist()
+        return self._values[name]
+    def column(self,name):
+        """Return the field name of all objects as a numpy array (for branches of the input tree, a copy of the values loaded by the reader)"""
+        if name in self._derived:
+            return numpy.array(self._derived[name])
+        if name not in self._arrays:
+            self._arrays[name] = _readColumn(self._event, self._prefix+"_"+name, self._len)
+        return self._arrays[name]
+    def _value(self,name,index):
+        derived = self._derived.get(name)
+        if derived is not None:
+            val = derived[index]
+            if val is _unset: raise AttributeError("%s[%d] has no attribute %s" % (self._prefix,index,name))
+            return val
+        return self.values(name)[index]
+    def _setValue(self,name,index,val):
+        derived = self._derived.get(name)
+        if derived is None:
+            if name in self._values or _isField(self._event, self._prefix+"_"+name):
+                # overriding a field keeps the values of the other objects
+                derived = list(self.values(name))
+            else:
+                derived = [_unset]*self._len
+            self._derived[name] = derived
+            self._arrays.pop(name, None)
+        derived[index] = val
+
+_unset = object()
+
+def _isField(event,branchName):
+    tree = event._tree
+    return branchName in tree._extrabranches or bool(tree.GetBranch(branchName))
+
+def _readColumn(event,branchName,length):
+    tree = event._tree
+    val = getattr(event,branchName)
+    if isinstance(val, (list, tuple, numpy.ndarray)): # filled by a module, or already read
+        return numpy.asarray(val[:length])
+    # copy the values loaded by the TTreeReaderArray, in compiled code
+    column = numpy.empty(min(length, val.GetSize()), dtype=numpyType(tree,branchName))
+    if len(column):
+        _declareCopyReaderArray()
+        ROOT.nanoCopyReaderArray(val, column.ctypes.data, len(column))
+    return column
+
+_copyReaderArrayDeclared = False
+def _declareCopyReaderArray():
+    global _copyReaderArrayDeclared
+    if _copyReaderArrayDeclared: return
+    code = ['#include "TTreeReaderArray.h"']
+    for typ in ('Bool_t', 'Char_t', 'UChar_t', 'Short_t', 'UShort_t', 'Int_t', 'UInt_t', 'Long64_t', 'ULong64_t', 'Float_t', 'Double_t'):
+        code.append("""
+        void nanoCopyReaderArray(TTreeReaderArray<%s> &array, ULong64_t address, ULong64_t n) {
+            %s *out = reinterpret_cast<%s *>(address);
+            for (ULong64_t i = 0; i < n; ++i) out[i] = array.At(i);
+        }""" % (typ, typ, typ))
+    ROOT.gInterpreter.Declare("\n".join(code))
+    _copyReaderArrayDeclared = True
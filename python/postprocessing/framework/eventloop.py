@@ -1,10 +1,19 @@
 from PhysicsTools.NanoAODTools.postprocessing.framework.datamodel import Event
-from PhysicsTools.NanoAODTools.postprocessing.framework.treeReaderArrayTools import clearExtraBranches
+from PhysicsTools.NanoAODTools.postprocessing.framework.treeReaderArrayTools import clearExtraBranches, readerStatistics
 import sys, time
 import ROOT
 import random
 
 class Module(object):
+    inputBranches = [] # branches read by analyze (fnmatch patterns allowed), to make all the readers before the first entry
+    rawSelection = None # cut on input branches (TTree::Draw syntax) that TTree::Draw evaluates to the decision of analyze on every entry, for skims that can be pushed into the preselection
+    consumes = None # event attributes and branches read by analyze (fnmatch patterns allowed), for scheduler.scheduleModules; None if not declared
+    produces = None # event attributes and branches set or filled by analyze, for scheduler.scheduleModules; None if not declared
+    cacheable = False # the only effects of analyze are the branches it fills, so that they can be taken from the module output cache
+    def __new__(cls, *args, **kwargs):
+        self = super(Module, cls).__new__(cls)
+        self._constructorArgs = (args, kwargs) # configuration of the module, for the keys of the module output cache
+        return self
     def __init__(self):
         self.writeHistFile=False
     def beginJob(self,histFile=None,histDirName=None):
@@ -30,6 +39,12 @@ class Module(object):
         pass
     def endFile(self, inputFile, outputFile, inputTree, wrappedOutputTree):
         pass
+    def checkpointState(self):
+        """JSON-serializable state accumulated over the files processed so far (e.g. counters), saved in the checkpoint; None if there is none"""
+        return None
+    def restoreCheckpointState(self, state):
+        """restore the state returned by checkpointState, when the files it covers are skipped by a resumed job"""
+        pass
     def analyze(self, event):
         """process event, return True (go to next module) or False (fail, go to next event)"""
         pass
@@ -44,48 +59,86 @@ class Module(object):
             self.objs.append( getattr( self, obj.GetName() + '_' + name ) )
         setattr( self, obj.GetName(), objlist )
 
-def eventLoop(modules, inputFile, outputFile, inputTree, wrappedOutputTree, maxEvents=-1, eventRange=None, progress=(10000,sys.stdout), filterOutput=True, cutFlow=False): 
+def moduleLabel(m):
+    """Name of a module in cutflows and reports: its class name, plus its outputName if it has one"""
+    m = getattr(m, "wrappedModule", m) # modules replayed from the module output cache
+    label = m.__class__.__name__
+    if getattr(m, "outputName", None) is not None:
+        label += "_"+m.outputName
+    return label
+
+def moduleLabels(modules):
+    """Labels of the modules of a chain, made unique by adding the position in the chain to those shared by several modules"""
+    labels = [moduleLabel(m) for m in modules]
+    return [("%s_%d" % (label, im) if labels.count(label) > 1 else label) for im, label in enumerate(labels)]
+
+def declareInputBranches(modules, inputTree):
+    """Make the readers for the inputBranches declared by all the modules at once"""
+    branchNames = []
+    for m in modules:
+        branchNames += getattr(m, 'inputBranches', [])
+    if branchNames: inputTree.declareBranches(branchNames)
+
+def eventLoop(modules, inputFile, outputFile, inputTree, wrappedOutputTree, maxEvents=-1, eventRange=None, progress=(10000,sys.stdout), filterOutput=True, cutFlow=False, timer=None, providers=None, metrics=None): 
     if cutFlow:
         acceptedEventsPerModule = dict()
 
-    for m in modules: 
+    tracer = getattr(inputTree, '_branchTracer', None)
+    labels = moduleLabels(modules)
+    declareInputBranches(modules + (providers.modules if providers else []), inputTree)
+    for im, m in enumerate(modules): 
 
-        m.beginFile(inputFile, outputFile, inputTree, wrappedOutputTree)
+        if tracer: tracer.current = labels[im]
+        if timer: timer.beginFile(labels[im], m, inputFile, outputFile, inputTree, wrappedOutputTree)
+        else: m.beginFile(inputFile, outputFile, inputTree, wrappedOutputTree)
         if cutFlow:
-            m.__name__ = m.__class__.__name__
-            if hasattr(m, "outputName"):
-                if m.outputName is not None:
-                    m.__name__ += "_"+m.outputName
+            m.__name__ = labels[im]
             acceptedEventsPerModule[m.__name__] = 0
+    if tracer: tracer.current = None
+    # in lazy mode, the providers run when their products are requested
+    if providers: providers.beginFile(inputFile, outputFile, inputTree, wrappedOutputTree)
 
     t0 = time.time(); tlast = t0; doneEvents = 0; acceptedEvents = 0
     entries = inputTree.entries
     if eventRange: entries = len(eventRange)
     if maxEvents > 0: entries = min(entries, maxEvents)
 
+    e = None
     for ie,i in enumerate(xrange(entries) if eventRange == None else eventRange):
         if maxEvents > 0 and ie >= maxEvents: break
-        e = Event(inputTree,i)
+        if e is None: e = Event(inputTree,i)
+        else: e.reset(i)
         clearExtraBranches(inputTree)
         doneEvents += 1
         ret = True
-        for m in modules: 
-            ret = m.analyze(e) 
+        for im, m in enumerate(modules): 
+            if tracer: tracer.current = labels[im]
+            ret = timer.analyze(labels[im], m, e) if timer else m.analyze(e)
             if cutFlow and ret:
                 acceptedEventsPerModule[m.__name__] += 1 
             if not ret: break
+        if tracer: tracer.current = None
         if ret:
             acceptedEvents += 1
         if (ret or not filterOutput) and wrappedOutputTree != None: 
+            if providers: providers.provideOutputs(e)
             wrappedOutputTree.fill()
+        if metrics and doneEvents % metrics.every == 0:
+            metrics.update(doneEvents, acceptedEvents, inputFile, outputFile)
         if progress:
             if ie > 0 and ie % progress[0] == 0:
                 t1 = time.time()
                 progress[1].write("Processed %8d/%8d entries, %5.2f%% (elapsed time %7.1fs, curr speed %8.3f kHz, avg speed %8.3f kHz), accepted %8d/%8d events (%5.2f%%)\n" % (
                         ie,entries, ie/float(0.01*entries), t1-t0, (progress[0]/1000.)/(max(t1-tlast,1e-9)), ie/1000./(max(t1-t0,1e-9)), acceptedEvents, doneEvents, acceptedEvents/(0.01*doneEvents) ))
                 tlast = t1
-    for m in modules: 
-        m.endFile(inputFile, outputFile, inputTree, wrappedOutputTree)
+    for im, m in enumerate(modules): 
+        if tracer: tracer.current = labels[im]
+        if timer: timer.endFile(labels[im], m, inputFile, outputFile, inputTree, wrappedOutputTree)
+        else: m.endFile(inputFile, outputFile, inputTree, wrappedOutputTree)
+    if tracer: tracer.current = None
+    if providers: providers.endFile(inputFile, outputFile, inputTree, wrappedOutputTree)
+    stats = readerStatistics(inputTree)
+    if stats: print stats
 
 
     if cutFlow:
@@ -95,6 +148,8 @@ def eventLoop(modules, inputFile, outputFile, inputTree, wrappedOutputTree, maxE
         print "--- Results of cutflow ---"
         for key in sortedKeys:
             print("%s accepted %i events out of %i: %2.2f%%") % (key, acceptedEventsPerModule[key], doneEvents, acceptedEventsPerModule[key]/float(0.01*doneEvents))
+        for m in modules:
+            if hasattr(m, 'cutflowSummary'): print m.cutflowSummary()
         print "--- End of cutflow ---"
 
     return (doneEvents, acceptedEvents, time.time() - t0)
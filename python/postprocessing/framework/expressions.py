@@ -0,0 +1,322 @@
+import re
+import numpy
+from PhysicsTools.NanoAODTools.postprocessing.framework.columns import JaggedColumn
+
+class Expression:
+    """A cut or formula in the TTree::Draw syntax, compiled to numpy operations on columns of branches.
+
+       Supported: numbers, branches, arithmetic, comparisons, logical and bitwise operators, the ternary operator,
+       indexing of arrays (also by an array, e.g. Jet_pt[Muon_jetIdx]), math functions (abs, sqrt, exp, log, min, max, pow,
+       TMath:: equivalents...) and the specials Sum$, Max$, Min$, Length$ and Alt$.
+       As in TTree::Draw, arrays used without an index loop over their elements: a selection passes if any element passes,
+       while a value is the one of the first element. An element out of range (e.g. Jet_pt[1] with a single jet) has
+       no value: outside of Alt$, the entry is rejected by a selection whatever the rest of the expression, and its value is 0.
+    """
+    def __init__(self, expr):
+        self.expr = expr
+        self._tree = _Parser(expr).parse()
+        self.branches = sorted(_branches(self._tree))
+        self.variableIndexes = _variableIndexes(self._tree) # arrays indexed by a branch, e.g. Jet_pt[Muon_jetIdx]
+    def evaluate(self, getColumn, size):
+        """Return the values for size entries, reading the branches with getColumn(name) (numpy array or JaggedColumn)"""
+        with numpy.errstate(all='ignore'):
+            (val, valid) = _eval(self._tree, getColumn)
+            if numpy.ndim(val) == 0: val = numpy.full(size, val)
+            if isinstance(val, JaggedColumn):
+                first = numpy.zeros(size, dtype=val.content.dtype)
+                nonEmpty = val.counts > 0
+                pos = val.offsets[:-1][nonEmpty]
+                first[nonEmpty] = val.content[pos] if valid is None else numpy.where(valid[pos], val.content[pos], 0)
+                return first
+            return val if valid is None else numpy.where(valid, val, 0)
+    def select(self, getColumn, size):
+        """Return the boolean mask of the entries passing the expression as a selection"""
+        with numpy.errstate(all='ignore'):
+            (val, valid) = _eval(self._tree, getColumn)
+            if numpy.ndim(val) == 0: val = numpy.full(size, val)
+            passed = _truth(val.content if isinstance(val, JaggedColumn) else val)
+            if valid is not None: passed = passed & valid
+            if isinstance(val, JaggedColumn):
+                return numpy.bincount(val.parents(), weights=passed, minlength=size) > 0
+            return passed
+    def evalChunk(self, chunk):
+        return self.evaluate(chunk.column, chunk.size)
+    def selectChunk(self, chunk):
+        return self.select(chunk.column, chunk.size)
+    def evalEvent(self, event):
+        """Evaluate the expression for the current entry of an Event"""
+        return self.evaluate(event._column, 1)[0].item()
+    def selectEvent(self, event):
+        return bool(self.select(event._column, 1)[0])
+
+def compileExpression(expr):
+    """Return the Expression for expr, compiling it the first time. Raises RuntimeError for unsupported expressions"""
+    if expr not in _compiled:
+        _compiled[expr] = Expression(expr)
+    return _compiled[expr]
+
+
+
+####### PRIVATE IMPLEMENTATION PART #######
+
+_compiled = {}
+
+_tokenRe = re.compile(r"\s*(?:(\d+\.?\d*(?:[eE][+-]?\d+)?|\.\d+(?:[eE][+-]?\d+)?)|([A-Za-z_]\w*(?:::\w+)*\$?)|(&&|\|\||==|!=|<=|>=|[-+*/%<>!()\[\],&|^?:]))")
+
+# binding powers of the infix operators
+_infix = {
+    '?': 1, '||': 2, '&&': 3, '|': 4, '^': 5, '&': 6, '==': 7, '!=': 7,
+    '<': 8, '<=': 8, '>': 8, '>=': 8, '+': 9, '-': 9, '*': 10, '/': 10, '%': 10, '[': 12,
+}
+_prefixPower = 11
+
+_functions = {
+    'abs': numpy.abs, 'fabs': numpy.abs, 'TMath::Abs': numpy.abs, 'sqrt': numpy.sqrt, 'TMath::Sqrt': numpy.sqrt,
+    'exp': numpy.exp, 'TMath::Exp': numpy.exp, 'log': numpy.log, 'TMath::Log': numpy.log, 'log10': numpy.log10, 'TMath::Log10': numpy.log10,
+    'sin': numpy.sin, 'cos': numpy.cos, 'tan': numpy.tan, 'asin': numpy.arcsin, 'acos': numpy.arccos, 'atan': numpy.arctan,
+    'sinh': numpy.sinh, 'cosh': numpy.cosh, 'tanh': numpy.tanh, 'floor': numpy.floor, 'ceil': numpy.ceil,
+    'TMath::Sin': numpy.sin, 'TMath::Cos': numpy.cos, 'TMath::Tan': numpy.tan, 'TMath::ATan': numpy.arctan,
+    'atan2': numpy.arctan2, 'TMath::ATan2': numpy.arctan2, 'pow': numpy.power, 'TMath::Power': numpy.power,
+    'min': numpy.minimum, 'TMath::Min': numpy.minimum, 'max': numpy.maximum, 'TMath::Max': numpy.maximum,
+    'TMath::Hypot': numpy.hypot, 'TMath::Pi': lambda: numpy.pi,
+}
+_reductions = ('Sum$', 'Max$', 'Min$', 'Length$')
+_constants = {'true': 1, 'false': 0, 'kTRUE': 1, 'kFALSE': 0}
+
+class _Parser:
+    """Pratt parser producing a tree of tuples: ('num', value), ('var', name), ('unary', op, x), ('binary', op, x, y),
+       ('ternary', cond, x, y), ('index', x, i), ('call', name, args)"""
+    def __init__(self, expr):
+        self.expr = expr
+        self.tokens = []
+        pos = 0
+        expr = expr.rstrip()
+        while pos < len(expr):
+            m = _tokenRe.match(expr, pos)
+            if not m or m.end() == pos: raise RuntimeError("Unexpected character at position %d in expression %r" % (pos, self.expr))
+            if m.group(1): self.tokens.append(('num', m.group(1)))
+            elif m.group(2): self.tokens.append(('name', m.group(2)))
+            else: self.tokens.append(('op', m.group(3)))
+            pos = m.end()
+        self.pos = 0
+    def parse(self):
+        tree = self._expression(0)
+        if self.pos != len(self.tokens): raise RuntimeError("Unexpected %r in expression %r" % (self.tokens[self.pos][1], self.expr))
+        return tree
+    def _peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+    def _next(self):
+        tok = self._peek()
+        if tok[0] is None: raise RuntimeError("Unexpected end of expression %r" % self.expr)
+        self.pos += 1
+        return tok
+    def _expect(self, op):
+        tok = self._next()
+        if tok != ('op', op): raise RuntimeError("Expected %r instead of %r in expression %r" % (op, tok[1], self.expr))
+    def _expression(self, power):
+        left = self._prefix()
+        while True:
+            kind, op = self._peek()
+            if kind != 'op' or op not in _infix or _infix[op] <= power: return left
+            self.pos += 1
+            if op == '[':
+                left = ('index', left, self._expression(0))
+                self._expect(']')
+            elif op == '?':
+                x = self._expression(0)
+                self._expect(':')
+                left = ('ternary', left, x, self._expression(_infix['?']-1)) # right associative
+            else:
+                left = ('binary', op, left, self._expression(_infix[op]))
+    def _prefix(self):
+        kind, tok = self._next()
+        if kind == 'num':
+            return ('num', float(tok) if any(c in tok for c in '.eE') else int(tok))
+        if kind == 'name':
+            if self._peek() == ('op', '('):
+                self.pos += 1
+                args = []
+                if self._peek() != ('op', ')'):
+                    args.append(self._expression(0))
+                    while self._peek() == ('op', ','):
+                        self.pos += 1
+                        args.append(self._expression(0))
+                self._expect(')')
+                if tok not in _functions and tok not in _reductions and tok != 'Alt$':
+                    raise RuntimeError("Unsupported function %s in expression %r" % (tok, self.expr))
+                return ('call', tok, args)
+            if tok in _constants: return ('num', _constants[tok])
+            if tok.endswith('$') or '::' in tok: raise RuntimeError("Unsupported %s in expression %r" % (tok, self.expr))
+            return ('var', tok)
+        if tok == '(':
+            x = self._expression(0)
+            self._expect(')')
+            return x
+        if tok in ('-', '+', '!'):
+            return ('unary', tok, self._expression(_prefixPower))
+        raise RuntimeError("Unexpected %r in expression %r" % (tok, self.expr))
+
+def _branches(node):
+    if node[0] == 'var': return set([node[1]])
+    ret = set()
+    for child in node[1:]:
+        if isinstance(child, tuple): ret |= _branches(child)
+        elif isinstance(child, list):
+            for arg in child: ret |= _branches(arg)
+    return ret
+
+def _variableIndexes(node):
+    if node[0] == 'index' and node[2][0] != 'num': return True
+    for child in node[1:]:
+        if isinstance(child, tuple) and _variableIndexes(child): return True
+        if isinstance(child, list) and any(_variableIndexes(arg) for arg in child): return True
+    return False
+
+def _load(getColumn, name):
+    col = getColumn(name)
+    if isinstance(col, JaggedColumn):
+        return JaggedColumn(_widen(col.content), col.counts)
+    return _widen(numpy.asarray(col))
+
+def _widen(col):
+    """As in TTree::Draw: compute floats in double precision (a float 25.1 is above the constant 25.1), do not wrap
+       around on unsigned integers (e.g. nJet-1), and count booleans as integers"""
+    if col.dtype.kind == 'f' and col.dtype.itemsize < 8: return col.astype('f8')
+    if col.dtype.kind in 'ub': return col.astype('i8')
+    return col
+
+def _modulo(x, y):
+    """% of TTreeFormula: on the values truncated to integers, with the sign of x as in C++"""
+    return numpy.fmod(numpy.asarray(x).astype('i8'), numpy.asarray(y).astype('i8'))
+
+def _truth(x):
+    x = numpy.asarray(x)
+    if x.dtype.kind == 'b': return x
+    return x != 0 # NaN is true, as in C++
+
+def _truncate(col, counts):
+    """Keep the first counts elements of each entry of col"""
+    offsets = numpy.zeros(len(counts)+1, dtype='i8')
+    numpy.cumsum(counts, out=offsets[1:])
+    index = numpy.arange(offsets[-1], dtype='i8') + numpy.repeat(col.offsets[:-1] - offsets[:-1], counts)
+    return col.content[index]
+
+def _take(content, pos):
+    """content[pos], with zeros if content is empty (all the positions are then out of range)"""
+    return content[pos] if len(content) else numpy.zeros(len(pos), dtype=content.dtype)
+
+def _combine(masks):
+    """Logical and of validity masks, None meaning all valid"""
+    ret = None
+    for mask in masks:
+        if mask is not None: ret = mask if ret is None else ret & mask
+    return ret
+
+def _align(values, masks):
+    """Bring operands and their validity masks to a common layout: per-entry values are repeated for every element
+       of the arrays, and arrays with different lengths are cut to the shortest one (as TTree::Draw does).
+       Returns the flat operands, their flat masks and the counts of the resulting array (None if there are no arrays)."""
+    jagged = [v for v in values if isinstance(v, JaggedColumn)]
+    if not jagged: return values, masks, None
+    counts = jagged[0].counts
+    for j in jagged[1:]:
+        if j.counts is not counts and not numpy.array_equal(j.counts, counts): counts = numpy.minimum(counts, j.counts)
+    flat, flatMasks = [], []
+    for v, mask in zip(values, masks):
+        if isinstance(v, JaggedColumn):
+            same = v.counts is counts or numpy.array_equal(v.counts, counts)
+            flat.append(v.content if same else _truncate(v, counts))
+            flatMasks.append(mask if mask is None or same else _truncate(JaggedColumn(mask, v.counts), counts))
+        elif numpy.ndim(v) == 0:
+            flat.append(v)
+            flatMasks.append(mask)
+        else:
+            flat.append(numpy.repeat(v, counts))
+            flatMasks.append(None if mask is None else numpy.repeat(mask, counts))
+    return flat, flatMasks, counts
+
+def _apply(func, args):
+    """Apply func to the values of args, (value, mask) pairs: the result is valid where all the operands are"""
+    (flat, masks, counts) = _align([value for (value, mask) in args], [mask for (value, mask) in args])
+    ret = func(*flat)
+    return (ret if counts is None else JaggedColumn(ret, counts)), _combine(masks)
+
+def _index(col, index):
+    (col, colValid), (index, indexValid) = col, index
+    if not isinstance(col, JaggedColumn):
+        # a single value per entry: only index 0 exists
+        ((x, i), masks, counts) = _align([col, index], [colValid, indexValid])
+        (x, i) = numpy.broadcast_arrays(x, i)
+        valid = _combine(masks + [numpy.asarray(i) == 0])
+        return (x if counts is None else JaggedColumn(x, counts)), valid
+    if isinstance(index, JaggedColumn):
+        # an element for every index, e.g. Jet_pt[Muon_jetIdx]
+        parents = index.parents()
+        i = index.content.astype('i8')
+        valid = (i >= 0) & (i < col.counts[parents])
+        pos = numpy.where(valid, col.offsets[parents] + i, 0)
+        if colValid is not None: valid &= _take(colValid, pos)
+        return JaggedColumn(_take(col.content, pos), index.counts), _combine([valid, indexValid])
+    i = numpy.asarray(index).astype('i8')
+    valid = (i >= 0) & (i < col.counts)
+    pos = numpy.where(valid, col.offsets[:-1] + i, 0)
+    if colValid is not None: valid &= _take(colValid, pos)
+    return _take(col.content, pos), _combine([valid, indexValid])
+
+def _reduce(name, arg):
+    """Sum$, Max$, Min$ and Length$ over the valid elements: the result is always valid"""
+    (col, valid) = arg
+    if not isinstance(col, JaggedColumn):
+        if name == 'Length$': return (numpy.ones_like(col, dtype='i8') if valid is None else numpy.asarray(valid).astype('i8')), None
+        return (col if valid is None else numpy.where(valid, col, 0)), None
+    n = len(col.counts)
+    if valid is not None:
+        col = JaggedColumn(col.content[valid], numpy.bincount(col.parents()[valid], minlength=n))
+    if name == 'Length$': return col.counts, None
+    content = col.content
+    if name == 'Sum$': return numpy.bincount(col.parents(), weights=content, minlength=n), None
+    ret = numpy.zeros(n, dtype=content.dtype)
+    nonEmpty = col.counts > 0
+    if nonEmpty.any():
+        ret[nonEmpty] = (numpy.maximum if name == 'Max$' else numpy.minimum).reduceat(content, col.offsets[:-1][nonEmpty])
+    return ret, None
+
+def _alt(primary, alternate):
+    """Alt$: the alternate value where the primary one is missing"""
+    ((x, y), (mx, my), counts) = _align([primary[0], alternate[0]], [primary[1], alternate[1]])
+    if mx is None: return primary
+    ret = numpy.where(mx, x, y)
+    return (ret if counts is None else JaggedColumn(ret, counts)), (None if my is None else mx | my)
+
+_binary = {
+    '+': numpy.add, '-': numpy.subtract, '*': numpy.multiply, '/': numpy.true_divide, '%': _modulo,
+    '==': numpy.equal, '!=': numpy.not_equal, '<': numpy.less, '<=': numpy.less_equal, '>': numpy.greater, '>=': numpy.greater_equal,
+    '&&': lambda x, y: _truth(x) & _truth(y), '||': lambda x, y: _truth(x) | _truth(y),
+    '&': lambda x, y: numpy.bitwise_and(numpy.asarray(x).astype('i8'), numpy.asarray(y).astype('i8')),
+    '|': lambda x, y: numpy.bitwise_or(numpy.asarray(x).astype('i8'), numpy.asarray(y).astype('i8')),
+    '^': lambda x, y: numpy.bitwise_xor(numpy.asarray(x).astype('i8'), numpy.asarray(y).astype('i8')),
+}
+_unary = { '-': numpy.negative, '+': lambda x: x, '!': lambda x: ~_truth(x) }
+
+def _eval(node, getColumn):
+    """Return (value, validity mask) of node: the mask is None if all the values are valid,
+       otherwise a boolean array with the layout of the values (per entry, or per element of arrays)"""
+    kind = node[0]
+    if kind == 'num': return node[1], None
+    if kind == 'var': return _load(getColumn, node[1]), None
+    if kind == 'unary': return _apply(_unary[node[1]], [_eval(node[2], getColumn)])
+    if kind == 'binary': return _apply(_binary[node[1]], [_eval(node[2], getColumn), _eval(node[3], getColumn)])
+    if kind == 'ternary':
+        return _apply(lambda c, x, y: numpy.where(_truth(c), x, y), [_eval(child, getColumn) for child in node[1:]])
+    if kind == 'index': return _index(_eval(node[1], getColumn), _eval(node[2], getColumn))
+    if kind == 'call':
+        name = node[1]
+        args = [_eval(arg, getColumn) for arg in node[2]]
+        if name in _reductions:
+            if len(args) != 1: raise RuntimeError("%s takes one argument" % name)
+            return _reduce(name, args[0])
+        if name == 'Alt$':
+            if len(args) != 2: raise RuntimeError("Alt$ takes two arguments")
+            return _alt(args[0], args[1])
+        return _apply(_functions[name], args)
+    raise RuntimeError("Unknown expression node %s" % kind)
@@ -11,7 +11,7 @@ class JobReport :
            ET.SubElement(self.performancesummary, "Metric", Name="Parameter-untracked-bool-stats",Value="true")
            ET.SubElement(self.performancesummary, "Metric", Name="Parameter-untracked-string-cacheHint",Value="application-only")
            ET.SubElement(self.performancesummary, "Metric", Name="Parameter-untracked-string-readHint",Value="auto-detect")
-           ET.SubElement(self.performancesummary, "Metric", Name="ROOT-tfile-read-totalMegabytes",Value="0")
+           self.readMegabytes = ET.SubElement(self.performancesummary, "Metric", Name="ROOT-tfile-read-totalMegabytes",Value="0")
            ET.SubElement(self.performancesummary, "Metric", Name="ROOT-tfile-write-totalMegabytes",Value="0")
     #<Metric Name="Parameter-untracked-bool-enabled" Value="true"/>
     #<Metric Name="Parameter-untracked-bool-stats" Value="true"/>
@@ -24,7 +24,7 @@ class JobReport :
 #<GeneratorInfo>
 #</GeneratorInfo>
 
-       def addInputFile(self,filename,eventsRead=1,runsAndLumis={"1":[1]}) :
+       def addInputFile(self,filename,eventsRead=1,runsAndLumis={"1":[1]},readStats=None) :
            infile = ET.SubElement(self.fjr, "InputFile")
 	   ET.SubElement(infile,"LFN").text=re.sub(r".*?(/store/.*\.root)(\?.*)?",r"\1", filename) 
 	   ET.SubElement(infile,"PFN").text=""
@@ -39,6 +39,15 @@ class JobReport :
 	   	run=ET.SubElement(runs,"Run",ID="%s"%r)
 	   	for l in ls :
 		   ET.SubElement(run,"LumiSection",ID="%s"%l)
+           if readStats :
+                self.addReadStatistics(infile,readStats)
+
+       def addReadStatistics(self,infile,readStats):
+           """Record the read statistics of an input file, and add them to the storage statistics of the job"""
+           ET.SubElement(infile,"ReadStatistics",BytesRead="%d"%readStats['bytesRead'],ReadCalls="%d"%readStats['readCalls'],
+                         CacheSize="%d"%readStats['cacheSize'],CacheBytesRead="%d"%readStats['cacheBytesRead'],NoCacheBytesRead="%d"%readStats['noCacheBytesRead'],
+                         UnzipTime="%.3f"%readStats['unzipTime'],DiskTime="%.3f"%readStats['diskTime'])
+           self.readMegabytes.set("Value","%.3f"%(float(self.readMegabytes.get("Value"))+readStats['bytesRead']/1e6))
 
        def addOutputFile(self,filename,events=1,runsAndLumis={"1":[1]}):
            infile = ET.SubElement(self.fjr, "File")
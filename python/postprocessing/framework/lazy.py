@@ -0,0 +1,73 @@
+import fnmatch
+from PhysicsTools.NanoAODTools.postprocessing.framework.eventloop import moduleLabels
+
+class LazyProviders:
+    """Producer modules run on demand (lazy mode), at most once per entry.
+
+       A provider is run when an event attribute or branch it declares in produces is requested from the Event and not
+       set yet (see Event.__getattr__), or at the end of an accepted entry if it fills branches kept in the output.
+       Otherwise it is not run at all for the entry. Providers must accept all events: the selections that only
+       collect objects, and EventSkims storing their decision, qualify.
+    """
+    def __init__(self, modules, timer=None):
+        self.modules = modules
+        self.labels = dict((id(m), label) for (m, label) in zip(modules, moduleLabels(modules)))
+        self.timer = timer
+        self.calls = dict((id(m), 0) for m in modules)
+        self.outputModules = []
+        self._exact = {}
+        self._patterns = []
+        for m in modules:
+            for name in m.produces:
+                if any(c in name for c in "*?["): self._patterns.append((name, m))
+                else: self._exact.setdefault(name, m)
+        self._lookup = {}
+    def beginFile(self, inputFile, outputFile, inputTree, wrappedOutputTree):
+        self.outputModules = []
+        for m in self.modules:
+            before = set(wrappedOutputTree._branches) if wrappedOutputTree else set()
+            if self.timer: self.timer.beginFile(self.labels[id(m)], m, inputFile, outputFile, inputTree, wrappedOutputTree)
+            else: m.beginFile(inputFile, outputFile, inputTree, wrappedOutputTree)
+            if wrappedOutputTree:
+                booked = set(wrappedOutputTree._branches) - before
+                if any(wrappedOutputTree._branches[name].tree is wrappedOutputTree.tree() for name in booked):
+                    self.outputModules.append(m)
+        inputTree._lazyProviders = self
+        self._tracer = inputTree._branchTracer
+    def endFile(self, inputFile, outputFile, inputTree, wrappedOutputTree):
+        inputTree._lazyProviders = None
+        for m in self.modules:
+            if self.timer: self.timer.endFile(self.labels[id(m)], m, inputFile, outputFile, inputTree, wrappedOutputTree)
+            else: m.endFile(inputFile, outputFile, inputTree, wrappedOutputTree)
+        print "Lazy mode: %s" % ", ".join("%s run on %d entries" % (self.labels[id(m)], self.calls[id(m)]) for m in self.modules)
+    def provide(self, event, name):
+        """Run the provider of name for the entry of event, unless it ran already; return whether it was run"""
+        if name not in self._lookup:
+            m = self._exact.get(name)
+            if m is None:
+                m = next((m for (pattern, m) in self._patterns if fnmatch.fnmatchcase(name, pattern)), None)
+            self._lookup[name] = m
+        m = self._lookup[name]
+        return m is not None and self.run(event, m)
+    def provideOutputs(self, event):
+        """Run the providers filling kept output branches, before the entry is written"""
+        for m in self.outputModules: self.run(event, m)
+    def run(self, event, m):
+        done = event.__dict__.setdefault('_lazyDone', set())
+        if id(m) in done: return False
+        done.add(id(m))
+        label = self.labels[id(m)]
+        if self._tracer:
+            current = self._tracer.current
+            self._tracer.current = label
+        ret = self.timer.analyze(label, m, event) if self.timer else m.analyze(event)
+        if self._tracer: self._tracer.current = current
+        if not ret: raise RuntimeError("%s rejected an event, so it can not be run in lazy mode" % label)
+        self.calls[id(m)] += 1
+        return True
+
+def splitProviders(modules):
+    """Split modules into those to run in the event loop, and the providers to run on demand: the modules declaring
+       what they consume and produce, other than skims"""
+    providers = [m for m in modules if getattr(m, 'consumes', None) is not None and getattr(m, 'produces', None)]
+    return ([m for m in modules if m not in providers], providers)
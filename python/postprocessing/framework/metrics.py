@@ -0,0 +1,175 @@
+import os
+import time
+import resource
+import threading
+import BaseHTTPServer
+
+class MetricsRegistry:
+    """Counters and gauges of a running job, rendered in the Prometheus text exposition format.
+
+       Values are set from the event loop thread and rendered from the exporter thread, under a lock.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {} # name -> [type, help, {labels: value}]
+        self._order = []
+    def declare(self, name, metricType, help):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = [metricType, help, {}]
+                self._order.append(name)
+    def set(self, name, value, **labels):
+        key = tuple(sorted(labels.iteritems()))
+        with self._lock:
+            self._metrics[name][2][key] = value
+    def inc(self, name, value=1, **labels):
+        key = tuple(sorted(labels.iteritems()))
+        with self._lock:
+            values = self._metrics[name][2]
+            values[key] = values.get(key, 0) + value
+    def clear(self, name):
+        with self._lock:
+            self._metrics[name][2].clear()
+    def render(self):
+        lines = []
+        with self._lock:
+            for name in self._order:
+                (metricType, help, values) = self._metrics[name]
+                lines.append("# HELP %s %s" % (name, help))
+                lines.append("# TYPE %s %s" % (name, metricType))
+                for key in sorted(values):
+                    labels = ",".join('%s="%s"' % (k, _escape(v)) for (k, v) in key)
+                    lines.append("%s%s %s" % (name, "{%s}" % labels if labels else "", _format(values[key])))
+        return "\n".join(lines) + "\n"
+
+class MetricsExporter:
+    """Publishes a MetricsRegistry: rewritten atomically to fileName every interval seconds, and/or served at
+       http://localhost:port/metrics, from daemon threads"""
+    def __init__(self, registry, fileName=None, port=None, interval=10.):
+        self.registry = registry
+        self.fileName = fileName
+        self.interval = interval
+        self._stop = threading.Event()
+        self._threads = []
+        self._server = None
+        if port is not None:
+            self._server = BaseHTTPServer.HTTPServer(("", port), _MetricsHandler)
+            self._server.registry = registry
+            self._startThread(self._server.serve_forever, "MetricsServer")
+            print "Serving job metrics at http://localhost:%d/metrics" % self._server.server_address[1]
+        if fileName is not None:
+            self._startThread(self._flushPeriodically, "MetricsWriter")
+    def flush(self):
+        if self.fileName is None: return
+        tmpName = "%s.tmp%d" % (self.fileName, os.getpid())
+        out = open(tmpName, 'w')
+        out.write(self.registry.render())
+        out.close()
+        os.rename(tmpName, self.fileName)
+    def close(self):
+        """Stop the threads, after a last flush"""
+        self._stop.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+        for thread in self._threads: thread.join()
+        self.flush()
+    def _startThread(self, target, name):
+        thread = threading.Thread(target=target, name=name)
+        thread.daemon = True
+        thread.start()
+        self._threads.append(thread)
+    def _flushPeriodically(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.flush()
+            except (IOError, OSError), e:
+                print "Could not write the job metrics to %s: %s" % (self.fileName, e)
+
+class JobMetrics:
+    """The metrics of a PostProcessor job, kept up to date from the event loop every `every` entries"""
+    prefix = "nanoaod_"
+    def __init__(self, registry, timer=None, every=1000):
+        self.registry = registry
+        self.timer = timer
+        self.every = every
+        for (name, metricType, help) in [
+                ("entries_processed_total", "counter", "Entries run through the modules"),
+                ("entries_accepted_total", "counter", "Entries accepted by all the modules"),
+                ("accept_rate", "gauge", "Fraction of the processed entries accepted"),
+                ("entries_per_second", "gauge", "Processing rate in the current file"),
+                ("files_done_total", "counter", "Input files (or entry ranges) completed"),
+                ("current_file_info", "gauge", "Input file being processed"),
+                ("module_seconds_total", "counter", "Wall time spent in the analyze method of each module"),
+                ("module_calls_total", "counter", "Calls to the analyze method of each module"),
+                ("input_bytes_read_total", "counter", "Bytes read from the input files"),
+                ("output_bytes_written_total", "counter", "Bytes written to the output files"),
+                ("resident_memory_bytes", "gauge", "Resident set size of the process"),
+                ("last_update_timestamp_seconds", "gauge", "Time of the last update, to spot stuck jobs")]:
+            registry.declare(self.prefix+name, metricType, help)
+        self._done = {"entries_processed_total": 0, "entries_accepted_total": 0, "input_bytes_read_total": 0, "output_bytes_written_total": 0}
+        self._t0 = time.time()
+        self.update()
+    def beginFile(self, fileName):
+        self.registry.clear(self.prefix+"current_file_info")
+        self.registry.set(self.prefix+"current_file_info", 1, file=fileName)
+        self._t0 = time.time()
+    def update(self, doneEvents=0, acceptedEvents=0, inputFile=None, outputFile=None):
+        """Set the metrics from the counts of the file being processed"""
+        current = {"entries_processed_total": doneEvents, "entries_accepted_total": acceptedEvents,
+                   "input_bytes_read_total": inputFile.GetBytesRead() if inputFile else 0,
+                   "output_bytes_written_total": outputFile.GetBytesWritten() if outputFile else 0}
+        for name, value in current.iteritems():
+            self.registry.set(self.prefix+name, self._done[name] + value)
+        processed = self._done["entries_processed_total"] + doneEvents
+        if processed: self.registry.set(self.prefix+"accept_rate", (self._done["entries_accepted_total"] + acceptedEvents)/float(processed))
+        self.registry.set(self.prefix+"entries_per_second", doneEvents/max(time.time() - self._t0, 1e-9))
+        if self.timer:
+            for label in self.timer.labels:
+                self.registry.set(self.prefix+"module_seconds_total", self.timer.stats[label]["wallTime"], module=label)
+                self.registry.set(self.prefix+"module_calls_total", self.timer.stats[label]["calls"], module=label)
+        self.registry.set(self.prefix+"resident_memory_bytes", residentMemory())
+        self.registry.set(self.prefix+"last_update_timestamp_seconds", time.time())
+    def endFile(self, doneEvents, acceptedEvents, inputFile=None, outputFile=None):
+        self.update(doneEvents, acceptedEvents, inputFile, outputFile)
+        self.addFile(doneEvents, acceptedEvents, inputFile.GetBytesRead() if inputFile else 0, outputFile.GetBytesWritten() if outputFile else 0)
+    def addFile(self, doneEvents, acceptedEvents, bytesRead=0, bytesWritten=0):
+        """Count a completed file, e.g. processed by a worker process"""
+        for name, value in [("entries_processed_total", doneEvents), ("entries_accepted_total", acceptedEvents),
+                            ("input_bytes_read_total", bytesRead), ("output_bytes_written_total", bytesWritten)]:
+            self._done[name] += value
+        self.registry.inc(self.prefix+"files_done_total")
+        self.update()
+    def totals(self):
+        """Counts of the completed files, as arguments of addFile"""
+        return tuple(self._done[name] for name in ("entries_processed_total", "entries_accepted_total", "input_bytes_read_total", "output_bytes_written_total"))
+
+def residentMemory():
+    """Resident set size of this process in bytes (the peak one where /proc is not available)"""
+    try:
+        return int(open("/proc/self/statm").read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (IOError, OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+####### PRIVATE IMPLEMENTATION PART #######
+
+class _MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.server.registry.render()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    def log_message(self, format, *args):
+        pass # keep the job output clean
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format(value):
+    if isinstance(value, float): return repr(value)
+    return str(value)
@@ -0,0 +1,258 @@
+import os
+import json
+import types
+import inspect
+import hashlib
+import numpy
+from PhysicsTools.NanoAODTools.postprocessing.framework.eventloop import Module, moduleLabel
+from PhysicsTools.NanoAODTools.postprocessing.framework.output import OutputTree, _rootBranchType2NumpyType
+from PhysicsTools.NanoAODTools.postprocessing.framework.skimcache import EntryListCache
+
+class ModuleOutputCache(EntryListCache):
+    """On-disk cache of the output branches of modules, one compressed numpy file per module and input file.
+
+       A file holds, for every input tree entry the module was run on, its decision and the values it filled,
+       aligned by entry number like a friend tree. Keys are built by moduleKeys and fileKey; storage, atomic
+       writes and eviction of the least recently used files are those of EntryListCache.
+    """
+    def get(self, key):
+        """Return the content stored for key (a dict of numpy arrays, plus the branch specs under 'spec'), or None"""
+        fileName = self._fileName(key)
+        try:
+            data = numpy.load(fileName)
+            content = dict((name, data[name]) for name in data.files)
+            data.close()
+            content['spec'] = json.loads(str(content['spec']))
+        except (IOError, KeyError, ValueError):
+            return None
+        try:
+            os.utime(fileName, None) # mark as recently used
+        except OSError:
+            pass
+        return content
+    def put(self, key, content):
+        fileName = self._fileName(key)
+        tmpName = "%s.tmp%d" % (fileName, os.getpid())
+        arrays = dict(content)
+        arrays['spec'] = numpy.array(json.dumps(content['spec']))
+        out = open(tmpName, 'wb')
+        numpy.savez_compressed(out, **arrays)
+        out.close()
+        os.rename(tmpName, fileName)
+        self._evict()
+
+class CachedModule(Module):
+    """Wraps a cacheable module: for the entries found in the cache its branches are filled with the stored values
+       and its stored decision is returned, instead of running it. Other entries are run through the module and
+       recorded, and the cache is rewritten at the end of the file, keeping the cached entries that were not
+       processed (e.g. outside of the entry range of this job).
+
+       A module is cacheable (cacheable = True) if its only effects are the branches it fills: it does not set event
+       attributes or modify objects read by later modules, fill histograms, or keep state across entries. Later modules
+       reading its branches get them from the input tree extra branches, as when it runs.
+       Its output must only depend on the input entry and on its configuration as seen by moduleFingerprint: a module
+       reading external inputs (model or scale factor files, helpers from other python files) must list their content
+       hash (fileHash, sourceHash) in cacheConfig(), otherwise the cache keeps serving the outputs of the old ones.
+    """
+    def __init__(self, module, cache, key):
+        self.wrappedModule = module
+        self.cache = cache
+        self.key = key
+        self.writeHistFile = False
+    @property
+    def inputBranches(self):
+        return getattr(self.wrappedModule, 'inputBranches', [])
+    def beginFile(self, inputFile, outputFile, inputTree, wrappedOutputTree):
+        self.out = wrappedOutputTree
+        self.recorder = _RecordingOutput(wrappedOutputTree)
+        self.wrappedModule.beginFile(inputFile, outputFile, inputTree, self.recorder)
+        self.cached = self.cache.get(self.key)
+        if self.cached is not None and self.cached['spec'] != self.recorder.specs:
+            print "Ignoring the cached output of %s, which has different branches" % moduleLabel(self.wrappedModule)
+            self.cached = None
+        self.rows = {}
+        if self.cached is not None:
+            self.rows = dict((entry, i) for (i, entry) in enumerate(self.cached['entries'].tolist()))
+            self.offsets = _offsets(self.cached)
+        self.recorded = [] # (entry, row in the cache) or (entry, decision, values) for the entries that were run
+        self.nComputed = 0
+    def analyze(self, event):
+        entry = event._tree.currentTreeEntry()
+        row = self.rows.get(entry)
+        if row is None:
+            self.recorder.values = {}
+            ret = self.wrappedModule.analyze(event)
+            self.recorded.append((entry, bool(ret), self.recorder.values))
+            self.nComputed += 1
+            return ret
+        for (i, (name, rootBranchType, n, lenVar)) in enumerate(self.recorder.specs):
+            if self.cached['filled%d' % i][row]:
+                self.out.fillBranch(name, self._cachedValue(self.cached, self.offsets, i, row))
+        self.recorded.append((entry, row))
+        return bool(self.cached['accepted'][row])
+    def endFile(self, inputFile, outputFile, inputTree, wrappedOutputTree):
+        self.wrappedModule.endFile(inputFile, outputFile, inputTree, self.recorder)
+        print "%s: %d entries from the cache, %d computed" % (moduleLabel(self.wrappedModule), len(self.recorded) - self.nComputed, self.nComputed)
+        if self.nComputed: self.cache.put(self.key, self._content())
+        self.cached = None
+        self.rows = {}
+        self.recorded = []
+    def _cachedValue(self, cached, offsets, i, row):
+        (name, rootBranchType, n, lenVar) = self.recorder.specs[i]
+        values = cached['content%d' % i][offsets[i][row]:offsets[i][row+1]]
+        return values.tolist() if (lenVar or n > 1) else values[0].item()
+    def _cachedRecord(self, cached, offsets, row, entry):
+        """(entry, decision, values) of a row of the cache content"""
+        values = dict((name, self._cachedValue(cached, offsets, i, row)) for (i, (name, rootBranchType, n, lenVar)) in enumerate(self.recorder.specs)
+                      if cached['filled%d' % i][row])
+        return (entry, bool(cached['accepted'][row]), values)
+    def _content(self):
+        """Arrays for the entries processed in this file and those already in the cache, in entry order"""
+        records = dict((r[0], r if len(r) == 3 else self._cachedRecord(self.cached, self.offsets, r[1], r[0])) for r in self.recorded)
+        # read the cache again, for the entries written since beginFile by jobs on other entry ranges
+        latest = self.cache.get(self.key)
+        if latest is not None and latest['spec'] == self.recorder.specs:
+            offsets = _offsets(latest)
+            for (row, entry) in enumerate(latest['entries'].tolist()):
+                if entry not in records: records[entry] = self._cachedRecord(latest, offsets, row, entry)
+        records = [records[entry] for entry in sorted(records)]
+        content = { 'spec': self.recorder.specs,
+                    'entries': numpy.array([r[0] for r in records], dtype='i8'),
+                    'accepted': numpy.array([r[1] for r in records], dtype=bool) }
+        for (i, (name, rootBranchType, n, lenVar)) in enumerate(self.recorder.specs):
+            filled, counts, flat = [], [], []
+            for r in records:
+                val = r[2].get(name)
+                filled.append(val is not None)
+                if val is None:
+                    counts.append(0)
+                elif lenVar or n > 1:
+                    counts.append(len(val))
+                    flat.extend(val)
+                else:
+                    counts.append(1)
+                    flat.append(val)
+            content['filled%d' % i] = numpy.array(filled, dtype=bool)
+            content['counts%d' % i] = numpy.array(counts, dtype='i4')
+            content['content%d' % i] = numpy.array(flat, dtype=_rootBranchType2NumpyType[rootBranchType])
+        return content
+
+def moduleFingerprint(module):
+    """Hash of what determines the output of a module: its class, the source file defining it, and its configuration.
+
+       The configuration is what cacheConfig() returns if the module defines it, else the arguments of the constructor
+       (recorded by Module.__new__), or for modules not deriving from Module their attributes. Functions, such as the lambdas selecting input collections, are hashed by their
+       code, defaults, closures and the plain values of the globals they use.
+    """
+    h = hashlib.sha1()
+    cls = module.__class__
+    h.update("%s.%s" % (cls.__module__, cls.__name__))
+    h.update(sourceHash(cls))
+    if hasattr(module, 'cacheConfig'):
+        config = module.cacheConfig()
+    else:
+        config = getattr(module, '_constructorArgs', None)
+        if config is None: config = vars(module)
+    h.update(_fingerprint(config, set(), 0))
+    return h.hexdigest()
+
+def moduleKeys(modules):
+    """Keys of the modules of a chain: each one covers the fingerprints of the module and of all the modules before it"""
+    keys = []
+    upstream = ""
+    for m in modules:
+        upstream = hashlib.sha1(upstream + moduleFingerprint(m)).hexdigest()
+        keys.append(upstream)
+    return keys
+
+def fileKey(inFile, treeName, friends=[]):
+    """Identifies the input of the module chain: the file UUID (unique to each written file), the tree and its friends"""
+    return ":".join([inFile.GetUUID().AsString(), treeName] + list(friends))
+
+def cacheModules(chain, modules, cache, inputKey):
+    """Wrap the cacheable modules among modules (taken from chain) in CachedModule, for the input identified by inputKey"""
+    keys = dict(zip(map(id, chain), moduleKeys(chain)))
+    return [CachedModule(m, cache, "%s:%s" % (keys[id(m)], inputKey)) if getattr(m, 'cacheable', False) else m for m in modules]
+
+def fileHash(fileName):
+    """Hash of the content of fileName, for the cacheConfig() of modules reading external files (models, scale factors)"""
+    try:
+        st = os.stat(fileName)
+    except OSError:
+        return "missing:%s" % fileName
+    key = (fileName, st.st_size, st.st_mtime)
+    if key not in _fileHashes:
+        h = hashlib.sha1()
+        f = open(fileName, 'rb')
+        for block in iter(lambda: f.read(1<<20), ''):
+            h.update(block)
+        f.close()
+        _fileHashes[key] = h.hexdigest()
+    return _fileHashes[key]
+
+def sourceHash(obj):
+    """Hash of the source file defining obj, a class or a python module (e.g. the utils helpers used by a module)"""
+    try:
+        fileName = inspect.getsourcefile(obj) or inspect.getfile(obj)
+    except TypeError:
+        return "" # builtin
+    return fileHash(fileName)
+
+####### PRIVATE IMPLEMENTATION PART #######
+
+def _offsets(cached):
+    """Offsets of the rows in the flat content of each branch of a cache content"""
+    return [numpy.concatenate(([0], numpy.cumsum(cached['counts%d' % i]))) for i in xrange(len(cached['spec']))]
+
+class _RecordingOutput:
+    """Passed to a cached module as its output tree: keeps the specs of the branches it books and the values it fills"""
+    def __init__(self, outputTree):
+        self._output = outputTree
+        self.specs = []
+        self.values = {}
+    def __getattr__(self, name):
+        return getattr(self._output, name)
+    def branch(self, name, rootBranchType, n=1, lenVar=None, title=None, limitedPrecision=False):
+        self.specs.append([name, rootBranchType, int(n), lenVar])
+        return self._output.branch(name, rootBranchType, n=n, lenVar=lenVar, title=title, limitedPrecision=limitedPrecision)
+    def fillBranch(self, name, val):
+        if isinstance(val, numpy.ndarray): self.values[name] = val.tolist()
+        elif isinstance(val, numpy.generic): self.values[name] = val.item()
+        elif isinstance(val, (int, long, float, bool)): self.values[name] = val
+        else: self.values[name] = list(val)
+        self._output.fillBranch(name, val)
+    fillBranches = OutputTree.fillBranches.im_func
+
+_fileHashes = {}
+
+def _fingerprint(value, seen, depth):
+    if value is None or isinstance(value, (bool, int, long, float, str, unicode)):
+        return repr(value)
+    if depth > 8 or id(value) in seen:
+        return "<%s>" % type(value).__name__
+    seen = seen | set([id(value)])
+    if isinstance(value, (list, tuple)):
+        return "[%s]" % ",".join(_fingerprint(v, seen, depth+1) for v in value)
+    if isinstance(value, dict):
+        return "{%s}" % ",".join(sorted("%s:%s" % (_fingerprint(k, seen, depth+1), _fingerprint(v, seen, depth+1)) for (k, v) in value.iteritems()))
+    if isinstance(value, numpy.ndarray):
+        return "array(%s,%s)" % (value.dtype.str, hashlib.sha1(numpy.ascontiguousarray(value).tostring()).hexdigest())
+    if isinstance(value, types.FunctionType):
+        code = value.func_code
+        # plain values of the globals used (e.g. configuration dicts); functions, modules and classes by name
+        globs = [(name, value.func_globals[name]) for name in code.co_names if name in value.func_globals]
+        globs = [(name, g if isinstance(g, (bool, int, long, float, str, unicode, list, tuple, dict)) else "<%s>" % type(g).__name__) for (name, g) in globs]
+        closure = [cell.cell_contents for cell in value.func_closure] if value.func_closure else []
+        return "function(%s,%s,%s,%s)" % (_codeFingerprint(code), _fingerprint(value.func_defaults, seen, depth+1),
+                                          _fingerprint(closure, seen, depth+1), _fingerprint(globs, seen, depth+1))
+    if isinstance(value, types.MethodType):
+        return "method(%s,%s)" % (value.im_func.__name__, _fingerprint(value.im_self, seen, depth+1))
+    if isinstance(value, (type, types.ClassType, types.ModuleType)):
+        return "<%s>" % value.__name__
+    if hasattr(value, '__dict__') and not type(value).__module__.startswith("ROOT") and not type(value).__module__.startswith("cppyy"):
+        return "%s(%s)" % (type(value).__name__, _fingerprint(vars(value), seen, depth+1))
+    return "<%s>" % type(value).__name__
+
+def _codeFingerprint(code):
+    consts = [_codeFingerprint(c) if isinstance(c, types.CodeType) else repr(c) for c in code.co_consts]
+    return hashlib.sha1("%s|%s|%s" % (code.co_code, ",".join(consts), ",".join(code.co_names))).hexdigest()
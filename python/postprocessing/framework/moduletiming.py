@@ -0,0 +1,78 @@
+import json
+import time
+import ROOT
+ROOT.PyConfig.IgnoreCommandLineOptions = True
+
+class ModuleTimer:
+    """Collects per-module wall and CPU time, calls and accepted events in the event loop, plus the time spent in beginFile/endFile"""
+    fields = ["wallTime", "cpuTime", "calls", "accepted", "beginFileTime", "endFileTime"]
+    def __init__(self):
+        self.labels = [] # in the order of the modules
+        self.stats = {}
+        self.readStats = [] # one dict per input file, see readstats.readStatistics
+    def module(self, label):
+        if label not in self.stats:
+            self.labels.append(label)
+            self.stats[label] = dict((f, 0) for f in self.fields)
+        return self.stats[label]
+    def analyze(self, label, m, event):
+        """Run m.analyze(event), timing it"""
+        stats = self.stats[label]
+        t0 = time.time(); c0 = time.clock()
+        ret = m.analyze(event)
+        stats["cpuTime"] += time.clock() - c0; stats["wallTime"] += time.time() - t0
+        stats["calls"] += 1
+        if ret: stats["accepted"] += 1
+        return ret
+    def add(self, label, wallTime, cpuTime, calls, accepted):
+        stats = self.module(label)
+        stats["wallTime"] += wallTime; stats["cpuTime"] += cpuTime
+        stats["calls"] += calls; stats["accepted"] += accepted
+    def beginFile(self, label, m, *args):
+        t0 = time.time()
+        m.beginFile(*args)
+        self.module(label)["beginFileTime"] += time.time() - t0
+    def endFile(self, label, m, *args):
+        t0 = time.time()
+        m.endFile(*args)
+        self.module(label)["endFileTime"] += time.time() - t0
+    def addReadStatistics(self, stats):
+        self.readStats.append(stats)
+    def merge(self, other):
+        self.readStats += other.readStats
+        for label in other.labels:
+            stats = self.module(label)
+            for f in self.fields:
+                stats[f] += other.stats[label][f]
+    def summary(self):
+        """Return the statistics as a list of dicts (one per module, in order), with the accept rate added"""
+        ret = []
+        for label in self.labels:
+            stats = dict(self.stats[label])
+            stats["module"] = label
+            stats["acceptRate"] = stats["accepted"]/float(stats["calls"]) if stats["calls"] else None
+            ret.append(stats)
+        return ret
+    def printSummary(self):
+        totWall = sum(self.stats[label]["wallTime"] for label in self.labels)
+        print "--- Module timing ---"
+        print "%-40s %10s %10s %6s %10s %9s %8s %8s" % ("module", "wall [s]", "cpu [s]", "wall%", "calls", "accepted", "begin[s]", "end[s]")
+        for stats in sorted(self.summary(), key=lambda s: s["wallTime"], reverse=True):
+            print "%-40s %10.2f %10.2f %5.1f%% %10d %8.2f%% %8.2f %8.2f" % (stats["module"], stats["wallTime"], stats["cpuTime"], 100.*stats["wallTime"]/max(totWall,1e-9),
+                    stats["calls"], 100.*(stats["acceptRate"] or 0), stats["beginFileTime"], stats["endFileTime"])
+        print "--- End of module timing ---"
+    def write(self, fileName):
+        out = open(fileName, 'w')
+        json.dump({ "modules":self.summary(), "inputFiles":self.readStats }, out, indent=2)
+        out.close()
+    def writeHistograms(self, directory):
+        """Write one histogram per quantity, with a bin per module, in directory"""
+        prevdir = ROOT.gDirectory
+        directory.cd()
+        for f in self.fields:
+            h = ROOT.TH1D(f, f, max(len(self.labels),1), 0, max(len(self.labels),1))
+            for i, label in enumerate(self.labels):
+                h.GetXaxis().SetBinLabel(i+1, label)
+                h.SetBinContent(i+1, self.stats[label][f])
+            h.Write()
+        prevdir.cd()
@@ -1,18 +1,23 @@
-from array import array
+import threading
+import Queue
+import numpy
 import ROOT
 ROOT.PyConfig.IgnoreCommandLineOptions = True
 
 from PhysicsTools.NanoAODTools.postprocessing.framework.treeReaderArrayTools import setExtraBranch
 
-_rootBranchType2PythonArray = { 'b':'B', 'B':'b', 'i':'I', 'I':'i', 'F':'f', 'D':'d', 'l':'L', 'L':'l', 'O':'B' }
+_rootBranchType2NumpyType = { 'b':'u1', 'B':'i1', 'i':'u4', 'I':'i4', 'F':'f4', 'D':'f8', 'l':'u8', 'L':'i8', 'O':'u1' }
 
 class OutputBranch:
     def __init__(self, tree, name, rootBranchType, n=1, lenVar=None, title=None, limitedPrecision=False):
         n = int(n)
-        self.buff   = array(_rootBranchType2PythonArray[rootBranchType], n*[0. if rootBranchType in 'FD' else 0])
+        self.buff   = numpy.zeros(n, dtype=_rootBranchType2NumpyType[rootBranchType])
+        self.writeBuff = None # buffer attached to the branch when rows are filled by an AsyncWriter
+        self.tree = tree
         self.lenVar = lenVar
         self.n = n
-        self.precision = ROOT.ReduceMantissaToNbitsRounding(limitedPrecision) if limitedPrecision and rootBranchType=='F' else lambda x : x
+        self.bits = limitedPrecision if limitedPrecision and rootBranchType=='F' else None
+        self.precision = ROOT.ReduceMantissaToNbitsRounding(limitedPrecision) if self.bits else lambda x : x
         #check if a branch was already there 
         existingBranch = tree.GetBranch(name)
         if (existingBranch):
@@ -28,16 +33,43 @@ class OutputBranch:
         if title: self.branch.SetTitle(title)
 
     def fill(self, val):
+        """Fill with a value, or for arrays with a list, numpy array or any other buffer, copied in one go"""
         if self.lenVar:
-            if len(self.buff) < len(val): # realloc
-                self.buff = array(self.buff.typecode, max(len(val),2*len(self.buff))*[0. if self.buff.typecode in 'fd' else 0])
-                self.branch.SetAddress(self.buff)
-            for i,v in enumerate(val): self.buff[i] = self.precision(v)
+            n = len(val)
+            if len(self.buff) < n: # realloc
+                self.buff = numpy.zeros(max(n,2*len(self.buff)), dtype=self.buff.dtype)
+                if self.writeBuff is None: self.branch.SetAddress(self.buff)
+            if n:
+                numpy.copyto(self.buff[:n], val, casting='unsafe')
+                if self.bits: reduceMantissa(self.buff[:n], self.bits)
         elif self.n == 1: 
             self.buff[0] = self.precision(val)
         else:
-            if len(val) != self.n: raise RuntimeError("Mismatch in filling branch %s of fixed length %d with %d values (%s)" % (self.Branch.GetName(),self.n,len(val),val))
-            for i,v in enumerate(val): self.buff[i] = v
+            if len(val) != self.n: raise RuntimeError("Mismatch in filling branch %s of fixed length %d with %d values (%s)" % (self.branch.GetName(),self.n,len(val),val))
+            numpy.copyto(self.buff, val, casting='unsafe')
+
+    def setWriteBuffer(self):
+        """Attach the branch to a separate buffer, so that fill() can prepare the next row while the previous one is written"""
+        self.writeBuff = self.buff.copy()
+        self.branch.SetAddress(self.writeBuff)
+    def restore(self, values):
+        """Copy a row taken from buff into the buffer attached to the branch"""
+        if len(values) > len(self.writeBuff):
+            self.writeBuff = numpy.zeros(len(values), dtype=self.writeBuff.dtype)
+            self.branch.SetAddress(self.writeBuff)
+        self.writeBuff[:len(values)] = values
+
+def reduceMantissa(values, bits):
+    """Round in place the mantissa of the float32 numpy array values to bits bits, as ReduceMantissaToNbitsRounding does"""
+    shift = 23-bits
+    mask = (0xFFFFFFFF >> shift) << shift
+    test = 1 << (shift-1)
+    maxn = (1 << bits) - 2
+    i32 = values.view('u4')
+    mantissa = (i32 & 0x007FFFFF) >> shift
+    mantissa += (mantissa < maxn)
+    rounded = (i32 & 0xFF800000) | (mantissa << shift)
+    i32[:] = numpy.where(i32 & test, rounded, i32 & mask)
 
 class OutputTree:
     def __init__(self, tfile, ttree, intree):
@@ -45,11 +77,19 @@ class OutputTree:
         self._tree = ttree
         self._intree = intree
         self._branches = {} 
+        self._asyncQueueSize = 0
+        self._writer = None
     def branch(self, name, rootBranchType, n=1, lenVar=None, title=None,limitedPrecision=False):
-        if (lenVar != None) and (lenVar not in self._branches): #and (not self._tree.GetBranch(lenVar)):
-            self._branches[lenVar] = OutputBranch(self._tree, lenVar, "i")
-        self._branches[name] = OutputBranch(self._tree, name, rootBranchType, n=n, lenVar=lenVar, title=title,limitedPrecision=limitedPrecision)
+        if lenVar != None:
+            lenTree = self._branchTree(lenVar, countOf=name)
+            # (re)book the counter in the output tree if this array is the first one kept that needs it
+            if (lenVar not in self._branches) or (lenTree is self._tree and self._branches[lenVar].tree is not self._tree):
+                self._branches[lenVar] = OutputBranch(lenTree, lenVar, "i")
+        self._branches[name] = OutputBranch(self._branchTree(name), name, rootBranchType, n=n, lenVar=lenVar, title=title,limitedPrecision=limitedPrecision)
         return self._branches[name]
+    def _branchTree(self, name, countOf=None):
+        """Tree in which the output branch name (the length of the array countOf, if given) is created"""
+        return self._tree
     def fillBranch(self, name, val):
         br = self._branches[name]
         if br.lenVar and (br.lenVar in self._branches):
@@ -57,13 +97,81 @@ class OutputTree:
             setExtraBranch(self._intree,br.lenVar,len(val))
         br.fill(val)
         setExtraBranch(self._intree,name,val)
+    def fillBranches(self, prefix, objects, fields):
+        """Fill the branches prefix_field for all fields with the values of the objects, e.g. fillBranches("selectedJets", jets, ["pt", "eta"])
+
+           If objects is an ArrayCollection, whole columns are copied at once.
+        """
+        if hasattr(objects, 'column'):
+            for field in fields:
+                self.fillBranch(prefix+"_"+field, objects.column(field))
+        else:
+            for field in fields:
+                self.fillBranch(prefix+"_"+field, [getattr(obj, field) for obj in objects])
     def tree(self):
         return self._tree
     def fill(self):
-        self._tree.Fill()
+        if self._asyncQueueSize: self._asyncFill()
+        else: self._tree.Fill()
+    def setAsync(self, queueSize=1000):
+        """Fill the tree in a writer thread: fill() only queues a copy of the row, at most queueSize rows are kept waiting"""
+        self._asyncQueueSize = queueSize
     def write(self):
+        if self._writer:
+            self._writer.close()
+            self._writer = None
         self._file.cd()
         self._tree.Write()
+    def _asyncFill(self, entry=None):
+        if self._writer is None:
+            # all the branches are booked by now (in beginFile)
+            self._writer = AsyncWriter(self._tree, [br for br in self._branches.itervalues() if br.tree is self._tree], self._asyncQueueSize, self._writerInputTree())
+            self._writer.start()
+        self._writer.put(entry)
+    def _writerInputTree(self):
+        return None
+
+class AsyncWriter(threading.Thread):
+    """Thread that fills an output tree with the rows queued by put(), so that compression runs in parallel to the event loop.
+
+       TTree::Fill is called with the GIL released; the queue is bounded, so put() blocks when the writer lags behind.
+       If inputTree is given, it is a separate handle to the input tree, and its entry is read by the writer before each Fill.
+    """
+    def __init__(self, tree, branches, queueSize, inputTree=None):
+        threading.Thread.__init__(self, name="AsyncWriter")
+        self.daemon = True
+        self._tree = tree
+        self._branches = branches
+        self._inputTree = inputTree
+        self._queue = Queue.Queue(queueSize)
+        self._error = None
+        # release the GIL in Fill and GetEntry while the writer runs, see close()
+        self._wasThreaded = (getattr(ROOT.TTree.Fill, '_threaded', False), getattr(ROOT.TTree.GetEntry, '_threaded', False))
+        ROOT.TTree.Fill._threaded = True
+        ROOT.TTree.GetEntry._threaded = True
+        for br in branches: br.setWriteBuffer()
+    def put(self, entry=None):
+        if self._error: raise self._error
+        self._queue.put((entry, [br.buff.copy() for br in self._branches]))
+    def run(self):
+        while True:
+            item = self._queue.get()
+            if item is None: break
+            if self._error: continue # keep consuming, so that put() doesn't block
+            (entry, row) = item
+            try:
+                for br, values in zip(self._branches, row):
+                    br.restore(values)
+                if self._inputTree is not None: self._inputTree.GetEntry(entry)
+                self._tree.Fill()
+            except Exception, e:
+                self._error = e
+    def close(self):
+        """Wait until all the queued rows are filled"""
+        self._queue.put(None)
+        self.join()
+        (ROOT.TTree.Fill._threaded, ROOT.TTree.GetEntry._threaded) = self._wasThreaded
+        if self._error: raise self._error
 
 class FullOutput(OutputTree):
     def __init__(
@@ -77,7 +185,8 @@ class FullOutput(OutputTree):
             maxEntries=None,
             firstEntry=0,
             provenance=False,
-            jsonFilter=None
+            jsonFilter=None,
+            writerInputTree=None
     ):
         outputFile.cd()
 
@@ -85,16 +194,33 @@ class FullOutput(OutputTree):
         self.outputbranchSelection = outputbranchSelection
         self.maxEntries = maxEntries
         self.firstEntry = firstEntry
-        if fullClone:
+        # with writerInputTree (a separate handle to the input), the output is cloned from it and filled by an AsyncWriter
+        self._writerTree = writerInputTree if not fullClone else None
+        sourceTree = self._writerTree if self._writerTree else inputTree
+        # only the branches active in the source tree are cloned: apply the output selection first,
+        # so that dropped branches are never filled and the tree is written only once
+        if outputbranchSelection:
+            outputbranchSelection.selectBranches(sourceTree)
+        if fullClone and inputTree.GetEntryList():
+            # the entry list of the preselection is already restricted to the range, and with an entry list
+            # the range of CopyTree would count positions in the list instead of tree entries
+            outputTree = inputTree.CopyTree('1')
+        elif fullClone:
             outputTree = inputTree.CopyTree('1', "", maxEntries if maxEntries else ROOT.TVirtualTreePlayer.kMaxEntries, firstEntry)
         else:            
-            outputTree = inputTree.CloneTree(0)
+            outputTree = sourceTree.CloneTree(0)
             
         # enable back all branches in inputTree, then disable for computation
         # the branches as requested in branchSelection
         inputTree.SetBranchStatus("*",1)
         if branchSelection:
             branchSelection.selectBranches(inputTree)
+            if not self._writerTree:
+                # the branches copied to the output must still be read
+                for b in outputTree.GetListOfBranches():
+                    if inputTree.GetBranch(b.GetName()): inputTree.SetBranchStatus(b.GetName(),1)
+        # branches made by modules but dropped by the output selection are attached to a tree that is never filled
+        self._scratchTree = None
 
         OutputTree.__init__(self, outputFile, outputTree, inputTree)
         self._inputTree = inputTree
@@ -109,24 +235,33 @@ class FullOutput(OutputTree):
             elif kn in ("LuminosityBlocks", "Runs"):
                 if not jsonFilter: self._otherTrees[kn] = inputFile.Get(kn).CopyTree('1' if firstEntry == 0 else '0')
                 elif firstEntry == 0:
-                    _isRun = (kn=="Runs")
-                    _it = inputFile.Get(kn)
-                    _ot = _it.CloneTree(0)
-                    for ev in _it:
-                        if (jsonFilter.filterRunOnly(ev.run) if _isRun else jsonFilter.filterRunLumi(ev.run,ev.luminosityBlock)): _ot.Fill()
-                    self._otherTrees[kn] = _ot
+                    self._otherTrees[kn] = jsonFilter.filterTree(inputFile.Get(kn), runsOnly=(kn=="Runs"))
             elif k.GetClassName() == "TTree":
                 print "Not copying unknown tree %s" % kn
             else:
                 self._otherObjects[kn] = inputFile.Get(kn)
+    def _branchTree(self, name, countOf=None):
+        if self.outputbranchSelection and not self.outputbranchSelection.isKept(name):
+            if countOf is not None and self.outputbranchSelection.isKept(countOf):
+                print "Warning: keeping %s in the output although the output branch selection drops it, as it is the length of %s" % (name, countOf)
+                return self._tree
+            if self._scratchTree is None:
+                self._scratchTree = ROOT.TTree("scratch", "dropped output branches")
+                self._scratchTree.SetDirectory(0)
+            return self._scratchTree
+        return self._tree
     def fill(self):
+        if self._asyncQueueSize:
+            self._asyncFill(self._inputTree.currentTreeEntry() if self._writerTree else None)
+            return
         self._inputTree.readAllBranches()
         self._tree.Fill()
+    def setAsync(self, queueSize=1000):
+        if not self._writerTree: raise RuntimeError("Asynchronous filling of the full output needs a separate handle to the input tree")
+        OutputTree.setAsync(self, queueSize)
+    def _writerInputTree(self):
+        return self._writerTree
     def write(self):
-        if self.outputbranchSelection:
-            self.outputbranchSelection.selectBranches(self._tree)
-        self._tree = self.tree().CopyTree('1', "", self.maxEntries if self.maxEntries else ROOT.TVirtualTreePlayer.kMaxEntries, self.firstEntry)
-
         OutputTree.write(self)
         for t in self._otherTrees.itervalues():
             t.Write()
@@ -1,23 +1,45 @@
 #!/usr/bin/env python
 import os
 import time
+import multiprocessing
 import ROOT
 ROOT.PyConfig.IgnoreCommandLineOptions = True
 from PhysicsTools.NanoAODTools.postprocessing.framework.branchselection import BranchSelection
+from PhysicsTools.NanoAODTools.postprocessing.framework.branchtracing import BranchTracer
 from PhysicsTools.NanoAODTools.postprocessing.framework.datamodel import InputTree
-from PhysicsTools.NanoAODTools.postprocessing.framework.eventloop import eventLoop
+from PhysicsTools.NanoAODTools.postprocessing.framework.eventloop import Module, eventLoop, moduleLabel
+from PhysicsTools.NanoAODTools.postprocessing.framework.chunkloop import chunkedEventLoop
 from PhysicsTools.NanoAODTools.postprocessing.framework.output import FriendOutput, FullOutput
-from PhysicsTools.NanoAODTools.postprocessing.framework.preskimming import preSkim
+from PhysicsTools.NanoAODTools.postprocessing.framework.preskimming import preSkim, cutflowCounts
+from PhysicsTools.NanoAODTools.postprocessing.framework.expressions import compileExpression
 from PhysicsTools.NanoAODTools.postprocessing.framework.jobreport import JobReport
+from PhysicsTools.NanoAODTools.postprocessing.framework.compression import parseCompression, autoCompression
+from PhysicsTools.NanoAODTools.postprocessing.framework.moduletiming import ModuleTimer
+from PhysicsTools.NanoAODTools.postprocessing.framework.sharding import splitEntries, mergeShards
+from PhysicsTools.NanoAODTools.postprocessing.framework.staging import InputStager
+from PhysicsTools.NanoAODTools.postprocessing.framework.skimcache import EntryListCache
+from PhysicsTools.NanoAODTools.postprocessing.framework.checkpoint import Checkpoint
+from PhysicsTools.NanoAODTools.postprocessing.framework.scheduler import scheduleModules
+from PhysicsTools.NanoAODTools.postprocessing.framework.lazy import LazyProviders, splitProviders
+from PhysicsTools.NanoAODTools.postprocessing.framework.modulecache import ModuleOutputCache, cacheModules, fileKey
+from PhysicsTools.NanoAODTools.postprocessing.framework.metrics import MetricsRegistry, MetricsExporter, JobMetrics
+from PhysicsTools.NanoAODTools.postprocessing.framework.readstats import setupTreeCache, startReadStatistics, readStatistics, sumReadStatistics, formatReadStatistics
 
 class PostProcessor :
     def __init__(self,outputDir,inputFiles,cut=None,branchsel=None,modules=[],compression="LZMA:9",friend=False,postfix=None,
 		 jsonInput=None,noOut=False,justcount=False,provenance=False,haddFileName=None,fwkJobReport=False,histFileName=None,histDirName=None, outputbranchsel=None,
-		 maxEvents=-1,treeName="Events", cutFlow=False):
+                 maxEvents=-1,treeName="Events", cutFlow=False, chunkSize=None, nWorkers=1, traceBranches=None, traceEvents=1000, moduleTiming=False, asyncOutput=False, outputQueueSize=1000,
+                 cacheSize=None, cacheLearnEntries=None, prefetch=False, longTermCache=False, stagingDir=None, stagingMaxSize=None,
+                 maxEntries=None, firstEntry=0, preSkimCacheDir=None, preSkimCacheMaxSize=None, preSkimEngine="draw", pushdownSkims=False, checkpoint=False, moduleCacheDir=None, moduleCacheMaxSize=None, schedule=False, lazy=False, metricsFile=None, metricsPort=None, metricsInterval=10):
 	self.outputDir=outputDir
 	self.inputFiles=inputFiles
 	self.cut=cut
-	self.modules=modules
+        # with schedule, duplicate modules are dropped and skims moved ahead of the producers they do not need
+        self.modules=scheduleModules(modules) if schedule else modules
+        self.lazy = lazy
+        if lazy and chunkSize:
+            print "Lazy mode is not supported by the chunked event loop, running all the modules"
+            self.lazy = False
 	self.compression=compression
 	self.postfix=postfix
 	self.json=jsonInput
@@ -32,9 +54,41 @@ class PostProcessor :
 	self.maxEvents = maxEvents
 	self.treeName = treeName
 	self.cutFlow = cutFlow
+        self.chunkSize = chunkSize
+        self.nWorkers = nWorkers
+        self.traceBranches = traceBranches
+        self.traceEvents = traceEvents
+        self.branchTracer = None
+        self.moduleTiming = moduleTiming
+        # the per-module times are also exported with the metrics
+        self.moduleTimer = ModuleTimer() if moduleTiming or metricsFile or metricsPort is not None else None
+        self.metrics = JobMetrics(MetricsRegistry(), self.moduleTimer) if metricsFile or metricsPort is not None else None
+        self.metricsFile = metricsFile
+        self.metricsPort = metricsPort
+        self.metricsInterval = metricsInterval
+        self.asyncOutput = asyncOutput
+        self.outputQueueSize = outputQueueSize
+        self.cacheSize = cacheSize
+        self.cacheLearnEntries = cacheLearnEntries
+        self.prefetch = prefetch
+        self.longTermCache = longTermCache
+        self.stagingDir = stagingDir
+        self.stagingMaxSize = stagingMaxSize
+        self.stager = None
+        self.maxEntries = maxEntries
+        self.firstEntry = firstEntry
+        self.preSkimCache = EntryListCache(preSkimCacheDir, preSkimCacheMaxSize) if preSkimCacheDir else None
+        self.preSkimEngine = preSkimEngine
+        self.pushdownSkims = pushdownSkims
+        self.checkpoint = checkpoint
+        # outputs of the cacheable modules, reused when the modules and those before them are unchanged
+        self.moduleCache = ModuleOutputCache(moduleCacheDir, moduleCacheMaxSize) if moduleCacheDir else None
+        self.journal = None
+        self._processedSteps = 0
+        self._workerHistFiles = [] # per-task histogram files of the parallel mode, removed at the end of the job
 	if self.jobReport and not self.haddFileName :
-		print "Because you requested a FJR we assume you want the final hadd. No name specified for the output file, will use tree.root"
-		self.haddFileName="tree.root"
+            print "Because you requested a FJR we assume you want the final hadd. No name specified for the output file, will use tree.root"
+            self.haddFileName="tree.root"
  	self.branchsel = BranchSelection(branchsel) if branchsel else None 
         if outputbranchsel != None:
             self.outputbranchsel = BranchSelection(outputbranchsel)
@@ -48,17 +102,31 @@ class PostProcessor :
         self.histDirName=histDirName
     def run(self) :
         outpostfix = self.postfix if self.postfix != None else ("_Friend" if self.friend else "_Skim")
+        if self.traceBranches:
+            # the outputs of the first entries of each file must not be taken for those of the full job
+            outpostfix += "_Trace"
+            if self.haddFileName: self.haddFileName = self.haddFileName.replace(".root", "")+"_Trace.root"
+            if self.histFileName: self.histFileName = self.histFileName.replace(".root", "")+"_Trace.root"
+        compressionAlgo = None
+        if self.checkpoint and not self.justcount:
+            if not os.path.exists(self.outputDir):
+                os.system("mkdir -p "+self.outputDir)
+            self.journal = Checkpoint(os.path.join(self.outputDir, "checkpoint.json"), self._checkpointConfig(outpostfix), "Friends" if self.friend else self.treeName)
+            if self.histFileName != None:
+                # the histograms of the skipped files can only be recovered from the module states
+                missing = [moduleLabel(m) for m in self.modules if getattr(m, 'writeHistFile', False) and not _savesCheckpointState(m)]
+                if missing: raise RuntimeError("Can not resume a job writing histograms with %s, which do not implement checkpointState" % ", ".join(missing))
     	if not self.noOut:
             
-            if self.compression != "none":
-                ROOT.gInterpreter.ProcessLine("#include <Compression.h>")
-                (algo, level) = self.compression.split(":")
-                compressionLevel = int(level)
-                if   algo == "LZMA": compressionAlgo  = ROOT.ROOT.kLZMA
-                elif algo == "ZLIB": compressionAlgo  = ROOT.ROOT.kZLIB
-                else: raise RuntimeError("Unsupported compression %s" % algo)
-            else:
-                compressionLevel = 0 
+            if self.compression.startswith("auto") and not self.justcount:
+                if self.journal and "compression" in self.journal.info:
+                    # keep the setting picked by the interrupted job
+                    self.compression = self.journal.info["compression"]
+                else:
+                    self.compression = self._autoCompression()
+                    if self.journal: self.journal.info["compression"] = self.compression
+                print "Will use compression "+self.compression
+            (compressionLevel, compressionAlgo) = parseCompression(self.compression) if not self.justcount else (0, None)
 	    print "Will write selected trees to "+self.outputDir
             if not self.justcount:
                 if not os.path.exists(self.outputDir):
@@ -70,11 +138,141 @@ class PostProcessor :
 	    if len(self.modules) == 0: 
 		raise RuntimeError("Running with --noout and no modules does nothing!")
 
-        # Open histogram file, if desired 
         if (self.histFileName != None and self.histDirName == None) or (self.histFileName == None and self.histDirName != None) :
             raise RuntimeError("Must specify both histogram file and histogram directory!")
-        elif self.histFileName != None and self.histDirName != None:
-            self.histFile = ROOT.TFile.Open( self.histFileName, "RECREATE" )
+
+        if self.traceBranches:
+            print "Tracing the branches read by the modules in the first %d entries of each file" % self.traceEvents
+            self.branchTracer = BranchTracer()
+            if self.nWorkers > 1:
+                print "Branch tracing runs in a single process"
+                self.nWorkers = 1
+
+        if self.asyncOutput and not self.noOut:
+            ROOT.EnableThreadSafety()
+
+        if self.prefetch:
+            self.stager = InputStager(self.stagingDir, self.longTermCache, self.stagingMaxSize)
+
+        t0 = time.time()
+        exporter = MetricsExporter(self.metrics.registry, self.metricsFile, self.metricsPort, self.metricsInterval) if self.metrics else None
+        try:
+            if self.nWorkers > 1 and not self.justcount:
+                results = self._runParallel(outpostfix, compressionLevel, compressionAlgo)
+            else:
+                results = self._runSerial(outpostfix, compressionLevel, compressionAlgo)
+        finally:
+            if self.stager: self.stager.close()
+            if exporter: exporter.close()
+
+        outFileNames=[]
+        totEntriesRead=0
+        for friendList, (outFileName, nall, nread, readStats) in zip(self.inputFiles, results):
+            totEntriesRead+=nread
+            if self.justcount: continue
+            if outFileName: outFileNames.append(outFileName)
+            if self.jobReport:
+                self.jobReport.addInputFile(friendList[0],nall,readStats=readStats)
+            if self.moduleTimer:
+                self.moduleTimer.addReadStatistics(readStats)
+
+        if self.branchTracer:
+            self.branchTracer.writeBranchSelection(self.traceBranches)
+            self.branchTracer.writeModuleReads(os.path.splitext(self.traceBranches)[0]+"_modules.json")
+            print "Wrote the selection of the %d branches read to %s" % (len(self.branchTracer.neededBranches()), self.traceBranches)
+
+        if self.moduleTiming:
+            self.moduleTimer.printSummary()
+            timingFileName = self.haddFileName.replace(".root","")+"_timing.json" if self.haddFileName else os.path.join(self.outputDir, "moduleTiming.json")
+            if not os.path.exists(os.path.dirname(os.path.abspath(timingFileName))):
+                os.system("mkdir -p "+os.path.dirname(os.path.abspath(timingFileName)))
+            self.moduleTimer.write(timingFileName)
+            print "Wrote module timing to %s" % timingFileName
+
+        print "Total time %.1f sec. to process %i events. Rate = %.1f Hz." %((time.time()-t0), totEntriesRead, totEntriesRead/(time.time()-t0))
+
+
+        if self.haddFileName and (self.justcount or self.noOut):
+            print "No output trees to merge into %s" % self.haddFileName
+        elif self.haddFileName :
+            # self.compression is the resolved setting here, "auto" was replaced by the picked one
+            if self.journal and not self._processedSteps and self.journal.completed("hadd"):
+                print "Not merging again into %s, which is complete" % self.haddFileName
+            else:
+                os.system("./haddnano.py -z %s %s %s" %(self.compression,self.haddFileName," ".join(outFileNames))) #FIXME: remove "./" once haddnano.py is distributed with cms releases
+                if self.journal: self.journal.record("hadd", self.haddFileName)
+        if self.jobReport :
+            self.jobReport.addOutputFile(self.haddFileName)
+            self.jobReport.save()
+        # the job is complete: the histograms of the tasks are in histFileName
+        for histFileName in self._workerHistFiles:
+            if os.path.exists(histFileName): os.remove(histFileName)
+
+    def _runSerial(self, outpostfix, compressionLevel, compressionAlgo):
+        """Process the inputs one after the other in this process, skipping those completed according to the checkpoint"""
+        self._beginJob(self.histFileName)
+        results = []
+        for ifile, friendList in enumerate(self.inputFiles):
+            record = self.journal.completed(self._stepKey(friendList)) if self.journal else None
+            if record:
+                print "Skipping %s, already processed into %s" % (friendList[0], record["outFileName"])
+                self._restoreModuleStates(record.get("moduleStates"))
+                results.append(self._resumedResult(record))
+                continue
+            if self.stager:
+                # stage this file, then copy the next one while this one is processed
+                self.stager.get(friendList)
+                if ifile+1 < len(self.inputFiles): self.stager.prefetch(self.inputFiles[ifile+1])
+            result = self._processFile(friendList, outpostfix, compressionLevel, compressionAlgo, self.firstEntry, self.maxEntries)
+            if self.journal: self._recordStep(self._stepKey(friendList), result, moduleStates=self._moduleStates())
+            results.append(result)
+        self._endJob()
+        return results
+
+    def _checkpointConfig(self, outpostfix):
+        """What must not change for a job to resume from the checkpoint of another one"""
+        selections = [[(getattr(pattern, 'pattern', pattern), keep) for (pattern, keep) in sel._ops] if sel else None for sel in (self.branchsel, self.outputbranchsel)]
+        return { 'inputFiles': self.inputFiles, 'cut': self.cut, 'json': self.json, 'outpostfix': outpostfix, 'friend': self.friend, 'noOut': self.noOut,
+                 'treeName': self.treeName, 'maxEvents': self.maxEvents, 'firstEntry': self.firstEntry, 'maxEntries': self.maxEntries,
+                 'modules': [moduleLabel(m) for m in self.modules], 'branchSelections': selections, 'compression': self.compression,
+                 'haddFileName': self.haddFileName, 'pushdownSkims': self.pushdownSkims }
+
+    def _stepKey(self, friendList, ishard=None, nShards=None):
+        return friendList[0] if ishard is None else "%s#part%d/%d" % (friendList[0], ishard, nShards)
+
+    def _recordStep(self, key, result, **info):
+        (outFileName, nall, nread, readStats) = result
+        self.journal.record(key, outFileName, nall=nall, nread=nread, readStats=readStats, **info)
+        self._processedSteps += 1
+
+    def _resumedResult(self, record):
+        return (record["outFileName"], record["nall"], record["nread"], record["readStats"])
+
+    def _moduleStates(self):
+        """States of the modules implementing checkpointState, after endFile of the last file"""
+        states = {}
+        for im, m in enumerate(self.modules):
+            state = m.checkpointState() if hasattr(m, 'checkpointState') else None
+            if state is not None: states["%d:%s" % (im, moduleLabel(m))] = state
+        return states
+
+    def _restoreModuleStates(self, states):
+        for im, m in enumerate(self.modules):
+            key = "%d:%s" % (im, moduleLabel(m))
+            if states and key in states:
+                m.restoreCheckpointState(states[key])
+
+    def _autoCompression(self):
+        """Pick the compression by profiling the candidate settings on the first entries of the first input"""
+        inFile = ROOT.TFile.Open(self.inputFiles[0][0])
+        compression = autoCompression(self.compression, inFile.Get(self.treeName), branchSelection=self.outputbranchsel)
+        inFile.Close()
+        return compression
+
+    def _beginJob(self, histFileName):
+        # Open histogram file, if desired
+        if histFileName != None and self.histDirName != None:
+            self.histFile = ROOT.TFile.Open( histFileName, "RECREATE" )
         else :
             self.histFile = None
 
@@ -84,83 +282,293 @@ class PostProcessor :
             else :
                 m.beginJob()
 
+    def _endJob(self):
+        if self.moduleTiming and self.histFile:
+            self.moduleTimer.writeHistograms(self.histFile.mkdir("moduleTiming"))
+	for m in self.modules: m.endJob()
+	
+    def _processFile(self, friendList, outpostfix, compressionLevel, compressionAlgo, firstEntry=0, maxEntries=None, outFileName=None):
+        """Process one input file (plus its friends), or the range of maxEntries entries starting at firstEntry.
+
+           Returns (output file name, processed entries, entries read, read statistics).
+        """
 	fullClone = (len(self.modules) == 0)
-	outFileNames=[]
-        t0 = time.time()
-	totEntriesRead=0
-	for friendList in self.inputFiles:
-
-	    fname = friendList[0]
-	    # open input file
-	    inFile = ROOT.TFile.Open(fname)
-
-	    #get input tree
-	    inTree = inFile.Get(self.treeName)
-	    for friend in friendList[1:]:
-	        inTree.AddFriend(self.treeName,friend)
-	    totEntriesRead+=inTree.GetEntries()
-	    # pre-skimming
-	    elist,jsonFilter = preSkim(inTree, self.json, self.cut)
-	    if self.justcount:
-		print 'Would select %d entries from %s'%(elist.GetN() if elist else inTree.GetEntries(), fname)
+        fname = friendList[0]
+        if self.metrics: self.metrics.beginFile(fname)
+        # local copies, if staged
+        inputList = self.stager.get(friendList) if self.stager else friendList
+        # open input file
+        inFile = ROOT.TFile.Open(inputList[0])
+
+        #get input tree
+        inTree = inFile.Get(self.treeName)
+        for friend in inputList[1:]:
+            inTree.AddFriend(self.treeName,friend)
+        perfStats = startReadStatistics(inTree)
+        nread = inTree.GetEntries() - firstEntry
+        if maxEntries is not None: nread = min(nread, maxEntries)
+        # pre-skimming, including the skims at the start of the chain that only cut on input branches
+        pushed = self._pushedSkims(inTree) if not fullClone else []
+        modules = self.modules[len(pushed):]
+        cut = " && ".join("(%s)" % c for c in [self.cut] + [m.rawSelection for m in pushed] if c) or None
+        if pushed and self.cutFlow:
+            baseList,jsonFilter = preSkim(inTree, self.json, self.cut, maxEntries, firstEntry, cache=self.preSkimCache, engine=self.preSkimEngine)
+            counts = cutflowCounts(inTree, baseList, [m.rawSelection for m in pushed], maxEntries, firstEntry)
+            print "--- Results of cutflow of the skims in the preselection ---"
+            nBase = baseList.GetN() if baseList else nread
+            for m, count in zip(pushed, counts):
+                print("%s accepted %i events out of %i: %2.2f%%") % (moduleLabel(m), count, nBase, count/float(0.01*max(nBase,1)))
+            print "--- End of cutflow ---"
+        elist,jsonFilter = preSkim(inTree, self.json, cut, maxEntries, firstEntry, cache=self.preSkimCache, engine=self.preSkimEngine)
+        if self.justcount:
+            print 'Would select %d entries from %s'%(elist.GetN() if elist else nread, fname)
+            if self.stager: self.stager.release(friendList)
+            return (None, 0, nread, None)
+        else:
+            print 'Pre-select %d entries out of %s '%(elist.GetN() if elist else nread,nread)
+
+        if fullClone:
+            # no need of a reader (no event loop), but set up the elist if available
+            if elist: inTree.SetEntryList(elist)
+        else:
+            # initialize reader
+            inTree = InputTree(inTree, elist)
+            if self.branchsel and (self.friend or self.noOut):
+                # FullOutput applies the input branch selection itself
+                self.branchsel.selectBranches(inTree)
+            if self.branchTracer: self.branchTracer.attach(inTree)
+        # without an entry list, restrict the loop to the requested range
+        eventRange = xrange(firstEntry, firstEntry + nread) if (not elist and nread != inTree.GetEntries()) else None
+
+        # prepare output file
+        writerFile = None
+        if not self.noOut:
+            if outFileName is None:
+                outFileName = self._outputFileName(friendList, outpostfix)
+            outFile = ROOT.TFile.Open(outFileName, "RECREATE", "", compressionLevel)
+            if compressionLevel:
+                outFile.SetCompressionAlgorithm(compressionAlgo)
+            # prepare output tree
+            asyncOutput = self.asyncOutput and not fullClone
+            if self.friend:
+                outTree = FriendOutput(inFile, inTree, outFile)
+            else:
+                if asyncOutput:
+                    # the writer thread reads the input branches to copy from its own handle to the input file
+                    writerFile = ROOT.TFile.Open(inputList[0])
+                    writerTree = writerFile.Get(self.treeName)
+                    for friend in inputList[1:]:
+                        writerTree.AddFriend(self.treeName,friend)
+                outTree = FullOutput(
+                    inFile,
+                    inTree,
+                    outFile,
+                    branchSelection=self.branchsel,
+                    outputbranchSelection=self.outputbranchsel,
+                    fullClone=fullClone,
+                    maxEntries=maxEntries,
+                    firstEntry=firstEntry,
+                    jsonFilter=jsonFilter,
+                    provenance=self.provenance,
+                    writerInputTree=writerTree if asyncOutput else None)
+            if asyncOutput:
+                outTree.setAsync(self.outputQueueSize)
+        else :
+            outFile = None
+            outTree = None
+
+        # process events, if needed
+        if not fullClone:
+            providers = None
+            if self.lazy:
+                modules, providerModules = splitProviders(modules)
+                if providerModules: providers = LazyProviders(providerModules, self.moduleTimer)
+            if self.moduleCache and not self.noOut:
+                modules = cacheModules(self.modules, modules, self.moduleCache, fileKey(inFile, self.treeName, friendList[1:]))
+            if self.cacheSize is not None:
+                # the branch selections are applied by now, so the active branches are those that will be read
+                setupTreeCache(inTree, self.cacheSize, self.cacheLearnEntries)
+            maxEvents = self.maxEvents
+            if self.branchTracer and (maxEvents <= 0 or maxEvents > self.traceEvents): maxEvents = self.traceEvents
+            if self.chunkSize:
+                (nall, npass, timeLoop) = chunkedEventLoop(modules, inFile, outFile, inTree, outTree,maxEvents=maxEvents,eventRange=eventRange,cutFlow=self.cutFlow,chunkSize=self.chunkSize,timer=self.moduleTimer,metrics=self.metrics)
+            else:
+                (nall, npass, timeLoop) = eventLoop(modules, inFile, outFile, inTree, outTree,maxEvents=maxEvents,eventRange=eventRange,cutFlow=self.cutFlow,timer=self.moduleTimer,providers=providers,metrics=self.metrics)
+            if self.branchTracer: self.branchTracer.detach(inTree)
+            print 'Processed %d preselected entries from %s (%s entries). Finally selected %d entries' % (nall, fname, nread, npass)
+        else:
+            nall = nread
+            npass = outTree.tree().GetEntries()
+            print 'Selected %d entries from %s' % (npass, fname)
+
+        readStats = readStatistics(inFile, inTree, perfStats)
+        print formatReadStatistics(readStats)
+
+        # now write the output
+        if not self.noOut:
+            outTree.write()
+            outFile.Close()
+            # the writer thread, if any, was joined by write()
+            if writerFile: writerFile.Close()
+            print "Done %s" % outFileName
+        if self.metrics: self.metrics.endFile(nall, npass, inFile, outFile)
+        if self.stager: self.stager.release(friendList)
+        return (outFileName if not self.noOut else None, nall, nread, readStats)
+
+    def _pushedSkims(self, inTree):
+        """Leading modules with a rawSelection on branches of the input tree, to be applied in the preselection instead of the event loop"""
+        pushed = []
+        if not self.pushdownSkims: return pushed
+        for m in self.modules:
+            if not getattr(m, 'rawSelection', None): break
+            try:
+                branches = compileExpression(m.rawSelection).branches
+            except RuntimeError:
+                break
+            if not all(inTree.GetBranch(b) for b in branches): break
+            pushed.append(m)
+        if pushed: print "Applying %s in the preselection" % ", ".join(moduleLabel(m) for m in pushed)
+        return pushed
+
+    def _runParallel(self, outpostfix, compressionLevel, compressionAlgo):
+        """Process the inputs in a pool of nWorkers processes.
+
+           If there are fewer input files than workers, each file is split into cluster-aligned entry ranges.
+           Every task is processed in a freshly forked worker, with its own copy of the modules running
+           beginJob/beginFile/endFile/endJob. Results are returned in input order: the outputs of the ranges
+           of a file are stitched back together in entry order, and the per-task histogram files are merged
+           into histFileName. With a checkpoint, the tasks and files completed by an interrupted job are skipped.
+        """
+        global _workerProcessor
+        nShards = 1
+        if len(self.inputFiles) < self.nWorkers:
+            if self.maxEvents > 0 or self.maxEntries is not None or self.firstEntry > 0:
+                print "Not splitting input files by entry range, as maxEvents or an entry range is set"
+            else:
+                nShards = (self.nWorkers + len(self.inputFiles) - 1) // len(self.inputFiles)
+        tasks = []
+        for ifile, friendList in enumerate(self.inputFiles):
+            if nShards > 1:
+                inFile = ROOT.TFile.Open(friendList[0])
+                ranges = splitEntries(inFile.Get(self.treeName), nShards)
+                inFile.Close()
+            else:
+                ranges = [(self.firstEntry, self.maxEntries)]
+            for ishard, (firstEntry, maxEntries) in enumerate(ranges):
+                tasks.append((len(tasks), ifile, ishard if len(ranges) > 1 else None, firstEntry, maxEntries, outpostfix, compressionLevel, compressionAlgo))
+        if len(tasks) == 1:
+            return self._runSerial(outpostfix, compressionLevel, compressionAlgo)
+
+        # tasks completed by an interrupted job, or belonging to a file whose ranges were already merged
+        doneFiles, doneTasks = {}, {}
+        if self.journal:
+            for ifile, friendList in enumerate(self.inputFiles):
+                record = self.journal.completed(self._stepKey(friendList))
+                if record: doneFiles[ifile] = record
+            for task in tasks:
+                (itask, ifile, ishard) = task[:3]
+                if ifile in doneFiles:
+                    doneTasks[itask] = self._resumedResult(doneFiles[ifile])
+                elif ishard is not None:
+                    record = self.journal.completed(self._stepKey(self.inputFiles[ifile], ishard, nShards))
+                    if record: doneTasks[itask] = self._resumedResult(record)
+        pending = [task for task in tasks if task[0] not in doneTasks]
+        if not pending and len(doneFiles) == len(self.inputFiles):
+            print "Skipping all %d tasks, already processed" % len(tasks)
+            return [self._resumedResult(doneFiles[ifile]) for ifile in xrange(len(self.inputFiles))]
+        if doneTasks:
+            print "Skipping %d of %d tasks, already processed" % (len(doneTasks), len(tasks))
+
+        # a file split into entry ranges is staged once here, the workers inherit the local copy
+        stagedFiles = []
+        if self.stager and nShards > 1:
+            stagedFiles = [self.inputFiles[ifile] for ifile in sorted(set(task[1] for task in pending))]
+            for friendList in stagedFiles: self.stager.get(friendList)
+
+        taskResults = dict(doneTasks)
+        if pending:
+            _workerProcessor = self
+            pool = multiprocessing.Pool(min(self.nWorkers, len(pending)), maxtasksperchild=1)
+            try:
+                for (itask, result, histFileName, timer, totals) in pool.imap_unordered(_processFileInWorker, pending, chunksize=1):
+                    taskResults[itask] = result
+                    if self.moduleTimer: self.moduleTimer.merge(timer)
+                    if self.metrics: self.metrics.addFile(*totals)
+                    if self.journal:
+                        (ifile, ishard) = tasks[itask][1:3]
+                        self._recordStep(self._stepKey(self.inputFiles[ifile], ishard, nShards), result)
+                pool.close()
+            except:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+                _workerProcessor = None
+                for friendList in stagedFiles: self.stager.release(friendList)
+        # histograms of tasks completed by an interrupted job are still in their per-task files, which are
+        # kept until the job is complete, so that a resumed job merges them all again
+        histFileNames = [self._workerHistFileName(task[0]) for task in tasks if self._workerHistFileName(task[0])]
+        histFileNames = [histFileName for histFileName in histFileNames if os.path.exists(histFileName)]
+        if histFileNames:
+            self._mergeHistFiles(histFileNames)
+            self._workerHistFiles = histFileNames
+
+        results = []
+        for ifile in xrange(len(self.inputFiles)):
+            if ifile in doneFiles:
+                results.append(self._resumedResult(doneFiles[ifile]))
 		continue
-	    else:
-		print 'Pre-select %d entries out of %s '%(elist.GetN() if elist else inTree.GetEntries(),inTree.GetEntries())
-		
-	    if fullClone:
-		# no need of a reader (no event loop), but set up the elist if available
-		if elist: inTree.SetEntryList(elist)
-	    else:
-		# initialize reader
-		inTree = InputTree(inTree, elist) 
-
-	    # prepare output file
+            fileResults = [taskResults[task[0]] for task in tasks if task[1] == ifile]
+            if len(fileResults) == 1:
+                results.append(fileResults[0])
+                continue
+            outFileName = None
             if not self.noOut:
-                outFileName = os.path.join(self.outputDir, os.path.basename(fname).replace(".root",outpostfix+".root"))
-                outFile = ROOT.TFile.Open(outFileName, "RECREATE", "", compressionLevel)
-                outFileNames.append(outFileName)
-                if compressionLevel: 
-                    outFile.SetCompressionAlgorithm(compressionAlgo)
-                # prepare output tree
-                if self.friend:
-                    outTree = FriendOutput(inFile, inTree, outFile)
-                else:
-                    outTree = FullOutput(
-                        inFile,
-                        inTree,
-                        outFile,
-                        branchSelection=self.branchsel,
-                        outputbranchSelection=self.outputbranchsel,
-                        fullClone=fullClone,
-                        jsonFilter=jsonFilter,
-                        provenance=self.provenance)
-            else : 
-                outFile = None
-                outTree = None
-
-	    # process events, if needed
-	    if not fullClone:
-		(nall, npass, timeLoop) = eventLoop(self.modules, inFile, outFile, inTree, outTree,maxEvents=self.maxEvents,cutFlow=self.cutFlow)
-		print 'Processed %d preselected entries from %s (%s entries). Finally selected %d entries' % (nall, fname, inTree.GetEntries(), npass)
-	    else:
-                nall = inTree.GetEntries()
-		print 'Selected %d entries from %s' % (outTree.tree().GetEntries(), fname)
-
-	    # now write the output
-            if not self.noOut: 
-                outTree.write()
-                outFile.Close()
-                print "Done %s" % outFileName
-	    if self.jobReport:
-		self.jobReport.addInputFile(fname,nall)
-		
-	for m in self.modules: m.endJob()
-	
-	print "Total time %.1f sec. to process %i events. Rate = %.1f Hz." %((time.time()-t0), totEntriesRead, totEntriesRead/(time.time()-t0))
+                outFileName = self._outputFileName(self.inputFiles[ifile], outpostfix)
+                print "Merging %d entry ranges into %s" % (len(fileResults), outFileName)
+                mergeShards([partFileName for (partFileName, nall, nread, readStats) in fileResults], outFileName, compressionLevel, compressionAlgo)
+            result = (outFileName, sum(nall for (_, nall, _, _) in fileResults), sum(nread for (_, _, nread, _) in fileResults),
+                      sumReadStatistics([readStats for (_, _, _, readStats) in fileResults]))
+            if self.journal: self._recordStep(self._stepKey(self.inputFiles[ifile]), result)
+            results.append(result)
+        return results
+
+    def _outputFileName(self, friendList, outpostfix, ishard=None):
+        postfix = outpostfix if ishard is None else "%s_part%d" % (outpostfix, ishard)
+        return os.path.join(self.outputDir, os.path.basename(friendList[0]).replace(".root",postfix+".root"))
+
+    def _workerHistFileName(self, itask):
+        if self.histFileName == None or self.histDirName == None:
+            return None
+        return self.histFileName.replace(".root", "") + "_part%d.root" % itask
+
+    def _mergeHistFiles(self, histFileNames):
+        merger = ROOT.TFileMerger(False)
+        merger.OutputFile(self.histFileName, "RECREATE")
+        for histFileName in histFileNames:
+            merger.AddFile(histFileName)
+        if not merger.Merge():
+            raise RuntimeError("Failed to merge histogram files %s into %s" % (", ".join(histFileNames), self.histFileName))
+
+_workerProcessor = None
 
+def _savesCheckpointState(module):
+    """Whether module overrides Module.checkpointState"""
+    method = getattr(type(module), 'checkpointState', None)
+    return method is not None and getattr(method, 'im_func', method) is not Module.checkpointState.im_func
 
-	if self.haddFileName :
-		os.system("./haddnano.py %s %s" %(self.haddFileName," ".join(outFileNames))) #FIXME: remove "./" once haddnano.py is distributed with cms releases
-	if self.jobReport :
-		self.jobReport.addOutputFile(self.haddFileName)
-		self.jobReport.save()
+def _processFileInWorker(task):
+    (itask, ifile, ishard, firstEntry, maxEntries, outpostfix, compressionLevel, compressionAlgo) = task
+    processor = _workerProcessor
+    # the worker counts and timing for this task are added to those of the main process: start from zero, as
+    # workers forked after the first tasks completed inherit the totals merged so far
+    if processor.moduleTimer: processor.moduleTimer = ModuleTimer()
+    if processor.metrics: processor.metrics = JobMetrics(MetricsRegistry())
+    if processor.stager: processor.stager.detach()
+    friendList = processor.inputFiles[ifile]
+    histFileName = processor._workerHistFileName(itask)
+    processor._beginJob(histFileName)
+    outFileName = processor._outputFileName(friendList, outpostfix, ishard)
+    result = processor._processFile(friendList, outpostfix, compressionLevel, compressionAlgo, firstEntry, maxEntries, outFileName)
+    processor._endJob()
+    return (itask, result, histFileName, processor.moduleTimer, processor.metrics.totals() if processor.metrics else None)
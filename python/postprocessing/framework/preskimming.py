@@ -1,7 +1,11 @@
 import json
 import re
+import bisect
+import hashlib
+import numpy
 import ROOT
 ROOT.PyConfig.IgnoreCommandLineOptions = True
+from PhysicsTools.NanoAODTools.postprocessing.framework.columns import entryListToArray, readColumn, countBranch, numpyType
 class JSONFilter:
     def __init__(self,fname="",runsAndLumis={}):
         self.keep = {}
@@ -15,39 +19,63 @@ class JSONFilter:
             self.keep[run] += lumis
         for run in self.keep.keys():
             if len(self.keep[run])==0: del self.keep[run]
+        self._compile()
+    def _compile(self):
+        """Merge the lumi ranges of each run, and flatten them in sorted arrays of (run << 32 | lumi) bounds"""
+        starts, ends = [], []
+        for run in sorted(self.keep.iterkeys()):
+            merged = []
+            for (l1,l2) in sorted(self.keep[run]):
+                if merged and l1 <= merged[-1][1]+1: merged[-1][1] = max(merged[-1][1], l2)
+                else: merged.append([l1,l2])
+            starts += [(run << 32) | l1 for (l1,l2) in merged]
+            ends += [(run << 32) | l2 for (l1,l2) in merged]
+        self._starts = starts
+        self._ends = ends
+        self._startArray = numpy.array(starts, dtype='i8')
+        self._endArray = numpy.array(ends, dtype='i8')
+        self._runArray = numpy.array(sorted(self.keep.iterkeys()), dtype='i8')
     def filterRunLumi(self,run,lumi):
-        try:
-            for (l1,l2) in self.keep[run]:
-                if l1 <= lumi and lumi <= l2: return True
-            return False
-        except KeyError:
-            return False
+        key = (long(run) << 32) | long(lumi)
+        i = bisect.bisect_right(self._starts, key) - 1
+        return i >= 0 and key <= self._ends[i]
     def filterRunOnly(self,run):
         return (run in self.keep)
+    def filterRunLumis(self,runs,lumis):
+        """Vectorized filterRunLumi: return the boolean mask of the (run, lumi) pairs that are kept"""
+        keys = (numpy.asarray(runs, dtype='i8') << 32) | numpy.asarray(lumis, dtype='i8')
+        i = numpy.searchsorted(self._startArray, keys, side='right') - 1
+        return (i >= 0) & (keys <= self._endArray[numpy.maximum(i, 0)])
+    def filterRuns(self,runs):
+        """Vectorized filterRunOnly"""
+        return numpy.in1d(numpy.asarray(runs, dtype='i8'), self._runArray)
     def runCut(self):
         return "%d <= run && run <= %s" % (min(self.keep.iterkeys()), max(self.keep.iterkeys()))
     def filterEList(self, tree, elist):
-        #FIXME this can be optimized for sure
-        tree.SetBranchStatus("*", 0)
-        tree.SetBranchStatus('run',1)
-        tree.SetBranchStatus('luminosityBlock',1)
-        filteredList = ROOT.TEntryList('filteredList','filteredList')
-        if elist:
-            for i in xrange(elist.GetN()):
-                entry = elist.GetEntry(0) if i == 0 else elist.Next()
-                tree.GetEntry(entry)
-                if self.filterRunLumi(tree.run, tree.luminosityBlock):
-                    filteredList.Enter(entry)
-        else:
-            for entry in xrange(tree.GetEntries()):
-                tree.GetEntry(entry)
-                if self.filterRunLumi(tree.run, tree.luminosityBlock):
-                    filteredList.Enter(entry)
-        tree.SetBranchStatus("*", 1)
-        return filteredList
-                
+        entries = entryListToArray(tree, elist) if elist else numpy.arange(tree.GetEntries(), dtype='i8')
+        mask = self.filterRunLumis(readColumn(tree, 'run', entries), readColumn(tree, 'luminosityBlock', entries))
+        if elist and mask.all(): return elist
+        return _makeEntryList(entries[mask], 'filteredList')
+    def filterTree(self, tree, runsOnly=False):
+        """Return a copy of the Runs (runsOnly) or LuminosityBlocks tree with only the runs or lumis that are kept"""
+        entries = numpy.arange(tree.GetEntries(), dtype='i8')
+        runs = readColumn(tree, 'run', entries)
+        mask = self.filterRuns(runs) if runsOnly else self.filterRunLumis(runs, readColumn(tree, 'luminosityBlock', entries))
+        if mask.all(): return tree.CopyTree('1')
+        tree.SetEntryList(_makeEntryList(entries[mask], 'filtered'+tree.GetName()))
+        try:
+            return tree.CopyTree('1')
+        finally:
+            tree.SetEntryList(0)
+
+def preSkim(tree, jsonInput = None, cutstring = None, maxEntries = None, firstEntry = 0, cache = None, engine = "draw"):
+    """Select the entries passing cutstring and the JSON, returning (TEntryList, JSONFilter).
 
-def preSkim(tree, jsonInput = None, cutstring = None, maxEntries = None, firstEntry = 0):
+       With an EntryListCache, the selected entries are looked up by file identity, cut, JSON and entry range,
+       and stored after a selection is made, so that the selection is run once per file.
+       The cut is evaluated with TTree::Draw (engine "draw"), or with a multithreaded RDataFrame (engine "rdf" or "rdf:<nThreads>",
+       see rdfEntryList); the resulting entries are the same.
+    """
     if jsonInput == None and cutstring == None: 
         return None,None
     cut = None
@@ -66,8 +94,119 @@ def preSkim(tree, jsonInput = None, cutstring = None, maxEntries = None, firstEn
         if not m:
             raise RuntimeError("Error, found AltBranch$ in cut string, but it doesn't comply with the syntax this code can support. The cut is %r" % cut)
         cut = cut.replace(m.group(0), m.group(1) if tree.GetBranch(m.group(1)) else m.group(2))
-    tree.Draw('>>elist',cut,"entrylist", maxEntries, firstEntry)
-    elist = ROOT.gDirectory.Get('elist')
+    if cache:
+        key = preSkimKey(tree, cut, jsonFilter, maxEntries, firstEntry)
+        entries = cache.get(key)
+        if entries is not None:
+            print "Using the cached preselection of %d entries" % len(entries)
+            return _makeEntryList(entries, 'elist'),jsonFilter
+    elist = None
+    if engine.startswith("rdf"):
+        elist = rdfEntryList(tree, cut, maxEntries, firstEntry, int(engine.split(":")[1]) if ":" in engine else 0)
+    if elist is None:
+        tree.Draw('>>elist',cut,"entrylist", maxEntries, firstEntry)
+        elist = ROOT.gDirectory.Get('elist')
     if jsonInput:
         elist = jsonFilter.filterEList(tree,elist)
+    if cache:
+        cache.put(key, entryListToArray(tree, elist))
     return elist,jsonFilter
+
+def cutflowCounts(tree, elist, cuts, maxEntries = None, firstEntry = 0):
+    """Return the number of entries (of elist, if any, else of the entry range) passing the first 1, 2, ... of cuts"""
+    counts = []
+    if elist: tree.SetEntryList(elist)
+    try:
+        for i in xrange(len(cuts)):
+            cut = " && ".join("(%s)" % c for c in cuts[:i+1])
+            if elist: tree.Draw('>>cutflowList', cut, "entrylist")
+            else: tree.Draw('>>cutflowList', cut, "entrylist", ROOT.TVirtualTreePlayer.kMaxEntries if maxEntries is None else maxEntries, firstEntry)
+            counts.append(ROOT.gDirectory.Get('cutflowList').GetN())
+    finally:
+        if elist: tree.SetEntryList(0)
+    return counts
+
+def rdfEntryList(tree, cut, maxEntries, firstEntry, nThreads=0):
+    """Select the entries of tree passing cut with an RDataFrame Filter, using nThreads threads (0: all cores).
+
+       The cut is JIT-compiled as C++, so TTreeFormula constructs (specials like Sum$, and variable-length arrays
+       used without an index, which TTree::Draw loops over) are not supported, nor cuts whose C++ meaning differs:
+       array elements taken by index (TTree::Draw rejects the entries where the index is out of range, while
+       C++ reads past the end), divisions (integer ones truncate in C++) and subtractions or negations with unsigned
+       branches like nJet (which wrap around in C++, while TTree::Draw computes in double). None is returned for those,
+       to fall back to TTree::Draw.
+    """
+    unsupported = _rdfUnsupported(tree, cut)
+    if unsupported:
+        print "Pre-selecting with TTree::Draw, as RDataFrame can not evaluate %s" % unsupported
+        return None
+    if hasattr(ROOT.ROOT, "RDataFrame"):
+        dataFrame, entryColumn = ROOT.ROOT.RDataFrame, "rdfentry_"
+    else: # ROOT < 6.14
+        dataFrame, entryColumn = ROOT.ROOT.Experimental.TDataFrame, "tdfentry_"
+    enableMT = not ROOT.ROOT.IsImplicitMTEnabled()
+    if enableMT: ROOT.ROOT.EnableImplicitMT(nThreads)
+    try:
+        # in multithreaded mode entries are processed out of order, so the range is applied in the filter
+        lastEntry = firstEntry + maxEntries
+        if firstEntry > 0 or lastEntry < tree.GetEntries():
+            cut = "(%s) && %s >= %d && %s < %d" % (cut, entryColumn, firstEntry, entryColumn, min(lastEntry, tree.GetEntries()))
+        selected = dataFrame(tree).Filter(cut).Take['ULong64_t'](entryColumn)
+        _declareFillEntryList()
+        elist = ROOT.TEntryList('elist','elist')
+        ROOT.nanoFillEntryList(elist, selected.GetValue())
+    finally:
+        if enableMT: ROOT.ROOT.DisableImplicitMT()
+    return elist
+
+def preSkimKey(tree, cut, jsonFilter, maxEntries, firstEntry):
+    """Key of a preselection: identity (UUID and size) of the files of tree and its friends, normalised cut, JSON and entry range"""
+    files = [tree.GetCurrentFile()]
+    if tree.GetListOfFriends():
+        files += [fe.GetTree().GetCurrentFile() for fe in tree.GetListOfFriends()]
+    key = [tree.GetName()] + ["%s:%d" % (f.GetUUID().AsString(), f.GetSize()) for f in files if f]
+    key.append(" ".join(cut.split()))
+    if jsonFilter: key.append(hashlib.sha1(repr((jsonFilter._starts, jsonFilter._ends))).hexdigest())
+    key.append("%d:%d" % (firstEntry, maxEntries))
+    return "|".join(key)
+
+
+####### PRIVATE IMPLEMENTATION PART #######
+
+def _rdfUnsupported(tree, cut):
+    if "$" in cut: return "the TTreeFormula specials in %r" % cut
+    for name in set(re.findall(r"\b([A-Za-z_]\w*)\b(?!\s*[\[(])", cut)):
+        if tree.GetBranch(name) and countBranch(tree, name):
+            return "the array %s without an index" % name
+    for name in set(re.findall(r"\b([A-Za-z_]\w*)\s*\[", cut)):
+        if tree.GetBranch(name):
+            return "the array element %s[...], which may be out of range" % name
+    if "/" in cut: return "the division in %r, which truncates integers in C++" % cut
+    if "-" in cut:
+        for name in set(re.findall(r"\b([A-Za-z_]\w*)\b", cut)):
+            if tree.GetBranch(name) and numpyType(tree, name).kind == 'u':
+                return "the unsigned branch %s with a subtraction or negation, which wraps around in C++" % name
+    return None
+
+_fillEntryListDeclared = False
+def _declareFillEntryList():
+    global _fillEntryListDeclared
+    if _fillEntryListDeclared: return
+    ROOT.gInterpreter.Declare("""
+        void nanoFillEntryList(TEntryList *elist, std::vector<ULong64_t> entries) {
+            std::sort(entries.begin(), entries.end());
+            for (ULong64_t entry : entries) elist->Enter(entry);
+        }
+        void nanoFillEntryList(TEntryList *elist, ULong64_t address, ULong64_t n) {
+            const Long64_t *entries = reinterpret_cast<const Long64_t*>(address);
+            for (ULong64_t i = 0; i < n; ++i) elist->Enter(entries[i]);
+        }""")
+    _fillEntryListDeclared = True
+
+def _makeEntryList(entries, name):
+    """TEntryList of the entry numbers in the numpy array entries, filled in C++"""
+    _declareFillEntryList()
+    entries = numpy.ascontiguousarray(numpy.sort(entries), dtype='i8')
+    elist = ROOT.TEntryList(name, name)
+    ROOT.nanoFillEntryList(elist, entries.ctypes.data, len(entries))
+    return elist
@@ -0,0 +1,61 @@
+import ROOT
+ROOT.PyConfig.IgnoreCommandLineOptions = True
+
+def setupTreeCache(tree, cacheSize, learnEntries=None):
+    """Configure the TTreeCache of tree with cacheSize bytes (0 disables it).
+
+       With learnEntries, the cache learns the branches to prefetch in the first learnEntries entries;
+       otherwise it is trained right away with all the active branches, so that every read goes through it.
+    """
+    tree.SetCacheSize(cacheSize)
+    if not cacheSize:
+        return # no cache to train
+    if learnEntries:
+        tree.SetCacheLearnEntries(learnEntries)
+        return
+    for b in tree.GetListOfBranches():
+        if tree.GetBranchStatus(b.GetName()):
+            tree.AddBranchToCache(b, True)
+    tree.StopCacheLearningPhase()
+
+def startReadStatistics(tree):
+    """Start recording the reads of tree: returns the TTreePerfStats to be passed to readStatistics"""
+    return ROOT.TTreePerfStats("ioperf", tree)
+
+def readStatistics(inFile, tree, perfStats):
+    """Return a dict with the read statistics of inFile (bytes, calls, cache usage) and of tree (unzip and disk time)"""
+    perfStats.Finish()
+    stats = {
+        'file': inFile.GetName(),
+        'bytesRead': inFile.GetBytesRead(),
+        'readCalls': inFile.GetReadCalls(),
+        'unzipTime': perfStats.GetUnzipTime(),
+        'diskTime': perfStats.GetDiskTime(),
+        'cacheSize': tree.GetCacheSize(),
+        'cacheBytesRead': 0,
+        'noCacheBytesRead': 0,
+    }
+    cache = inFile.GetCacheRead(tree)
+    if cache:
+        stats['cacheBytesRead'] = cache.GetBytesRead()
+        stats['noCacheBytesRead'] = cache.GetNoCacheBytesRead()
+    tree.SetPerfStats(0)
+    return stats
+
+def sumReadStatistics(statsList):
+    """Combine the read statistics of several entry ranges of the same file"""
+    ret = dict(statsList[0])
+    for stats in statsList[1:]:
+        for key in ('bytesRead', 'readCalls', 'unzipTime', 'diskTime', 'cacheBytesRead', 'noCacheBytesRead'):
+            ret[key] += stats[key]
+    return ret
+
+def cacheHitRate(stats):
+    """Fraction of the bytes that were read through the cache"""
+    tot = stats['cacheBytesRead'] + stats['noCacheBytesRead']
+    return stats['cacheBytesRead']/float(tot) if tot else None
+
+def formatReadStatistics(stats):
+    hitRate = cacheHitRate(stats)
+    return "Read %.1f MB in %d calls from %s (cache %s, %s hits), unzip time %.1f s" % (stats['bytesRead']/1e6, stats['readCalls'], stats['file'],
+            "%.0f MB" % (stats['cacheSize']/1e6) if stats['cacheSize'] else "off", "%.1f%%" % (100*hitRate) if hitRate is not None else "no", stats['unzipTime'])
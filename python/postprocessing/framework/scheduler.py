@@ -0,0 +1,124 @@
+import types
+import fnmatch
+from PhysicsTools.NanoAODTools.postprocessing.framework import datamodel
+from PhysicsTools.NanoAODTools.postprocessing.framework.eventloop import moduleLabel
+from PhysicsTools.NanoAODTools.postprocessing.framework.modulecache import moduleFingerprint
+
+def scheduleModules(modules, verbose=True):
+    """Return the modules in the order in which to run them: duplicates removed, and skims moved as early as possible.
+
+       Modules may declare the event attributes and branches they read (consumes) and fill (produces); fnmatch
+       patterns are allowed. A module declaring both promises that analyze has no other effect, and is run again
+       with the same result on the same inputs. Modules that read objects may modify them (as the selections do
+       when setting attributes of the leptons and jets), so what a module consumes among the products of the
+       modules counts as written by it, except for skims, i.e. modules producing nothing. Modules without declarations are kept in place, and
+       nothing is moved across them.
+
+       A declared module identical to an earlier one (same moduleFingerprint) is dropped if no module in between
+       writes what it reads or writes. Then the modules are ordered along the dependencies: a skim runs as soon as
+       the modules it depends on did, so that the producers not needed by it only run on the events it accepts.
+       Skims keep their relative order, and so do the other modules.
+    """
+    products = set()
+    for m in modules:
+        if _declared(m): products.update(m.produces)
+    writes = dict((id(m), _writes(m, products)) for m in modules if _declared(m))
+    kept, dropped = [], []
+    fingerprints = {}
+    for m in modules:
+        duplicate = None
+        if _declared(m):
+            fingerprints[id(m)] = moduleFingerprint(m)
+            for other in reversed(kept):
+                if fingerprints.get(id(other)) == fingerprints[id(m)]:
+                    duplicate = other
+                    break
+                if not _declared(other) or _overlap(writes[id(other)], set(m.consumes) | writes[id(m)]):
+                    break
+        if duplicate is not None:
+            dropped.append((m, duplicate))
+        else:
+            kept.append(m)
+
+    preds = [set(i for i in xrange(j) if _depends(kept[i], kept[j], writes)) for j in xrange(len(kept))]
+    order, done = [], set()
+    while len(order) < len(kept):
+        ready = [j for j in xrange(len(kept)) if j not in done and preds[j] <= done]
+        skims = [j for j in ready if _isSkim(kept[j])]
+        j = skims[0] if skims else ready[0]
+        order.append(j)
+        done.add(j)
+    scheduled = [kept[j] for j in order]
+
+    if verbose:
+        for (m, duplicate) in dropped:
+            print "Scheduler: not running %s, identical to %s" % (moduleLabel(m), moduleLabel(duplicate))
+        if order != range(len(kept)):
+            print "Scheduler: running the modules in the order %s" % ", ".join(moduleLabel(m) for m in scheduled)
+    return scheduled
+
+def functionReads(fn):
+    """Names possibly read by a function of the event, such as the lambdas passed to the modules as selections or
+       input collections, or None if that can not be told.
+
+       This includes the attribute and global names it uses (also in the functions it calls), and for the string
+       constants, e.g. Collection(event, "Jet"), the branches of the collection of that name. Calling anything else
+       than functions, builtins and the classes of the datamodel makes the result unknown.
+    """
+    names = set()
+    if not _functionReads(fn, names, set()): return None
+    return names
+
+####### PRIVATE IMPLEMENTATION PART #######
+
+def _declared(m):
+    return getattr(m, 'consumes', None) is not None and getattr(m, 'produces', None) is not None
+
+def _isSkim(m):
+    return _declared(m) and not m.produces
+
+def _writes(m, products):
+    written = set(m.produces)
+    if not _isSkim(m):
+        written.update(name for name in m.consumes if _overlap(set([name]), products))
+    return written
+
+def _depends(first, second, writes):
+    """Whether second must run after first"""
+    if not _declared(first) or not _declared(second): return True
+    if _isSkim(first) and _isSkim(second): return True
+    return _overlap(writes[id(first)], set(second.consumes) | writes[id(second)]) or _overlap(set(first.consumes), writes[id(second)])
+
+def _overlap(names, others):
+    if names & others: return True
+    for (patterns, targets) in ((names, others), (others, names)):
+        for pattern in patterns:
+            if any(c in pattern for c in "*?[") and fnmatch.filter(targets, pattern): return True
+    return False
+
+def _functionReads(fn, names, seen):
+    if id(fn) in seen: return True
+    seen.add(id(fn))
+    if isinstance(fn, (types.BuiltinFunctionType, types.ModuleType)):
+        return True
+    if isinstance(fn, (type, types.ClassType)):
+        return fn.__module__ == datamodel.__name__
+    if not isinstance(fn, types.FunctionType):
+        return not callable(fn)
+    closure = [cell.cell_contents for cell in fn.func_closure] if fn.func_closure else []
+    for value in closure + list(fn.func_defaults or []):
+        if isinstance(value, basestring): _addCollection(value, names)
+        elif not _functionReads(value, names, seen): return False
+    codes = [fn.func_code]
+    while codes:
+        code = codes.pop()
+        for name in code.co_names:
+            names.add(name)
+            if name in fn.func_globals and not _functionReads(fn.func_globals[name], names, seen): return False
+        for const in code.co_consts:
+            if isinstance(const, types.CodeType): codes.append(const)
+            elif isinstance(const, basestring): _addCollection(const, names)
+    return True
+
+def _addCollection(prefix, names):
+    names.update([prefix, "n"+prefix, prefix+"_*"])
@@ -0,0 +1,41 @@
+import os
+import ROOT
+ROOT.PyConfig.IgnoreCommandLineOptions = True
+from PhysicsTools.NanoAODTools.postprocessing.framework.columns import clusterRanges
+
+def splitEntries(tree, nShards):
+    """Split the entries of tree into at most nShards cluster-aligned ranges, returned as (firstEntry, nEntries)"""
+    nEntries = tree.GetEntries()
+    if nShards <= 1 or nEntries == 0:
+        return [(0, nEntries)]
+    shardSize = (nEntries + nShards - 1) // nShards
+    return [(begin, end - begin) for (begin, end) in clusterRanges(tree, shardSize)]
+
+def mergeShards(partFileNames, outFileName, compressionLevel=0, compressionAlgo=None):
+    """Stitch the outputs of consecutive entry ranges back together, keeping the order of partFileNames.
+
+       Trees are concatenated with fast cloning (baskets are copied without being decompressed, as the parts
+       share the same compression settings); other objects are identical in all parts and taken from the first one.
+    """
+    outFile = ROOT.TFile.Open(outFileName, "RECREATE", "", compressionLevel)
+    if compressionLevel:
+        outFile.SetCompressionAlgorithm(compressionAlgo)
+    firstPart = ROOT.TFile.Open(partFileNames[0])
+    done = set()
+    for key in firstPart.GetListOfKeys():
+        name = key.GetName()
+        if name in done: continue # older cycles
+        done.add(name)
+        if ROOT.TClass.GetClass(key.GetClassName()).InheritsFrom(ROOT.TTree.Class()):
+            chain = ROOT.TChain(name)
+            for partFileName in partFileNames:
+                chain.Add(partFileName)
+            outFile.cd()
+            merged = chain.CloneTree(-1, "fast")
+            merged.Write()
+        else:
+            outFile.WriteTObject(key.ReadObj(), name)
+    firstPart.Close()
+    outFile.Close()
+    for partFileName in partFileNames:
+        os.remove(partFileName)
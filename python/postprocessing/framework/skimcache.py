@@ -0,0 +1,65 @@
+import os
+import errno
+import hashlib
+import numpy
+
+class EntryListCache:
+    """On-disk cache of preselected entry numbers, one compressed numpy file per key.
+
+       Files are written under a temporary name and renamed, so that concurrent writers of the same key are safe
+       (they write the same content); readers only ever see complete files. When the cache grows above maxSize bytes,
+       the least recently used files are removed.
+    """
+    def __init__(self, cacheDir, maxSize=None):
+        self.cacheDir = cacheDir
+        self.maxSize = maxSize
+        if not os.path.exists(cacheDir):
+            try:
+                os.makedirs(cacheDir)
+            except OSError, e:
+                if e.errno != errno.EEXIST: raise
+    def get(self, key):
+        """Return the sorted array of entries stored for key, or None"""
+        fileName = self._fileName(key)
+        try:
+            data = numpy.load(fileName)
+            entries = numpy.cumsum(data['diffs'], dtype='i8')
+            data.close()
+        except (IOError, KeyError, ValueError):
+            return None
+        try:
+            os.utime(fileName, None) # mark as recently used
+        except OSError:
+            pass
+        return entries
+    def put(self, key, entries):
+        fileName = self._fileName(key)
+        tmpName = "%s.tmp%d" % (fileName, os.getpid())
+        # sorted entries have small differences, which compress well
+        diffs = numpy.diff(numpy.asarray(entries, dtype='i8'))
+        out = open(tmpName, 'wb')
+        numpy.savez_compressed(out, diffs=numpy.concatenate((numpy.asarray(entries[:1], dtype='i8'), diffs)))
+        out.close()
+        os.rename(tmpName, fileName)
+        self._evict()
+    def _fileName(self, key):
+        return os.path.join(self.cacheDir, hashlib.sha1(key).hexdigest()+".npz")
+    def _evict(self):
+        if self.maxSize is None: return
+        cached = []
+        for name in os.listdir(self.cacheDir):
+            if not name.endswith(".npz"): continue
+            path = os.path.join(self.cacheDir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue # removed by another job
+            cached.append((st.st_mtime, st.st_size, path))
+        total = sum(size for (_, size, _) in cached)
+        for (mtime, size, path) in sorted(cached):
+            if total <= self.maxSize: break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
@@ -0,0 +1,181 @@
+import os
+import re
+import time
+import fcntl
+import errno
+import hashlib
+import threading
+import subprocess
+
+def isRemote(fileName):
+    return fileName.startswith("root://")
+
+class InputStager:
+    """Copy remote input files to a local cache directory before they are processed.
+
+       With longTermCache, files are keyed by their path plus remote size and modification time, kept after use and
+       shared between concurrent jobs through lock files: a file is copied by a single job under an exclusive lock,
+       and held under a shared lock while it is being read. The least recently used files not in use are evicted to
+       keep the cache below maxSize bytes. Otherwise, each job makes private copies, deleted once processed.
+       Copies go to a temporary name and are renamed atomically when complete.
+    """
+    def __init__(self, cacheDir=None, longTermCache=False, maxSize=None, verbose=True):
+        if cacheDir is None:
+            cacheDir = os.path.join(os.environ.get('TMPDIR', "/tmp"), "nanoAOD-cache-%d" % os.getuid())
+        self.cacheDir = cacheDir
+        self.longTermCache = longTermCache
+        self.maxSize = maxSize
+        self.verbose = verbose
+        self._staged = {} # remote name -> (local name, open lock file), for the files used by this job
+        self._prefetching = {} # remote name -> thread
+        self._inherited = set() # files staged by the parent process of a forked worker
+        if not os.path.exists(cacheDir):
+            try:
+                os.makedirs(cacheDir)
+            except OSError, e:
+                if e.errno != errno.EEXIST: raise
+    def get(self, fileNames):
+        """Return the local names of fileNames, staging the remote ones (or waiting for their prefetch)"""
+        return [self._get(fileName) for fileName in fileNames]
+    def prefetch(self, fileNames):
+        """Start staging fileNames in the background"""
+        for fileName in fileNames:
+            if not isRemote(fileName) or fileName in self._staged or fileName in self._prefetching: continue
+            thread = threading.Thread(target=self._stageQuietly, args=(fileName,))
+            thread.daemon = True
+            thread.start()
+            self._prefetching[fileName] = thread
+    def release(self, fileNames):
+        """Tell that fileNames are no longer used by this job: delete the local copies, unless in long term cache mode"""
+        for fileName in fileNames:
+            if fileName not in self._staged or fileName in self._inherited: continue
+            (localName, lock) = self._staged.pop(fileName)
+            if not self.longTermCache:
+                for name in (localName, localName+".lock", localName+".staging"):
+                    if os.path.exists(name): os.remove(name)
+            lock.close()
+    def close(self):
+        """Wait for the pending prefetches, and release all the files"""
+        for fileName, thread in self._prefetching.items():
+            thread.join()
+        self._prefetching = {}
+        self.release(self._staged.keys())
+    def detach(self):
+        """To be called in a forked worker process: the files already staged are used but not released by the
+           worker, they stay owned by the parent process"""
+        self._inherited = set(self._staged)
+
+    def _get(self, fileName):
+        if not isRemote(fileName): return fileName
+        if fileName in self._prefetching:
+            self._prefetching.pop(fileName).join()
+        if fileName not in self._staged:
+            self._stageQuietly(fileName)
+        return self._staged[fileName][0] if fileName in self._staged else fileName
+    def _stageQuietly(self, fileName):
+        """Stage fileName; on failure, print a warning so that the file is read remotely"""
+        try:
+            self._stage(fileName)
+        except Exception, e:
+            print "Warning: could not stage %s (%s), will read it remotely" % (fileName, e)
+    def _stage(self, fileName):
+        localName = os.path.join(self.cacheDir, "%s-%s.root" % (os.path.basename(fileName).replace(".root",""), self._key(fileName)))
+        # hold a shared lock while the file is in use, so that other jobs do not evict it
+        lock = _lock(localName+".lock", fcntl.LOCK_SH)
+        # and copy it under an exclusive one, so that it is copied only once
+        staging = open(localName+".staging", "a")
+        fcntl.flock(staging, fcntl.LOCK_EX)
+        try:
+            if os.path.exists(localName):
+                if self.verbose: print "Using cached copy %s of %s" % (localName, fileName)
+                os.utime(localName, None) # mark as recently used
+            else:
+                size = _remoteStat(fileName)[0]
+                self._evict(size or 0)
+                if self.verbose: print "Staging %s to %s" % (fileName, localName)
+                t0 = time.time()
+                tmpName = "%s.part%d" % (localName, os.getpid())
+                ret = subprocess.call(["xrdcp", "-f", "--nopbar", fileName, tmpName])
+                if ret != 0 or not os.path.exists(tmpName):
+                    if os.path.exists(tmpName): os.remove(tmpName)
+                    raise RuntimeError("xrdcp exited with status %d" % ret)
+                os.rename(tmpName, localName)
+                if self.verbose: print "Staged %s in %.1f s" % (fileName, time.time()-t0)
+        except:
+            lock.close()
+            if not self.longTermCache:
+                for name in (localName+".lock", localName+".staging"):
+                    if os.path.exists(name): os.remove(name)
+            raise
+        finally:
+            staging.close()
+        self._staged[fileName] = (localName, lock)
+    def _key(self, fileName):
+        (size, mtime) = _remoteStat(fileName)
+        key = fileName if size is None else "%s:%d:%d" % (fileName, size, mtime)
+        if not self.longTermCache:
+            # a private copy, deleted after use
+            key += ":%d:%f" % (os.getpid(), time.time())
+        return hashlib.sha1(key).hexdigest()
+    def _evict(self, size):
+        """Remove the least recently used files not in use until size more bytes fit within maxSize"""
+        if self.maxSize is None: return
+        cached = []
+        for name in os.listdir(self.cacheDir):
+            if not name.endswith(".root"): continue
+            path = os.path.join(self.cacheDir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            cached.append((st.st_mtime, st.st_size, path))
+        total = sum(s for (_, s, _) in cached)
+        for (mtime, fsize, path) in sorted(cached):
+            if total + size <= self.maxSize: break
+            try:
+                lock = _lock(path+".lock", fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError:
+                continue # in use
+            if os.path.exists(path):
+                if self.verbose: print "Evicting %s from the cache" % path
+                os.remove(path)
+                total -= fsize
+            # remove the lock files with the copy, still holding the lock: a job waiting on them opens them again
+            for name in (path+".staging", path+".lock"):
+                if os.path.exists(name): os.remove(name)
+            lock.close()
+
+####### PRIVATE IMPLEMENTATION PART #######
+
+def _lock(fileName, operation):
+    """Open and flock fileName; retry if it was removed (by an eviction) while waiting for the lock"""
+    while True:
+        lock = open(fileName, "a")
+        try:
+            fcntl.flock(lock, operation)
+        except:
+            lock.close()
+            raise
+        try:
+            if os.fstat(lock.fileno()).st_ino == os.stat(fileName).st_ino:
+                return lock
+        except OSError:
+            pass
+        lock.close()
+
+_remoteStats = {}
+def _remoteStat(fileName):
+    """Return (size, modification time) of a remote file, or (None, None) if they can not be retrieved"""
+    if fileName not in _remoteStats:
+        size, mtime = None, None
+        m = re.match(r"(root://[^/]+)/(/.*)", fileName)
+        if m:
+            try:
+                out = subprocess.Popen(["xrdfs", m.group(1), "stat", m.group(2)], stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()[0]
+                fields = dict(line.split(":", 1) for line in out.splitlines() if ":" in line)
+                size = int(fields["Size"].strip())
+                mtime = int(time.mktime(time.strptime(fields["MTime"].strip(), "%Y-%m-%d %H:%M:%S")))
+            except (OSError, KeyError, ValueError):
+                size, mtime = None, None
+        _remoteStats[fileName] = (size, mtime)
+    return _remoteStats[fileName]
@@ -1,4 +1,5 @@
 import types
+import fnmatch
 import ROOT
 ROOT.PyConfig.IgnoreCommandLineOptions = True
 
@@ -13,17 +14,25 @@ def InputTree(tree,entrylist=None):
     tree._ttras = {}
     tree._leafTypes = {}
     tree._ttreereaderversion = 1
+    tree._readerRebuilds = 0
+    tree._lateReaders = []
+    tree._firstEntry = -1
     tree.arrayReader = types.MethodType(getArrayReader, tree)
     tree.valueReader = types.MethodType(getValueReader, tree)
     tree.readBranch = types.MethodType(readBranch, tree)
     tree.gotoEntry = types.MethodType(_gotoEntry, tree)
     tree.readAllBranches = types.MethodType(_readAllBranches, tree)
+    tree.currentTreeEntry = types.MethodType(_currentTreeEntry, tree)
+    tree.declareBranches = types.MethodType(declareBranches, tree)
     tree.entries = tree._ttreereader.GetEntries(False)
     tree._extrabranches={}
+    tree._branchTracer = None
+    tree._lazyProviders = None
     return tree
 
 def getArrayReader(tree, branchName):
     """Make a reader for branch branchName containing a variable-length value array."""
+    if tree._branchTracer: tree._branchTracer.record(branchName)
     if branchName not in tree._ttras:
        if not tree.GetBranch(branchName): raise RuntimeError, "Can't find branch '%s'" % branchName
        leaf = tree.GetBranch(branchName).GetLeaf(branchName)
@@ -34,6 +43,7 @@ def getArrayReader(tree, branchName):
 
 def getValueReader(tree, branchName):
     """Make a reader for branch branchName containing a single value."""
+    if tree._branchTracer: tree._branchTracer.record(branchName)
     if branchName not in tree._ttrvs:
        if not tree.GetBranch(branchName): raise RuntimeError, "Can't find branch '%s'" % branchName
        leaf = tree.GetBranch(branchName).GetLeaf(branchName)
@@ -42,6 +52,39 @@ def getValueReader(tree, branchName):
        tree._ttrvs[branchName] = _makeValueReader(tree, typ, branchName)
     return tree._ttrvs[branchName]
 
+def declareBranches(tree, branchNames):
+    """Make the readers for all the branches in branchNames (fnmatch patterns like Flag_* are allowed) in one go.
+
+       If this is done before the first entry is read (e.g. in beginFile), the TTreeReader doesn't need to be
+       rebuilt when the branches are first read. Names that don't match any branch are ignored.
+    """
+    names = set()
+    allBranches = None
+    for pattern in branchNames:
+        if any(c in pattern for c in "*?["):
+            if allBranches is None: allBranches = [b.GetName() for b in tree.GetListOfBranches()]
+            names.update(fnmatch.filter(allBranches, pattern))
+        else:
+            names.add(pattern)
+    wasClean = tree._ttreereader._isClean
+    for branchName in sorted(names):
+        if branchName in tree._ttras or branchName in tree._ttrvs: continue
+        branch = tree.GetBranch(branchName)
+        if not branch: continue
+        leaf = branch.GetLeaf(branchName)
+        if leaf.GetLen() == 1 and not bool(leaf.GetLeafCount()):
+            _makeValueReader(tree, leaf.GetTypeName(), branchName)
+        else:
+            _makeArrayReader(tree, leaf.GetTypeName(), branchName)
+    if not wasClean and tree._ttreereader._isClean:
+        tree.gotoEntry(tree.entry,forceCall=True) # readers were rebuilt, load the current entry again
+
+def readerStatistics(tree):
+    """Return a summary of the TTreeReader rebuilds caused by readers created after reading an entry, or None if there were none"""
+    if not tree._readerRebuilds: return None
+    return "%d TTreeReader rebuilds, %d of them after the first entry (for %s): declare these branches with inputBranches or tree.declareBranches in beginFile" % (
+            tree._readerRebuilds, len(tree._lateReaders), ", ".join(tree._lateReaders) if tree._lateReaders else "none")
+
 def clearExtraBranches(tree):
     tree._extrabranches = {}
 
@@ -53,7 +96,8 @@ def readBranch(tree, branchName):
     if tree._ttreereader._isClean: raise RuntimeError, "readBranch must not be called before calling gotoEntry"
     if branchName in tree._extrabranches:
         return tree._extrabranches[branchName]
-    elif branchName in tree._ttras:
+    if tree._branchTracer: tree._branchTracer.record(branchName)
+    if branchName in tree._ttras:
         return tree._ttras[branchName]
     elif branchName in tree._ttrvs: 
         ret = tree._ttrvs[branchName].Get()[0]
@@ -78,20 +122,25 @@ def readBranch(tree, branchName):
 ####### PRIVATE IMPLEMENTATION PART #######
 
 def _makeArrayReader(tree, typ, nam):
-    if not tree._ttreereader._isClean: _remakeAllReaders(tree)
+    if not tree._ttreereader._isClean: _remakeAllReaders(tree, nam)
     ttra = ROOT.TTreeReaderArray(typ)(tree._ttreereader, nam)
     tree._leafTypes[nam] = typ
     tree._ttras[nam] = ttra;
     return tree._ttras[nam]
 
 def _makeValueReader(tree, typ, nam):
-    if not tree._ttreereader._isClean: _remakeAllReaders(tree)
+    if not tree._ttreereader._isClean: _remakeAllReaders(tree, nam)
     ttrv = ROOT.TTreeReaderValue(typ)(tree._ttreereader, nam)
     tree._leafTypes[nam] = typ
     tree._ttrvs[nam] = ttrv
     return tree._ttrvs[nam]
 
-def _remakeAllReaders(tree):
+def _remakeAllReaders(tree, nam=None):
+    tree._readerRebuilds += 1
+    if tree.entry != tree._firstEntry and nam is not None:
+        if not tree._lateReaders:
+            print "Warning: reader for branch %s created at entry %d, all the readers of the tree are rebuilt" % (nam, tree.entry)
+        tree._lateReaders.append(nam)
     _ttreereader = ROOT.TTreeReader(tree, getattr(tree, '_entrylist', None))
     _ttreereader._isClean = True
     _ttrvs = {}
@@ -121,6 +170,7 @@ def _gotoEntry(tree, entry, forceCall=False):
         if (tree.entry == entry-1 and entry!=0):
             tree._ttreereader.Next()
         else:
+            if tree.entry < 0: tree._firstEntry = entry
             tree._ttreereader.SetEntry(entry)
         tree.entry = entry
 
@@ -3,10 +3,16 @@ import ROOT
 import numpy
 import sys
 
-if len(sys.argv) < 3 :
-	print "Syntax: haddnano.py out.root input1.root input2.root ..."
-ofname=sys.argv[1]
-files=sys.argv[2:]
+args=sys.argv[1:]
+compression=None
+if len(args) > 1 and args[0] == "-z" :
+	compression=args[1]
+	args=args[2:]
+if len(args) < 2 :
+	print "Syntax: haddnano.py [-z (algo):(level)] out.root input1.root input2.root ..."
+	print "        algo is one of LZMA, ZLIB, LZ4, ZSTD; by default the compression of the inputs is kept"
+ofname=args[0]
+files=args[1:]
 
 def zeroFill(tree,brName,brObj,allowNonBool=False) :
 	# typename: (numpy type code, root type code)
@@ -30,8 +36,16 @@ for fn in files :
     if fileHandles[-1].GetCompressionSettings() != fileHandles[0].GetCompressionSettings() :
 	goFast=False
 	print "Disabling fast merging as inputs have different compressions"
+if compression is not None :
+	from PhysicsTools.NanoAODTools.postprocessing.framework.compression import compressionSettings
+	settings=compressionSettings(compression)
+	if goFast and fileHandles[0].GetCompressionSettings() != settings :
+		goFast=False
+		print "Disabling fast merging as inputs are not compressed with",compression
 of=ROOT.TFile(ofname,"recreate")
-if goFast :
+if compression is not None :
+	of.SetCompressionSettings(settings)
+elif goFast :
 	of.SetCompressionSettings(fileHandles[0].GetCompressionSettings())
 of.cd()
 
@@ -19,11 +19,33 @@ if __name__ == "__main__":
     parser.add_option("--noout",  dest="noOut", action="store_true",  default=False, help="Do not produce output, just run modules")
     parser.add_option("-P", "--prefetch",  dest="prefetch", action="store_true",  default=False, help="Prefetch input files locally instead of accessing them via xrootd")
     parser.add_option("--long-term-cache",  dest="longTermCache", action="store_true",  default=False, help="Keep prefetched files across runs instead of deleting them at the end")
+    parser.add_option("--staging-dir",  dest="stagingDir", type="string", default=None, help="Directory where the prefetched files are stored (default: $TMPDIR/nanoAOD-cache-<uid>)")
+    parser.add_option("--staging-max-size",  dest="stagingMaxSize", type="float", default=None, help="Maximum size in GB of the long term cache: the least recently used files are removed to stay below it")
     parser.add_option("-N", "--max-entries", dest="maxEntries", type="long",  default=None, help="Maximum number of entries to process from any single given input tree")
     parser.add_option("--first-entry", dest="firstEntry", type="long",  default=0, help="First entry to process in the three (to be used together with --max-entries)")
     parser.add_option("--justcount",   dest="justcount", default=False, action="store_true",  help="Just report the number of selected events") 
     parser.add_option("-I", "--import", dest="imports",  type="string", default=[], action="append", nargs=2, help="Import modules (python package, comma-separated list of ");
-    parser.add_option("-z", "--compression",  dest="compression", type="string", default=("LZMA:9"), help="Compression: none, or (algo):(level) ")
+    parser.add_option("--chunk-size", dest="chunkSize", type="int", default=None, help="Process the input in chunks of (at least) this many entries, reading branches in bulk; modules implementing analyzeChunk run vectorized")
+    parser.add_option("-j", "--jobs", dest="nWorkers", type="int", default=1, help="Number of worker processes used to process the input files in parallel")
+    parser.add_option("--trace-branches", dest="traceBranches", type="string", default=None, help="Record the branches read by the modules in the first entries of each file, and write the input branch selection keeping only those to this file (plus the branches read by each module to <name>_modules.json). The outputs of these entries are written with a _Trace postfix")
+    parser.add_option("--trace-events", dest="traceEvents", type="int", default=1000, help="Number of entries per file to process when tracing the branches read")
+    parser.add_option("--module-timing", dest="moduleTiming", action="store_true", default=False, help="Record wall/CPU time, calls and accept rate of each module, and write them to moduleTiming.json in the output directory (and to the histogram file, if any)")
+    parser.add_option("--async-output", dest="asyncOutput", action="store_true", default=False, help="Fill and compress the output tree in a writer thread, in parallel to the event loop")
+    parser.add_option("--cache-size", dest="cacheSize", type="long", default=None, help="Size in bytes of the TTreeCache of the input tree (0 disables it), trained with the active branches")
+    parser.add_option("--cache-learn-entries", dest="cacheLearnEntries", type="int", default=None, help="Let the TTreeCache learn the branches to cache in this many entries, instead of training it with all the active branches")
+    parser.add_option("--preskim-cache", dest="preSkimCacheDir", type="string", default=None, help="Directory where the entries selected by the cut and JSON are cached, to skip the preselection when the same file is processed again with the same cut and JSON")
+    parser.add_option("--preskim-cache-max-size", dest="preSkimCacheMaxSize", type="float", default=None, help="Maximum size in MB of the preselection cache: the least recently used entries are removed to stay below it")
+    parser.add_option("--preskim-engine", dest="preSkimEngine", type="string", default="draw", help="Engine evaluating the cut: draw (TTree::Draw), or rdf[:nThreads] (multithreaded RDataFrame, falling back to draw for cuts it can not evaluate like TTree::Draw)")
+    parser.add_option("--module-cache", dest="moduleCacheDir", type="string", default=None, help="Directory where the output branches of the cacheable modules are kept, to be reused by later jobs on the same inputs as long as the modules up to them are unchanged")
+    parser.add_option("--module-cache-max-size", dest="moduleCacheMaxSize", type="float", default=None, help="Maximum size in MB of the module output cache: the least recently used files are removed to stay below it")
+    parser.add_option("--schedule", dest="schedule", action="store_true", default=False, help="Order the modules along the inputs and outputs they declare: skip duplicate modules and run the skims as early as possible")
+    parser.add_option("--lazy", dest="lazy", action="store_true", default=False, help="Run the modules declaring what they consume and produce only for the entries where their products are read, or their branches written")
+    parser.add_option("--metrics-file", dest="metricsFile", type="string", default=None, help="Write the job metrics (entries processed and accepted, time per module, memory, bytes read and written, current file) to this file in the Prometheus text format, every --metrics-interval seconds")
+    parser.add_option("--metrics-port", dest="metricsPort", type="int", default=None, help="Serve the job metrics in the Prometheus text format at http://localhost:PORT/metrics")
+    parser.add_option("--metrics-interval", dest="metricsInterval", type="float", default=10, help="Seconds between the writes of --metrics-file")
+    parser.add_option("--checkpoint", dest="checkpoint", action="store_true", default=False, help="Record the completed files in outputDir/checkpoint.json, and skip them when the same job is run again after being interrupted (with a histogram file, the modules writing histograms must implement checkpointState)")
+    parser.add_option("--pushdown-skims", dest="pushdownSkims", action="store_true", default=False, help="Apply the skims at the start of the module chain that only cut on input branches (rawSelection) in the preselection, instead of the event loop")
+    parser.add_option("-z", "--compression",  dest="compression", type="string", default=("LZMA:9"), help="Compression: none, (algo):(level) with algo one of LZMA, ZLIB, LZ4, ZSTD, or auto[:mbps=X][:ratio=Y] to pick the setting by profiling a sample of the input (most compact one writing at least X MB/s, or fastest one with compression ratio at least Y)")
 
     (options, args) = parser.parse_args()
 
@@ -67,8 +89,30 @@ if __name__ == "__main__":
             justcount = options.justcount,
             prefetch = options.prefetch,
             longTermCache = options.longTermCache,
+            stagingDir = options.stagingDir,
+            stagingMaxSize = int(options.stagingMaxSize*1e9) if options.stagingMaxSize else None,
             maxEntries = options.maxEntries,
             firstEntry = options.firstEntry,
-            outputbranchsel = options.branchsel_out)
+            outputbranchsel = options.branchsel_out,
+            chunkSize = options.chunkSize,
+            nWorkers = options.nWorkers,
+            traceBranches = options.traceBranches,
+            traceEvents = options.traceEvents,
+            moduleTiming = options.moduleTiming,
+            asyncOutput = options.asyncOutput,
+            cacheSize = options.cacheSize,
+            cacheLearnEntries = options.cacheLearnEntries,
+            preSkimCacheDir = options.preSkimCacheDir,
+            preSkimCacheMaxSize = int(options.preSkimCacheMaxSize*1e6) if options.preSkimCacheMaxSize else None,
+            preSkimEngine = options.preSkimEngine,
+            pushdownSkims = options.pushdownSkims,
+            checkpoint = options.checkpoint,
+            moduleCacheDir = options.moduleCacheDir,
+            moduleCacheMaxSize = int(options.moduleCacheMaxSize*1e6) if options.moduleCacheMaxSize else None,
+            schedule = options.schedule,
+            lazy = options.lazy,
+            metricsFile = options.metricsFile,
+            metricsPort = options.metricsPort,
+            metricsInterval = options.metricsInterval)
     p.run()
 
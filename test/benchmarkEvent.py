@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# Micro-benchmark of Event attribute access on a synthetic NanoAOD-like file:
+# a new Event per entry reading every value through readBranch (as before),
+# versus a reused Event with the per-entry scalar cache. All the loops run the same analyze.
+import os
+import sys
+import time
+import random
+import tempfile
+from array import array
+import ROOT
+ROOT.PyConfig.IgnoreCommandLineOptions = True
+from PhysicsTools.NanoAODTools.postprocessing.framework.datamodel import Event, Collection
+from PhysicsTools.NanoAODTools.postprocessing.framework.treeReaderArrayTools import InputTree, clearExtraBranches
+
+nEntries = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+nReads = 20 # accesses of each scalar per event, as done by different modules
+scalars = ["run", "luminosityBlock", "nJet", "fixedGridRhoFastjetAll", "Pileup_nTrueInt", "Flag_goodVertices", "Flag_METFilters"]
+
+def makeFile(fileName):
+    f = ROOT.TFile.Open(fileName, "RECREATE")
+    t = ROOT.TTree("Events", "Events")
+    run = array('I', [1]); lumi = array('I', [0]); nJet = array('i', [0])
+    rho = array('f', [0.]); nTrue = array('f', [0.])
+    goodVertices = array('b', [1]); metFilters = array('b', [1])
+    jetPt = array('f', [0.]*20)
+    t.Branch("run", run, "run/i")
+    t.Branch("luminosityBlock", lumi, "luminosityBlock/i")
+    t.Branch("nJet", nJet, "nJet/I")
+    t.Branch("Jet_pt", jetPt, "Jet_pt[nJet]/F")
+    t.Branch("fixedGridRhoFastjetAll", rho, "fixedGridRhoFastjetAll/F")
+    t.Branch("Pileup_nTrueInt", nTrue, "Pileup_nTrueInt/F")
+    t.Branch("Flag_goodVertices", goodVertices, "Flag_goodVertices/O")
+    t.Branch("Flag_METFilters", metFilters, "Flag_METFilters/O")
+    for i in xrange(nEntries):
+        lumi[0] = i/1000
+        nJet[0] = random.randint(0, 20)
+        for j in xrange(nJet[0]): jetPt[j] = random.expovariate(1/30.)
+        rho[0] = random.gauss(20, 5)
+        nTrue[0] = random.gauss(30, 10)
+        goodVertices[0] = random.random() > 0.01
+        metFilters[0] = random.random() > 0.02
+        t.Fill()
+    t.Write()
+    f.Close()
+
+def analyze(event):
+    tot = 0.
+    for k in xrange(nReads):
+        for name in scalars:
+            tot += getattr(event, name)
+        for jet in Collection(event, "Jet"):
+            tot += jet.pt
+    return tot
+
+class UncachedEvent(Event):
+    """Event as it was before the scalar cache: every attribute access goes through readBranch"""
+    def __getattr__(self, name):
+        if name in self.__dict__: return self.__dict__[name]
+        return self._tree.readBranch(name)
+
+def loopUncached(tree):
+    for i in xrange(tree.entries):
+        e = UncachedEvent(tree, i)
+        clearExtraBranches(tree)
+        analyze(e)
+
+def loopCached(tree):
+    e = None
+    for i in xrange(tree.entries):
+        if e is None: e = Event(tree, i)
+        else: e.reset(i)
+        clearExtraBranches(tree)
+        analyze(e)
+
+def loopNewEvent(tree):
+    for i in xrange(tree.entries):
+        e = Event(tree, i)
+        clearExtraBranches(tree)
+        analyze(e)
+
+def timeLoop(fileName, loop):
+    f = ROOT.TFile.Open(fileName)
+    tree = InputTree(f.Get("Events"))
+    loop(tree) # warm up: create the readers and fill the file cache
+    t0 = time.time()
+    loop(tree)
+    dt = time.time() - t0
+    f.Close()
+    return dt
+
+if __name__ == "__main__":
+    fileName = os.path.join(tempfile.mkdtemp(), "benchmarkEvent.root")
+    makeFile(fileName)
+    results = [(name, timeLoop(fileName, loop)) for (name, loop) in [("readBranch on every access", loopUncached), ("new Event per entry", loopNewEvent), ("reused Event", loopCached)]]
+    reference = results[0][1]
+    print "%d entries, %d scalar reads per entry" % (nEntries, nReads*len(scalars))
+    for name, dt in results:
+        print "%-28s %7.2f s  %8.1f kHz  speedup %5.2f" % (name, dt, nEntries/1000./dt, reference/dt)
+    os.remove(fileName)
+    os.rmdir(os.path.dirname(fileName))
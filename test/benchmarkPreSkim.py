@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# Benchmark of the preselection engines on a synthetic NanoAOD-like file with many clusters:
+# TTree::Draw versus a multithreaded RDataFrame Filter, checking that both select the same entries,
+# also on cuts that RDataFrame must leave to TTree::Draw (unguarded array elements, integer divisions, arithmetic
+# on the unsigned counters).
+import os
+import sys
+import time
+import random
+import tempfile
+from array import array
+import ROOT
+ROOT.PyConfig.IgnoreCommandLineOptions = True
+from PhysicsTools.NanoAODTools.postprocessing.framework.preskimming import preSkim
+from PhysicsTools.NanoAODTools.postprocessing.framework.columns import entryListToArray
+
+nEntries = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+nThreads = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+cut = "nMuon >= 1 && (HLT_IsoMu24 || HLT_IsoMu27) && Flag_goodVertices && MET_pt > 20"
+checkCuts = ["Muon_pt[0] > 25 && abs(Muon_eta[0]) < 2.4 && MET_pt > 20", "!(Muon_pt[1] > 10) || MET_pt > 50", "nMuon/3 > 0.5", "nMuon-1 >= 0 && MET_pt > 20", "-nMuon > -2"]
+
+def makeFile(fileName):
+    f = ROOT.TFile.Open(fileName, "RECREATE")
+    t = ROOT.TTree("Events", "Events")
+    t.SetAutoFlush(5000) # many clusters, to be processed in parallel
+    nMuon = array('I', [0]); muonPt = array('f', [0.]*10); muonEta = array('f', [0.]*10)
+    isoMu24 = array('b', [0]); isoMu27 = array('b', [0]); goodVertices = array('b', [1])
+    metPt = array('f', [0.])
+    t.Branch("nMuon", nMuon, "nMuon/i")
+    t.Branch("Muon_pt", muonPt, "Muon_pt[nMuon]/F")
+    t.Branch("Muon_eta", muonEta, "Muon_eta[nMuon]/F")
+    t.Branch("HLT_IsoMu24", isoMu24, "HLT_IsoMu24/O")
+    t.Branch("HLT_IsoMu27", isoMu27, "HLT_IsoMu27/O")
+    t.Branch("Flag_goodVertices", goodVertices, "Flag_goodVertices/O")
+    t.Branch("MET_pt", metPt, "MET_pt/F")
+    for i in xrange(nEntries):
+        nMuon[0] = random.randint(0, 4)
+        for j in xrange(nMuon[0]):
+            muonPt[j] = random.expovariate(1/20.); muonEta[j] = random.uniform(-3, 3)
+        isoMu24[0] = random.random() < 0.3; isoMu27[0] = random.random() < 0.2
+        goodVertices[0] = random.random() > 0.01
+        metPt[0] = random.expovariate(1/30.)
+        t.Fill()
+    t.Write()
+    f.Close()
+
+def timePreSkim(fileName, engine, firstEntry=0, maxEntries=None, cut=cut):
+    f = ROOT.TFile.Open(fileName)
+    tree = f.Get("Events")
+    t0 = time.time()
+    elist, jsonFilter = preSkim(tree, cutstring=cut, maxEntries=maxEntries, firstEntry=firstEntry, engine=engine)
+    dt = time.time() - t0
+    entries = entryListToArray(tree, elist)
+    f.Close()
+    return dt, entries
+
+if __name__ == "__main__":
+    fileName = os.path.join(tempfile.mkdtemp(), "benchmarkPreSkim.root")
+    makeFile(fileName)
+    engines = ["draw", "rdf:%d" % nThreads]
+    timePreSkim(fileName, "draw") # warm up the file cache
+    results = [(engine,) + timePreSkim(fileName, engine) for engine in engines]
+    print "%d entries, cut: %s" % (nEntries, cut)
+    reference = results[0]
+    for engine, dt, entries in results:
+        same = len(entries) == len(reference[2]) and (entries == reference[2]).all()
+        print "%-8s %7.2f s  %8d entries selected  speedup %5.2f  %s" % (engine, dt, len(entries), reference[1]/dt, "same entries" if same else "DIFFERENT ENTRIES")
+    # an entry range, as processed by a shard
+    (dtDraw, drawEntries), (dtRdf, rdfEntries) = [timePreSkim(fileName, engine, nEntries/3, nEntries/4) for engine in engines]
+    print "entry range: %s" % ("same entries" if len(drawEntries) == len(rdfEntries) and (drawEntries == rdfEntries).all() else "DIFFERENT ENTRIES")
+    for checkCut in checkCuts:
+        (dtDraw, drawEntries), (dtRdf, rdfEntries) = [timePreSkim(fileName, engine, cut=checkCut) for engine in engines]
+        print "%s: %s" % (checkCut, "same entries" if len(drawEntries) == len(rdfEntries) and (drawEntries == rdfEntries).all() else "DIFFERENT ENTRIES")
+    os.remove(fileName)
+    os.rmdir(os.path.dirname(fileName))
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# Check that the chunked event loop writes the same output as eventLoop on a synthetic NanoAOD-like file,
+# with a legacy producer, a vectorized EventSkim (selection_expr) and a legacy EventSkim.
+import os
+import sys
+import random
+import shutil
+import tempfile
+from array import array
+import ROOT
+ROOT.PyConfig.IgnoreCommandLineOptions = True
+from PhysicsTools.NanoAODTools.postprocessing.framework.postprocessor import PostProcessor
+from PhysicsTools.NanoAODTools.postprocessing.framework.datamodel import Collection
+from PhysicsTools.NanoAODTools.postprocessing.framework.eventloop import Module
+from PhysicsTools.NanoAODTools.modules.EventSkim import EventSkim
+
+nEntries = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+class GoodJetProducer(Module):
+    def beginFile(self, inputFile, outputFile, inputTree, wrappedOutputTree):
+        self.out = wrappedOutputTree
+        self.out.branch("GoodJet_pt", "F", lenVar="nGoodJet")
+        self.out.branch("HT", "F")
+    def analyze(self, event):
+        jets = [jet for jet in Collection(event, "Jet") if jet.pt > 25 and abs(jet.eta) < 2.4]
+        self.out.fillBranch("GoodJet_pt", [jet.pt for jet in jets])
+        self.out.fillBranch("HT", sum(jet.pt for jet in jets))
+        return True
+
+def makeFile(fileName):
+    f = ROOT.TFile.Open(fileName, "RECREATE")
+    t = ROOT.TTree("Events", "Events")
+    t.SetAutoFlush(3000) # several clusters per chunk
+    event = array('L', [0]); nJet = array('i', [0]); jetPt = array('f', [0.]*10); jetEta = array('f', [0.]*10)
+    metPt = array('f', [0.])
+    t.Branch("event", event, "event/l")
+    t.Branch("nJet", nJet, "nJet/I")
+    t.Branch("Jet_pt", jetPt, "Jet_pt[nJet]/F")
+    t.Branch("Jet_eta", jetEta, "Jet_eta[nJet]/F")
+    t.Branch("MET_pt", metPt, "MET_pt/F")
+    for i in xrange(nEntries):
+        event[0] = i
+        nJet[0] = random.randint(0, 6)
+        for j in xrange(nJet[0]):
+            jetPt[j] = random.expovariate(1/30.); jetEta[j] = random.uniform(-4, 4)
+        metPt[0] = random.expovariate(1/30.)
+        t.Fill()
+    t.Write()
+    f.Close()
+
+def readTree(fileName):
+    """Values of all the leaves of the Events tree, entry by entry"""
+    f = ROOT.TFile.Open(fileName)
+    t = f.Get("Events")
+    leaves = sorted(leaf.GetName() for leaf in t.GetListOfLeaves())
+    rows = []
+    for i in xrange(t.GetEntries()):
+        t.GetEntry(i)
+        rows.append(dict((name, tuple(t.GetLeaf(name).GetValue(k) for k in xrange(t.GetLeaf(name).GetLen()))) for name in leaves))
+    f.Close()
+    return leaves, rows
+
+def run(fileName, outputDir, chunkSize):
+    modules = [EventSkim(selection_expr="MET_pt > 20 || Sum$(Jet_pt > 40) >= 2"), GoodJetProducer(), EventSkim(selection=lambda event: event.HT > 50)]
+    PostProcessor(outputDir, [fileName], modules=modules, chunkSize=chunkSize).run()
+    return readTree(os.path.join(outputDir, os.path.basename(fileName).replace(".root", "_Skim.root")))
+
+if __name__ == "__main__":
+    workDir = tempfile.mkdtemp()
+    fileName = os.path.join(workDir, "checkChunkLoop.root")
+    makeFile(fileName)
+    reference = run(fileName, os.path.join(workDir, "eventLoop"), None)
+    failed = False
+    for chunkSize in (1000, 10000):
+        result = run(fileName, os.path.join(workDir, "chunk%d" % chunkSize), chunkSize)
+        if result[0] != reference[0]:
+            print "chunkSize %d: different branches %s" % (chunkSize, sorted(set(result[0]) ^ set(reference[0])))
+            failed = True
+        elif result[1] != reference[1]:
+            print "chunkSize %d: different values (%d entries instead of %d)" % (chunkSize, len(result[1]), len(reference[1]))
+            failed = True
+        else:
+            print "chunkSize %d: same %d entries as eventLoop" % (chunkSize, len(result[1]))
+    shutil.rmtree(workDir)
+    sys.exit(1 if failed else 0)
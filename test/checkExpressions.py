@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# Check that the numpy expressions select the same entries as TTree::Draw, on a synthetic file with empty and
+# short arrays: out-of-range indexes, Alt$, specials, indexing by an array of indexes, cuts on stored float values
+# (compared in double precision) and integer modulo.
+import os
+import sys
+import random
+import shutil
+import tempfile
+from array import array
+import numpy
+import ROOT
+ROOT.PyConfig.IgnoreCommandLineOptions = True
+from PhysicsTools.NanoAODTools.postprocessing.framework.expressions import compileExpression
+from PhysicsTools.NanoAODTools.postprocessing.framework.columns import readColumn, entryListToArray
+
+nEntries = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+expressions = [
+    "Jet_pt[1] > 30", "!(Jet_pt[1] > 30)", "Jet_pt[1] != 20", "nJet == 0 || Jet_pt[1] > 30", "Jet_pt[nJet-1] > 30",
+    "Alt$(Jet_pt[1], 0) > 10", "Alt$(Jet_pt[2], MET_pt) > 40", "Jet_pt > 30", "nJet == 0 || Jet_pt > 30",
+    "Sum$(Jet_pt > 30) >= 1", "Max$(Jet_pt) > 60 || MET_pt > 50", "Length$(Jet_pt) == 2",
+    "Jet_pt[Muon_jetIdx] > 20", "Sum$(Jet_pt[Muon_jetIdx] > 20) == 0", "MET_pt > 20 && Jet_pt[0] > Jet_pt[1]*2",
+    "(nJet > 1 ? Jet_pt[1] : MET_pt) > 25",
+    "MET_pt > 25.1", "MET_pt <= 25.1", "Jet_pt > 30.7", "Jet_pt[0] == 30.7",
+    "nJet % 2.5 == 1", "MET_pt % 7 > 3", "7 % 2.5 == 1",
+]
+
+def makeFile(fileName):
+    f = ROOT.TFile.Open(fileName, "RECREATE")
+    t = ROOT.TTree("Events", "Events")
+    nJet = array('i', [0]); jetPt = array('f', [0.]*10)
+    nMuon = array('i', [0]); muonJetIdx = array('i', [0]*10)
+    metPt = array('f', [0.])
+    t.Branch("nJet", nJet, "nJet/I")
+    t.Branch("Jet_pt", jetPt, "Jet_pt[nJet]/F")
+    t.Branch("nMuon", nMuon, "nMuon/I")
+    t.Branch("Muon_jetIdx", muonJetIdx, "Muon_jetIdx[nMuon]/I")
+    t.Branch("MET_pt", metPt, "MET_pt/F")
+    for i in xrange(nEntries):
+        nJet[0] = random.choice([0, 0, 1, 1, 2, 3, 5]) # many empty and short arrays
+        for j in xrange(nJet[0]): jetPt[j] = random.choice([30.7, random.expovariate(1/30.)]) # values on the cuts
+        nMuon[0] = random.randint(0, 3)
+        for j in xrange(nMuon[0]): muonJetIdx[j] = random.randint(-1, 3) # -1 or beyond nJet: no jet
+        metPt[0] = random.choice([25.1, random.expovariate(1/30.)])
+        t.Fill()
+    t.Write()
+    f.Close()
+
+def drawSelection(tree, expr):
+    tree.Draw(">>elist", expr, "entrylist")
+    return entryListToArray(tree, ROOT.gDirectory.Get("elist"))
+
+def numpySelection(tree, expr):
+    compiled = compileExpression(expr)
+    entries = numpy.arange(tree.GetEntries(), dtype='i8')
+    columns = dict((name, readColumn(tree, name, entries)) for name in compiled.branches)
+    return numpy.flatnonzero(compiled.select(columns.__getitem__, len(entries)))
+
+if __name__ == "__main__":
+    workDir = tempfile.mkdtemp()
+    fileName = os.path.join(workDir, "checkExpressions.root")
+    makeFile(fileName)
+    f = ROOT.TFile.Open(fileName)
+    tree = f.Get("Events")
+    failed = False
+    for expr in expressions:
+        reference = drawSelection(tree, expr)
+        result = numpySelection(tree, expr)
+        if len(result) == len(reference) and (result == reference).all():
+            print "%-50s same %d entries as TTree::Draw" % (expr, len(result))
+        else:
+            print "%-50s %d entries instead of %d, e.g. %s" % (expr, len(result), len(reference), sorted(set(result) ^ set(reference))[:5])
+            failed = True
+    f.Close()
+    shutil.rmtree(workDir)
+    sys.exit(1 if failed else 0)
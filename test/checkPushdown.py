@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# Check that pushing EventSkim(selection_expr=...) into the preselection (pushdownSkims) selects the same entries
+# as running it in the event loop, on stored values lying exactly on the cuts.
+import os
+import sys
+import random
+import shutil
+import tempfile
+from array import array
+import ROOT
+ROOT.PyConfig.IgnoreCommandLineOptions = True
+from PhysicsTools.NanoAODTools.postprocessing.framework.postprocessor import PostProcessor
+from PhysicsTools.NanoAODTools.modules.EventSkim import EventSkim
+
+nEntries = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+selections = ["MET_pt > 25.1", "MET_pt >= 25.1 && Jet_btag[0] > 0.3093", "Sum$(Jet_btag > 0.3093) >= 1 || MET_pt < 25.1",
+              "nJet >= 1 && Jet_btag[0] <= 0.3093", "!(Jet_btag[1] > 0.3093)"]
+
+def makeFile(fileName):
+    f = ROOT.TFile.Open(fileName, "RECREATE")
+    t = ROOT.TTree("Events", "Events")
+    event = array('L', [0]); nJet = array('i', [0]); jetBtag = array('f', [0.]*10)
+    metPt = array('f', [0.])
+    t.Branch("event", event, "event/l")
+    t.Branch("nJet", nJet, "nJet/I")
+    t.Branch("Jet_btag", jetBtag, "Jet_btag[nJet]/F")
+    t.Branch("MET_pt", metPt, "MET_pt/F")
+    for i in xrange(nEntries):
+        event[0] = i
+        nJet[0] = random.randint(0, 4)
+        for j in xrange(nJet[0]): jetBtag[j] = random.choice([0.3093, random.random()]) # values on the cuts
+        metPt[0] = random.choice([25.1, random.expovariate(1/30.)])
+        t.Fill()
+    t.Write()
+    f.Close()
+
+def selectedEvents(fileName):
+    f = ROOT.TFile.Open(fileName)
+    t = f.Get("Events")
+    events = []
+    for i in xrange(t.GetEntries()):
+        t.GetEntry(i)
+        events.append(t.event)
+    f.Close()
+    return events
+
+def run(fileName, outputDir, selection, pushdownSkims):
+    PostProcessor(outputDir, [fileName], modules=[EventSkim(selection_expr=selection)], pushdownSkims=pushdownSkims).run()
+    return selectedEvents(os.path.join(outputDir, os.path.basename(fileName).replace(".root", "_Skim.root")))
+
+if __name__ == "__main__":
+    workDir = tempfile.mkdtemp()
+    fileName = os.path.join(workDir, "checkPushdown.root")
+    makeFile(fileName)
+    failed = False
+    for selection in selections:
+        reference = run(fileName, os.path.join(workDir, "loop"), selection, False)
+        result = run(fileName, os.path.join(workDir, "pushed"), selection, True)
+        if result == reference:
+            print "%-50s same %d entries when pushed down" % (selection, len(result))
+        else:
+            print "%-50s %d entries when pushed down instead of %d" % (selection, len(result), len(reference))
+            failed = True
+    shutil.rmtree(workDir)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# Check that splitting an input file into entry ranges processed in parallel (and processing a single
+# entry range) writes the same entries as a serial job, with a cut, with and without modules.
+import os
+import sys
+import random
+import shutil
+import tempfile
+from array import array
+import ROOT
+ROOT.PyConfig.IgnoreCommandLineOptions = True
+from PhysicsTools.NanoAODTools.postprocessing.framework.postprocessor import PostProcessor
+from PhysicsTools.NanoAODTools.modules.EventSkim import EventSkim
+
+nEntries = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+cut = "MET_pt > 20 && nJet >= 1"
+
+def makeFile(fileName):
+    f = ROOT.TFile.Open(fileName, "RECREATE")
+    t = ROOT.TTree("Events", "Events")
+    t.SetAutoFlush(2000) # several clusters, to be split between the workers
+    event = array('L', [0]); nJet = array('i', [0]); jetPt = array('f', [0.]*10)
+    metPt = array('f', [0.])
+    t.Branch("event", event, "event/l")
+    t.Branch("nJet", nJet, "nJet/I")
+    t.Branch("Jet_pt", jetPt, "Jet_pt[nJet]/F")
+    t.Branch("MET_pt", metPt, "MET_pt/F")
+    for i in xrange(nEntries):
+        event[0] = i
+        nJet[0] = random.randint(0, 6)
+        for j in xrange(nJet[0]): jetPt[j] = random.expovariate(1/30.)
+        metPt[0] = random.expovariate(1/30.)
+        t.Fill()
+    t.Write()
+    f.Close()
+
+def readEvents(fileName):
+    """event number and MET of the entries of the Events tree"""
+    f = ROOT.TFile.Open(fileName)
+    t = f.Get("Events")
+    rows = []
+    for i in xrange(t.GetEntries()):
+        t.GetEntry(i)
+        rows.append((t.event, t.MET_pt))
+    f.Close()
+    return rows
+
+def run(fileName, outputDir, **kwargs):
+    PostProcessor(outputDir, [fileName], cut=cut, **kwargs).run()
+    return readEvents(os.path.join(outputDir, os.path.basename(fileName).replace(".root", "_Skim.root")))
+
+def compare(name, result, reference):
+    if result == reference:
+        print "%-40s same %d entries" % (name, len(result))
+        return True
+    print "%-40s %d entries instead of %d, %d different" % (name, len(result), len(reference), len(set(result) ^ set(reference)))
+    return False
+
+if __name__ == "__main__":
+    workDir = tempfile.mkdtemp()
+    fileName = os.path.join(workDir, "checkSharding.root")
+    makeFile(fileName)
+    ok = True
+    skim = lambda: [EventSkim(selection=lambda event: event.nJet >= 2)]
+    for (name, modules) in [("no modules", lambda: []), ("with a module", skim)]:
+        reference = run(fileName, os.path.join(workDir, "serial"), modules=modules())
+        ok &= compare("%s, 3 workers" % name, run(fileName, os.path.join(workDir, "parallel"), modules=modules(), nWorkers=3), reference)
+        (firstEntry, maxEntries) = (nEntries/3, nEntries/4)
+        inRange = [row for row in reference if firstEntry <= row[0] < firstEntry + maxEntries]
+        ok &= compare("%s, entry range" % name, run(fileName, os.path.join(workDir, "range"), modules=modules(), firstEntry=firstEntry, maxEntries=maxEntries), inRange)
+    shutil.rmtree(workDir)
+    sys.exit(0 if ok else 1)